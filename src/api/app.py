@@ -1,20 +1,31 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, UploadFile, HTTPException, WebSocket, Header
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
 import uvicorn
 import numpy as np
 import cv2
-from PIL import Image
-import io
 import base64
 from datetime import datetime
 import logging
 import os
+import sys
+import shutil
+import time
+import threading
+from typing import List
 
 # Импортируем вашу модель
-from ensemble import FinalEnsemble
+import model_registry
+from inference_pool import InferencePool, PooledEnsemble, PoolOverloaded
+from batching import BatchScheduler
+from streaming import serve_frame_stream, decode_frame
+from result_cache import ResultCache, AnnotatedImageStore
+from ingest import decode_image, ImageRejected, MAX_UPLOAD_BYTES
+from batch_analysis import BatchJob, collect_sources
+from inference_server import RemoteEnsemble, describe_ensemble, server_key
+import metrics
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -36,17 +47,10 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 # Инициализация модели
 analyzer = None
 
-@app.on_event("startup")
-async def startup_event():
-    global analyzer
-    try:
-        print("🔄 Загрузка Ensemble моделей...")
-        analyzer = FinalEnsemble()
-        print("✅ Ensemble модели успешно загружены!")
-        print(f"📊 Загружено моделей: {len(analyzer.models)}")
-    except Exception as e:
-        print(f"❌ Ошибка загрузки моделей: {e}")
-        analyzer = None
+# PRELOAD_MODELS=1: загрузка при импорте, до fork воркеров (gunicorn --preload)
+# INFERENCE_SERVER=<сокет>: модели живут в отдельном процессе (inference_server.py), воркеры только принимают и декодируют
+if os.getenv('PRELOAD_MODELS', '0') == '1' and not os.getenv('INFERENCE_SERVER'):
+    model_registry.preload()
 
 class DefectAnalyzer:
     def __init__(self, ensemble_model):
@@ -59,85 +63,93 @@ class DefectAnalyzer:
         }
     
     def preprocess_image(self, image_data: bytes) -> np.ndarray:
-        """Предобработка изображения для модели"""
+        """Предобработка изображения для модели: BGR с учетом EXIF, как у cv2.imread"""
         try:
-            image = Image.open(io.BytesIO(image_data))
-            image_np = np.array(image)
-            
-            if image_np.shape[-1] == 4:
-                image_np = cv2.cvtColor(image_np, cv2.COLOR_RGBA2RGB)
-            elif len(image_np.shape) == 2:
-                image_np = cv2.cvtColor(image_np, cv2.COLOR_GRAY2RGB)
-            
+            image_np, _ = decode_image(image_data, reduce_to=0)
             return image_np
         except Exception as e:
             logger.error(f"Ошибка предобработки изображения: {e}")
             raise
     
-    def analyze_defects(self, image_np: np.ndarray) -> dict:
+    def analyze_defects(self, image_np: np.ndarray, conf_threshold: float = 0.25, tiled: bool = False,
+                        scale: float = 1.0) -> dict:
         """Анализ изображения на наличие дефектов"""
         try:
             if self.model is None:
                 raise Exception("Модель не загружена")
             
             logger.info("🎯 Запуск предсказания модели...")
-            result_img, detections = self.model.predict(image_np, conf_threshold=0.25)
+            with metrics.span('inference'):
+                if tiled:
+                    # Большие снимки: перекрывающиеся тайлы 640 без сжатия всего кадра
+                    detections = self.model.predict_tiled(image_np, conf_threshold=conf_threshold)
+                else:
+                    # predict_batch не рисует разметку: она нужна не каждому запросу
+                    detections = self.model.predict_batch([image_np], conf_threshold=conf_threshold)[0]
             logger.info(f"📊 Найдено детекций: {len(detections)}")
             
-            # Преобразуем детекции в нужный формат
-            formatted_defects = []
-            for i, det in enumerate(detections):
-                cls_id = int(det['cls'])
-                class_name_en = self.model.class_names[cls_id]
-                
-                defect_info = self.defect_mapping.get(class_name_en, {
-                    'name': class_name_en, 
-                    'criticality': 'Средний'
-                })
-                
-                x1, y1, x2, y2 = det['xyxy']
-                
-                defect_data = {
-                    'id': i + 1,
-                    'type': defect_info['name'],
-                    'type_en': class_name_en,
-                    'coordinates': {
-                        'x': int((x1 + x2) / 2),
-                        'y': int((y1 + y2) / 2)
-                    },
-                    'size': round(max(x2 - x1, y2 - y1), 1),
-                    'criticality': defect_info['criticality'],
-                    'confidence': float(det['conf']),
-                    'bbox': [int(x1), int(y1), int(x2), int(y2)],
-                    'model_source': det.get('model', 'ensemble')
-                }
-                formatted_defects.append(defect_data)
-                logger.info(f"   - {defect_info['name']}: {det['conf']:.3f}")
-            
-            # Сортируем дефекты по критичности
-            criticality_order = {'Критический': 0, 'Высокий': 1, 'Средний': 2, 'Низкий': 3}
-            formatted_defects.sort(key=lambda x: (
-                criticality_order[x['criticality']], 
-                -x['confidence']
-            ))
-            
-            critical_defects = len([d for d in formatted_defects if d['criticality'] in ['Критический', 'Высокий']])
-            
-            return {
-                'defects_found': len(formatted_defects),
-                'critical_defects': critical_defects,
-                'defects': formatted_defects,
-                'analysis_id': f"ANL_{datetime.now().strftime('%Y%m%d_%H%M%S')}",
-                'timestamp': datetime.now().isoformat(),
-                'model_used': 'FinalEnsemble'
-            }
+            with metrics.span('format'):
+                return self.format_detections(detections, scale)
             
         except Exception as e:
             logger.error(f"Ошибка анализа изображения: {e}")
             raise
     
-    def draw_defects_on_image(self, image_np: np.ndarray, defects: list) -> bytes:
-        """Отрисовка дефектов на изображении"""
+    def format_detections(self, detections: list, scale: float = 1.0) -> dict:
+        """Преобразование детекций ансамбля в ответ API; scale — масштаб к исходному снимку"""
+        # Преобразуем детекции в нужный формат
+        formatted_defects = []
+        for i, det in enumerate(detections):
+            cls_id = int(det['cls'])
+            class_name_en = self.model.class_names[cls_id]
+            
+            defect_info = self.defect_mapping.get(class_name_en, {
+                'name': class_name_en, 
+                'criticality': 'Средний'
+            })
+            
+            x1, y1, x2, y2 = det['xyxy'] * scale
+            
+            defect_data = {
+                'id': i + 1,
+                'type': defect_info['name'],
+                'type_en': class_name_en,
+                'coordinates': {
+                    'x': int((x1 + x2) / 2),
+                    'y': int((y1 + y2) / 2)
+                },
+                'size': round(float(max(x2 - x1, y2 - y1)), 1),
+                'criticality': defect_info['criticality'],
+                'confidence': float(det['conf']),
+                'bbox': [int(x1), int(y1), int(x2), int(y2)],
+                'model_source': det.get('model', 'ensemble')
+            }
+            if 'track_id' in det:
+                defect_data['track_id'] = int(det['track_id'])
+            formatted_defects.append(defect_data)
+            logger.info(f"   - {defect_info['name']}: {det['conf']:.3f}")
+        
+        # Сортируем дефекты по критичности
+        criticality_order = {'Критический': 0, 'Высокий': 1, 'Средний': 2, 'Низкий': 3}
+        formatted_defects.sort(key=lambda x: (
+            criticality_order[x['criticality']], 
+            -x['confidence']
+        ))
+        
+        critical_defects = len([d for d in formatted_defects if d['criticality'] in ['Критический', 'Высокий']])
+        
+        return {
+            'defects_found': len(formatted_defects),
+            'critical_defects': critical_defects,
+            'defects': formatted_defects,
+            'analysis_id': f"ANL_{datetime.now().strftime('%Y%m%d_%H%M%S')}",
+            'timestamp': datetime.now().isoformat(),
+            'model_used': 'FinalEnsemble',
+            'ensemble_path': getattr(detections, 'path', 'full')
+        }
+    
+    def render_defects(self, image_np: np.ndarray, defects: list, scale: float = 1.0) -> np.ndarray:
+        """Отрисовка дефектов на копии изображения; scale — во сколько раз кадр меньше исходного"""
         try:
             image_with_defects = image_np.copy()
             
@@ -150,7 +162,7 @@ class DefectAnalyzer:
             
             for defect in defects:
                 color = colors.get(defect['criticality'], (255, 255, 255))
-                bbox = defect['bbox']
+                bbox = [int(v / scale) for v in defect['bbox']]
                 
                 cv2.rectangle(
                     image_with_defects,
@@ -172,29 +184,346 @@ class DefectAnalyzer:
                     cv2.LINE_AA
                 )
             
-            _, buffer = cv2.imencode('.jpg', image_with_defects, [cv2.IMWRITE_JPEG_QUALITY, 85])
-            return base64.b64encode(buffer).decode('utf-8')
+            return image_with_defects
             
         except Exception as e:
             logger.error(f"Ошибка отрисовки дефектов: {e}")
             raise
+    
+    def encode_jpeg(self, image_np: np.ndarray, quality: int = 85) -> bytes:
+        """Кодирование изображения в JPEG"""
+        with metrics.span('encode'):
+            _, buffer = cv2.imencode('.jpg', image_np, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        return buffer.tobytes()
+    
+    def draw_defects_on_image(self, image_np: np.ndarray, defects: list) -> str:
+        """Отрисовка дефектов на изображении, результат — JPEG в base64"""
+        annotated = self.encode_jpeg(self.render_defects(image_np, defects))
+        return base64.b64encode(annotated).decode('utf-8')
 
 # Инициализация анализатора
 defect_analyzer = None
 
+# Пул для инференса вне event loop
+inference_pool = None
+
+# Micro-batching запросов перед ансамблем (BATCH_MAX_SIZE=1 — отключить)
+batch_scheduler = None
+
+def _make_defect_analyzer(ensemble):
+    """DefectAnalyzer поверх ансамбля, через планировщик батчей если он включен"""
+    global batch_scheduler
+    if isinstance(ensemble, RemoteEnsemble):
+        return DefectAnalyzer(ensemble)  # Батчи собирает сервер инференса из запросов всех воркеров
+    if int(os.getenv('BATCH_MAX_SIZE', 8)) > 1:
+        batch_scheduler = BatchScheduler(ensemble)
+        return DefectAnalyzer(batch_scheduler)
+    return DefectAnalyzer(ensemble)
+
+def _load_ensemble():
+    """Собственный ансамбль процесса или клиент общего сервера инференса"""
+    if os.getenv('INFERENCE_SERVER'):
+        return RemoteEnsemble()
+    return model_registry.get_ensemble()
+
+def _init_worker():
+    """Загрузка моделей в процессе пула (INFERENCE_POOL=process)"""
+    global analyzer, defect_analyzer
+    analyzer = _load_ensemble()
+    # Без планировщика батчей: процесс пула выполняет одну задачу за раз, батч всегда из одного
+    # кадра, а окно BATCH_WINDOW_MS было бы чистой задержкой. Общие батчи для нескольких
+    # процессов собирает сервер инференса (INFERENCE_SERVER)
+    defect_analyzer = DefectAnalyzer(analyzer)
+
+def _worker_info():
+    """Описание ансамбля процесса пула для родителя (PooledEnsemble)"""
+    info = describe_ensemble(analyzer)
+    info['cascade'] = {k: v for k, v in analyzer.cascade_stats().items() if k in ('enabled', 'first', 'band')}
+    return info
+
+def _worker_predict_batch(images, conf_threshold):
+    return defect_analyzer.model.predict_batch(images, conf_threshold)
+
+# Кэш результатов по содержимому изображения (повторные загрузки того же снимка);
+# только в процессе приложения — один на все процессы пула при INFERENCE_POOL=process
+result_cache = ResultCache()
+
+# Размеченные JPEG для GET /api/annotated/{image_id}
+annotated_store = AnnotatedImageStore()
+
+# Способы вернуть разметку: none — только координаты, base64 — в JSON, url — отдельным ресурсом
+ANNOTATE_MODES = ('none', 'base64', 'url')
+
+# Задания пакетного анализа: результаты пишутся в BATCH_OUTPUT_DIR/<job_id>
+batch_jobs = {}
+BATCH_OUTPUT_DIR = os.getenv('BATCH_OUTPUT_DIR', 'batch_results')
+# Каталоги и архивы на сервере принимаются только внутри этого корня
+BATCH_INPUT_ROOT = os.path.realpath(os.getenv('BATCH_INPUT_ROOT', 'dataset'))
+# Предел суммарного размера файлов одного запроса; загрузка сверх него прерывается с 413
+BATCH_MAX_UPLOAD_BYTES = int(float(os.getenv('BATCH_MAX_UPLOAD_MB', 2048)) * 1024**2)
+BATCH_RESULT_FILES = {'jsonl': ('results.jsonl', 'application/x-ndjson'),
+                      'csv': ('results.csv', 'text/csv'),
+                      'summary': ('summary.json', 'application/json')}
+
+def _infer_image_bytes(image_bytes: bytes, conf_threshold: float = 0.25, tiled: bool = False,
+                       cached_result: dict = None, draw: bool = False):
+    """Декодирование, анализ и (если draw) отрисовка — выполняется в пуле.
+    
+    cached_result — результат из кэша, когда нужна только разметка. Возвращает (результат, JPEG или None).
+    Кэши живут в процессе приложения: с INFERENCE_POOL=process у процессов пула были бы свои копии
+    со своим бюджетом памяти, а ссылки annotate=url вели бы в чужой процесс.
+    """
+    analysis_result, image_np = cached_result, None
+    if analysis_result is None:
+        # Для нарезки на тайлы нужно полное разрешение, иначе можно декодировать JPEG с уменьшением
+        with metrics.span('preprocess'):
+            image_np, scale = decode_image(image_bytes, reduce_to=0 if tiled else None)
+        analysis_result = defect_analyzer.analyze_defects(image_np, conf_threshold, tiled, scale)
+    
+    if not draw:
+        return analysis_result, None
+    
+    if image_np is None:
+        with metrics.span('preprocess'):
+            image_np, scale = decode_image(image_bytes)
+    with metrics.span('draw'):
+        rendered = defect_analyzer.render_defects(image_np, analysis_result['defects'], scale)
+    return analysis_result, defect_analyzer.encode_jpeg(rendered)
+
+async def _analyze_image_bytes(image_bytes: bytes, conf_threshold: float = 0.25, tiled: bool = False,
+                               annotate: str = 'base64'):
+    """Кэши результатов и разметки — здесь, декодирование, инференс и отрисовка — в пуле.
+    
+    Полное попадание в кэш не занимает пул. Возвращает (результат, этапы).
+    """
+    with metrics.profile() as stages, metrics.span('cache_lookup'):
+        cache_key = result_cache.make_key(image_bytes, analyzer.version, conf_threshold, f"tiled={tiled}")
+        cached = result_cache.get(cache_key)
+        annotated = annotated_store.get(cache_key) if annotate != 'none' else None
+    draw = annotate != 'none' and annotated is None
+    
+    if cached is not None and not draw:
+        analysis_result = cached
+    else:
+        (analysis_result, rendered), pool_stages = await inference_pool.run(
+            _profiled, _infer_image_bytes, image_bytes, conf_threshold, tiled, cached, draw
+        )
+        stages.extend(pool_stages)
+        if cached is None:
+            result_cache.put(cache_key, analysis_result)
+        if rendered is not None:
+            annotated = rendered
+            annotated_store.put(cache_key, annotated)
+    
+    if cached is not None:
+        analysis_result['analysis_id'] = f"ANL_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        analysis_result['timestamp'] = datetime.now().isoformat()
+        analysis_result['cached'] = True
+    if annotate == 'url':
+        analysis_result['annotated_image_url'] = f"/api/annotated/{cache_key}"
+    elif annotate == 'base64':
+        analysis_result['annotated_image'] = f"data:image/jpeg;base64,{base64.b64encode(annotated).decode('utf-8')}"
+    return analysis_result, stages
+
+def _profiled(func, *args):
+    """Выполнение func в пуле со сбором разбивки по этапам (для X-Profile и /metrics)"""
+    with metrics.profile() as stages:
+        result = func(*args)
+    return result, stages
+
+# Фоновая перезагрузка моделей (POST /api/admin/reload-models)
+reload_status = {'state': 'idle'}
+reload_lock = threading.Lock()  # Проверка и смена состояния — одной операцией
+
+def _check_admin(token: str):
+    """Админ-эндпоинты закрыты токеном, если задан ADMIN_TOKEN"""
+    expected = os.getenv('ADMIN_TOKEN')
+    if expected and token != expected:
+        raise HTTPException(status_code=403, detail="Неверный X-Admin-Token")
+
+def _swap_ensemble(ensemble):
+    """Атомарная замена ансамбля: новые запросы идут в него, начатые дорабатывают на старом"""
+    global analyzer
+    if batch_scheduler is not None:
+        batch_scheduler.swap(ensemble)
+    else:
+        defect_analyzer.model = ensemble
+    analyzer = ensemble
+
+def _reload_models(config_path: str = None):
+    """Загрузка и прогрев новой конфигурации в фоновом потоке, затем замена"""
+    started = time.perf_counter()
+    previous_version = analyzer.version
+    try:
+        ensemble = model_registry.reload(config_path)
+        _swap_ensemble(ensemble)
+        with reload_lock:
+            reload_status.update({
+                'state': 'ready',
+                'version': ensemble.version,
+                'previous_version': previous_version,
+                'config': ensemble.config['path'],
+                'reused': [m['name'] for m in ensemble.models if m.get('reused')],
+                'loaded': [m['name'] for m in ensemble.models if not m.get('reused')],
+                'seconds': round(time.perf_counter() - started, 2),
+                'finished': datetime.now().isoformat()
+            })
+        logger.info(f"🔁 Ансамбль заменен: {previous_version} → {ensemble.version}")
+    except Exception as e:
+        with reload_lock:
+            reload_status.update({'state': 'failed', 'error': str(e), 'finished': datetime.now().isoformat()})
+        logger.error(f"❌ Ошибка перезагрузки моделей: {e}")
+
+def _json_response(content: dict, stages: list, upload_started: float = None, profile: bool = False) -> JSONResponse:
+    """JSON-ответ с замером сериализации; при profile — разбивка в теле и в заголовке Server-Timing"""
+    if profile:
+        content['profile'] = metrics.summarize(stages)
+    started = time.perf_counter()
+    response = JSONResponse(content=content)
+    serialization = time.perf_counter() - started
+    metrics.record('json', serialization)
+    stages.append(('json', serialization))
+    if upload_started is not None:
+        metrics.record('total', time.perf_counter() - upload_started)
+    if profile:
+        response.headers['Server-Timing'] = metrics.server_timing(stages)
+    return response
+
+def _collect_gauges() -> dict:
+    """Текущие значения очередей, кэша, памяти и времени загрузки моделей для /metrics"""
+    gauges = {}
+    if inference_pool is not None:
+        pool_stats = inference_pool.stats()
+        gauges['tagat_inference_pool_pending'] = ("Задачи пула инференса: в работе и в очереди", pool_stats['pending'])
+        gauges['tagat_inference_pool_capacity'] = ("Емкость пула инференса", pool_stats['capacity'])
+        gauges['tagat_inference_pool_rejected'] = ("Отклоненные из-за перегрузки запросы", pool_stats['rejected'])
+    if batch_scheduler is not None:
+        batch_stats = batch_scheduler.stats()
+        gauges['tagat_batch_queue_depth'] = ("Кадры в очереди планировщика батчей", batch_stats['queue_depth'])
+        gauges['tagat_batch_avg_size'] = ("Средний размер батча", batch_stats['avg_batch_size'])
+    
+    cache_stats = result_cache.stats()
+    gauges['tagat_result_cache_hits'] = ("Попадания в кэш результатов", cache_stats['hits'] + cache_stats['disk_hits'])
+    gauges['tagat_result_cache_misses'] = ("Промахи кэша результатов", cache_stats['misses'])
+    
+    registry_stats = model_registry.stats()
+    load_times, warmup_times = {}, {}
+    for backend, backend_stats in registry_stats.items():
+        warmup_times[('backend', backend)] = backend_stats['warmup_ms'] / 1000
+        for name, model_stats in backend_stats['models'].items():
+            load_times[('model', name)] = model_stats['load_ms'] / 1000
+    gauges['tagat_model_load_seconds'] = ("Время загрузки весов модели", load_times)
+    gauges['tagat_model_warmup_seconds'] = ("Время прогрева ансамбля", warmup_times)
+    
+    resident, page_ins = {}, {}
+    for backend_stats in registry_stats.values():
+        for path, entry in ((backend_stats['residency'] or {}).get('models') or {}).items():
+            resident[('path', path)] = int(entry['location'] == 'device')
+            page_ins[('path', path)] = entry['page_ins']
+    if resident:
+        gauges['tagat_model_resident'] = ("Модель на устройстве (1) или вытеснена (0)", resident)
+        gauges['tagat_model_page_ins'] = ("Возвраты вытесненной модели на устройство", page_ins)
+    
+    cascade_stats = analyzer.cascade_stats() if analyzer is not None else {}
+    if 'fast' in cascade_stats:
+        gauges['tagat_cascade_images'] = ("Кадры по пути каскада (fast — только быстрая модель)",
+                                          {('path', path): cascade_stats[path] for path in ('fast', 'escalated')})
+    
+    # torch импортирован только с бэкендом torch; с onnx видеопамять не опрашиваем
+    if 'torch' in sys.modules:
+        from device import gpu_memory
+        memory = gpu_memory()
+        gauges['tagat_gpu_memory_allocated_bytes'] = ("Выделенная видеопамять",
+                                                      {('device', d): m['allocated'] for d, m in memory.items()})
+        gauges['tagat_gpu_memory_reserved_bytes'] = ("Зарезервированная видеопамять",
+                                                     {('device', d): m['reserved'] for d, m in memory.items()})
+    return gauges
+
+async def _analyze_frame_data(image_data: str, annotate: str = 'base64'):
+    """Анализ кадра в base64 (data URL или чистый base64)"""
+    if ',' in image_data:
+        image_data = image_data.split(',')[1]
+    
+    return await _analyze_image_bytes(base64.b64decode(image_data), annotate=annotate)
+
+def _check_annotate_mode(annotate: str):
+    if annotate not in ANNOTATE_MODES:
+        raise HTTPException(status_code=400, detail=f"annotate: одно из {', '.join(ANNOTATE_MODES)}")
+
+def _analyze_stream_frame(data: bytes, frame_format: str, shape, annotate: bool, session=None):
+    """Декодирование и анализ кадра из WebSocket-потока — выполняется в пуле"""
+    image_np = decode_frame(data, frame_format, shape)
+    
+    if session is not None:
+        # Видеосессия: ансамбль только на ключевых кадрах, между ними — трекинг
+        detections, keyframe = session.update(
+            image_np, lambda image: defect_analyzer.model.predict_batch([image], conf_threshold=0.25)[0]
+        )
+        analysis_result = defect_analyzer.format_detections(detections)
+        analysis_result['keyframe'] = keyframe
+    else:
+        analysis_result = defect_analyzer.analyze_defects(image_np)
+    annotated = None
+    if annotate:
+        with metrics.span('draw'):
+            rendered = defect_analyzer.render_defects(image_np, analysis_result['defects'])
+        annotated = defect_analyzer.encode_jpeg(rendered)
+    
+    return analysis_result, annotated
+
+def _overloaded_error(e: PoolOverloaded) -> HTTPException:
+    logger.warning(f"⚠️ {e}")
+    return HTTPException(
+        status_code=503,
+        detail="Сервер перегружен, повторите запрос позже",
+        headers={"Retry-After": "1"}
+    )
+
 @app.on_event("startup")
 async def startup_event():
-    global analyzer, defect_analyzer
+    global analyzer, defect_analyzer, inference_pool
+    if os.getenv('INFERENCE_SERVER'):
+        server_key()  # Без ключа воркер не стартует, а не работает без моделей
+    # С пулом процессов модели загружаются только в воркерах: родитель не держит лишнюю копию
+    pooled = os.getenv('INFERENCE_POOL', 'thread') == 'process'
+    if pooled:
+        inference_pool = InferencePool(initializer=_init_worker)
     try:
         print("🔄 Загрузка Ensemble моделей...")
-        analyzer = FinalEnsemble()
-        defect_analyzer = DefectAnalyzer(analyzer)
+        if pooled:
+            analyzer = PooledEnsemble(inference_pool, _worker_info, _worker_predict_batch)
+            defect_analyzer = DefectAnalyzer(analyzer)
+        else:
+            analyzer = _load_ensemble()
+            defect_analyzer = _make_defect_analyzer(analyzer)
         print("✅ Ensemble модели успешно загружены!")
-        print(f"📊 Загружено моделей: {len(analyzer.models)}")
+        print(f"📊 Загружено моделей: {len(analyzer.models)}, загрузка: {model_registry.stats()}")
     except Exception as e:
         print(f"❌ Ошибка загрузки моделей: {e}")
         analyzer = None
         defect_analyzer = None
+    
+    if not pooled:
+        # Батч не может быть больше числа одновременно ожидающих потоков пула
+        workers = os.getenv('INFERENCE_WORKERS') or (batch_scheduler.max_batch_size if batch_scheduler else None)
+        inference_pool = InferencePool(workers=workers, initializer=_init_worker)
+    print(f"⚙️ Пул инференса: {inference_pool.stats()}")
+    if inference_pool.kind == 'process' and os.getenv('ENSEMBLE_BACKEND', 'torch') == 'torch':
+        from device import select_device, is_cuda
+        if is_cuda(select_device()):
+            logger.warning("⚠️ INFERENCE_POOL=process на GPU: каждый процесс пула создает свой CUDA-контекст "
+                           "и копию весов; для нескольких воркеров на одной карте лучше INFERENCE_SERVER")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if inference_pool is not None:
+        inference_pool.shutdown(wait=False)
+    if batch_scheduler is not None:
+        batch_scheduler.shutdown()
+    if isinstance(analyzer, RemoteEnsemble):
+        analyzer.close()
+    for job in batch_jobs.values():
+        job.cancel()
 
 # API endpoints
 @app.get("/")
@@ -206,37 +535,106 @@ async def health_check():
     return {
         "status": "healthy", 
         "model_status": "loaded" if analyzer else "failed",
+        "models": model_registry.stats(),
+        "model_version": analyzer.version if analyzer else None,
+        "result_cache": result_cache.stats(),
+        "annotated_store": annotated_store.stats(),
+        "inference_pool": inference_pool.stats() if inference_pool else None,
+        "batching": batch_scheduler.stats() if batch_scheduler else None,
+        "cascade": analyzer.cascade_stats() if analyzer else None,
+        "inference_server": analyzer.stats() if isinstance(analyzer, RemoteEnsemble) else None,
+        "batch_jobs": {job_id: job.status for job_id, job in batch_jobs.items()},
         "timestamp": datetime.now().isoformat()
     }
 
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Гистограммы этапов и моделей, очереди, кэш и память в текстовом формате Prometheus.
+    
+    С INFERENCE_POOL=process этапы внутри пула считаются в процессах-воркерах и здесь не видны.
+    """
+    return Response(content=metrics.render(_collect_gauges()), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/admin/models")
+async def get_models(x_admin_token: str = Header(None)):
+    """Текущий состав ансамбля и состояние последней перезагрузки"""
+    _check_admin(x_admin_token)
+    if analyzer is None:
+        raise HTTPException(status_code=503, detail="Модель не загружена")
+    with reload_lock:
+        reload = dict(reload_status)
+    return {
+        'version': analyzer.version,
+        'config': analyzer.config['path'],
+        'config_version': analyzer.config['version'],
+        'merge_mode': analyzer.merge_mode,
+        'models': [{'name': m['name'], 'path': m['path'], 'weight': m['weight'],
+                    'mtime': datetime.fromtimestamp(m['mtime']).isoformat()} for m in analyzer.models],
+        'reload': reload
+    }
+
+@app.post("/api/admin/reload-models")
+async def reload_models(config_path: str = None, x_admin_token: str = Header(None)):
+    """Фоновая загрузка ансамбля по YAML-конфигурации и замена без остановки приема запросов"""
+    _check_admin(x_admin_token)
+    if analyzer is None:
+        raise HTTPException(status_code=503, detail="Модель не загружена")
+    if inference_pool.kind == 'process':
+        raise HTTPException(status_code=409, detail="С INFERENCE_POOL=process модели живут в воркерах, нужен перезапуск")
+    if isinstance(analyzer, RemoteEnsemble):
+        raise HTTPException(status_code=409, detail="Моделями владеет сервер инференса, нужен его перезапуск")
+    with reload_lock:
+        if reload_status['state'] == 'loading':
+            raise HTTPException(status_code=409, detail="Перезагрузка уже выполняется")
+        reload_status.clear()
+        reload_status.update({'state': 'loading', 'started': datetime.now().isoformat()})
+        status = dict(reload_status)
+    threading.Thread(target=_reload_models, args=(config_path,), name='model-reload', daemon=True).start()
+    return JSONResponse(status_code=202, content=status)
+
 @app.post("/api/analyze-image")
 async def analyze_image(
     engine_number: str = "ТАГАТ-2024-001",
     blade_number: str = "LP-001",
-    file: UploadFile = File(...)
+    tiled: bool = False,
+    annotate: str = "base64",
+    file: UploadFile = File(...),
+    x_profile: str = Header(None)
 ):
-    """Анализ изображения на наличие дефектов"""
+    """Анализ изображения на наличие дефектов; заголовок X-Profile: 1 — разбивка времени по этапам"""
     try:
         if defect_analyzer is None:
             raise HTTPException(status_code=503, detail="Модель не загружена")
+        _check_annotate_mode(annotate)
         
         logger.info(f"🎯 Анализ для {engine_number}, лопатка {blade_number}")
         
         if not file.content_type.startswith('image/'):
             raise HTTPException(status_code=400, detail="Файл должен быть изображением")
         
+        # Отказ до чтения тела, если размер известен заранее
+        if getattr(file, 'size', None) and file.size > MAX_UPLOAD_BYTES:
+            raise HTTPException(status_code=413, detail="Файл слишком большой")
+        
+        upload_started = time.perf_counter()
         image_data = await file.read()
-        image_np = defect_analyzer.preprocess_image(image_data)
+        upload_read = time.perf_counter() - upload_started
+        metrics.record('upload_read', upload_read)
         
-        analysis_result = defect_analyzer.analyze_defects(image_np)
-        annotated_image = defect_analyzer.draw_defects_on_image(image_np, analysis_result['defects'])
+        analysis_result, stages = await _analyze_image_bytes(image_data, 0.25, tiled, annotate)
+        stages.insert(0, ('upload_read', upload_read))
         
-        analysis_result['annotated_image'] = f"data:image/jpeg;base64,{annotated_image}"
         analysis_result['engine_number'] = engine_number
         analysis_result['blade_number'] = blade_number
         
-        return JSONResponse(content=analysis_result)
+        return _json_response(analysis_result, stages, upload_started, profile=x_profile == '1')
         
+    except HTTPException:
+        raise
+    except ImageRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except PoolOverloaded as e:
+        raise _overloaded_error(e)
     except Exception as e:
         logger.error(f"❌ Ошибка: {e}")
         raise HTTPException(status_code=500, detail=f"Ошибка анализа: {str(e)}")
@@ -245,36 +643,173 @@ async def analyze_image(
 async def analyze_frame(
     engine_number: str = "ТАГАТ-2024-001",
     blade_number: str = "LP-001",
-    image_data: str = None
+    image_data: str = None,
+    annotate: str = "base64",
+    x_profile: str = Header(None)
 ):
     """Анализ кадра из видео"""
     try:
         if defect_analyzer is None:
             raise HTTPException(status_code=503, detail="Модель не загружена")
+        _check_annotate_mode(annotate)
             
         if not image_data:
             raise HTTPException(status_code=400, detail="Отсутствуют данные изображения")
         
-        if ',' in image_data:
-            image_data = image_data.split(',')[1]
-        
-        image_bytes = base64.b64decode(image_data)
-        image_np = defect_analyzer.preprocess_image(image_bytes)
+        started = time.perf_counter()
+        analysis_result, stages = await _analyze_frame_data(image_data, annotate)
         
-        analysis_result = defect_analyzer.analyze_defects(image_np)
-        annotated_image = defect_analyzer.draw_defects_on_image(image_np, analysis_result['defects'])
-        
-        analysis_result['annotated_image'] = f"data:image/jpeg;base64,{annotated_image}"
         analysis_result['engine_number'] = engine_number
         analysis_result['blade_number'] = blade_number
         
-        return JSONResponse(content=analysis_result)
+        return _json_response(analysis_result, stages, started, profile=x_profile == '1')
         
+    except HTTPException:
+        raise
+    except ImageRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except PoolOverloaded as e:
+        raise _overloaded_error(e)
     except Exception as e:
         logger.error(f"❌ Ошибка анализа кадра: {e}")
         raise HTTPException(status_code=500, detail=f"Ошибка анализа: {str(e)}")
 
+@app.get("/api/annotated/{image_id}")
+async def get_annotated_image(image_id: str):
+    """Размеченное изображение в JPEG (annotate=url)"""
+    annotated = annotated_store.get(image_id)
+    if annotated is None:
+        raise HTTPException(status_code=404, detail="Изображение не найдено или устарело")
+    return Response(content=annotated, media_type="image/jpeg")
+
+@app.post("/api/batch-jobs")
+async def create_batch_job(
+    engine_number: str = None,
+    source_path: str = None,
+    conf_threshold: float = 0.25,
+    files: List[UploadFile] = File(None)
+):
+    """Пакетный анализ инспекции: изображения и zip-архивы в запросе или каталог/архив на сервере.
+    
+    Без engine_number номер двигателя берется из первого подкаталога (в архиве или каталоге),
+    номер лопатки — из имени файла.
+    """
+    if defect_analyzer is None:
+        raise HTTPException(status_code=503, detail="Модель не загружена")
+    if not files and not source_path:
+        raise HTTPException(status_code=400, detail="Нужны файлы или source_path")
+    
+    job_id = BatchJob.new_id()
+    output_dir = os.path.join(BATCH_OUTPUT_DIR, job_id)
+    inputs = []
+    
+    if source_path:
+        real_path = os.path.realpath(source_path)
+        if os.path.commonpath([real_path, BATCH_INPUT_ROOT]) != BATCH_INPUT_ROOT:
+            raise HTTPException(status_code=403, detail=f"source_path должен быть внутри {BATCH_INPUT_ROOT}")
+        inputs.append(real_path)
+    
+    if files:
+        upload_dir = os.path.join(output_dir, 'inputs')
+        os.makedirs(upload_dir, exist_ok=True)
+        uploaded = 0
+        for i, file in enumerate(files):
+            name = os.path.basename(file.filename or '') or f"image_{i}.jpg"
+            path = os.path.join(upload_dir, name)
+            if os.path.exists(path):
+                path = os.path.join(upload_dir, f"{i}_{name}")
+            with open(path, 'wb') as f:
+                while chunk := await file.read(1024 * 1024):
+                    uploaded += len(chunk)
+                    if uploaded > BATCH_MAX_UPLOAD_BYTES:
+                        break
+                    f.write(chunk)
+            if uploaded > BATCH_MAX_UPLOAD_BYTES:
+                shutil.rmtree(output_dir, ignore_errors=True)
+                raise HTTPException(status_code=413,
+                                    detail=f"Файлы запроса больше {BATCH_MAX_UPLOAD_BYTES // 1024**2} МБ")
+            inputs.append(path)
+    
+    try:
+        sources = collect_sources(inputs)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ImageRejected as e:
+        shutil.rmtree(output_dir, ignore_errors=True)
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    if not sources:
+        sources.close()
+        raise HTTPException(status_code=400, detail="Изображения не найдены")
+    
+    job = BatchJob(sources, output_dir, defect_analyzer.model, defect_analyzer.format_detections,
+                   engine_number, conf_threshold)
+    batch_jobs[job.job_id] = job.start()
+    logger.info(f"📦 Пакетное задание {job.job_id}: {len(sources)} снимков")
+    
+    return JSONResponse(status_code=202, content=job.info())
+
+@app.get("/api/batch-jobs/{job_id}")
+async def get_batch_job(job_id: str):
+    """Статус и прогресс пакетного задания"""
+    job = batch_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задание не найдено")
+    return job.info()
+
+@app.get("/api/batch-jobs/{job_id}/results")
+async def get_batch_results(job_id: str, format: str = "jsonl"):
+    """Результаты задания; jsonl и csv доступны по мере обработки, summary — после завершения"""
+    job = batch_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задание не найдено")
+    if format not in BATCH_RESULT_FILES:
+        raise HTTPException(status_code=400, detail=f"format: одно из {', '.join(BATCH_RESULT_FILES)}")
+    
+    filename, media_type = BATCH_RESULT_FILES[format]
+    path = os.path.join(job.output_dir, filename)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Результаты еще не готовы")
+    return FileResponse(path, media_type=media_type, filename=f"{job_id}_{filename}")
+
+@app.delete("/api/batch-jobs/{job_id}")
+async def cancel_batch_job(job_id: str):
+    """Остановка задания; уже записанные результаты сохраняются"""
+    job = batch_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задание не найдено")
+    job.cancel()
+    return job.info()
+
+@app.websocket("/ws/analyze-stream")
+async def analyze_stream(
+    websocket: WebSocket,
+    engine_number: str = "ТАГАТ-2024-001",
+    blade_number: str = "LP-001"
+):
+    """Потоковый анализ кадров видео: бинарные JPEG/BGR кадры, ответы — JSON"""
+    await websocket.accept()
+    
+    if defect_analyzer is None:
+        await websocket.close(code=1013, reason="Модель не загружена")
+        return
+    
+    logger.info(f"📹 Видеопоток для {engine_number}, лопатка {blade_number}")
+    stats = await serve_frame_stream(
+        websocket,
+        inference_pool,
+        _analyze_stream_frame,
+        {'engine_number': engine_number, 'blade_number': blade_number}
+    )
+    logger.info(f"📹 Видеопоток закрыт: {stats}")
+
 if __name__ == "__main__":
     print("🚀 Запуск FastAPI сервера...")
     print("📝 Документация API: http://localhost:8000/docs")
-    uvicorn.run(app, host="0.0.0.0", port=8000, log_level="info")
\ No newline at end of file
+    # WEB_WORKERS>1: несколько процессов HTTP/декодирования; без INFERENCE_SERVER каждый загрузит свои модели
+    web_workers = int(os.getenv('WEB_WORKERS', 1))
+    if web_workers > 1:
+        if not os.getenv('INFERENCE_SERVER'):
+            print("⚠️ WEB_WORKERS без INFERENCE_SERVER: модели будут загружены в каждом воркере")
+        uvicorn.run("app:app", host="0.0.0.0", port=8000, workers=web_workers, log_level="info")
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8000, log_level="info")
\ No newline at end of file
@@ -2,27 +2,15 @@ import os
 import random
 import shutil
 from PIL import Image, ImageEnhance
-from collections import Counter
+from dataset_index import load_index, class_counts as count_classes, print_class_distribution
 
 def analyze_classes():
     """Анализ распределения классов"""
     class_names = ['Burn Mark', 'Coating_defects', 'Crack', 'EROSION']
-    class_counts = Counter()
-    
-    for split in ['train', 'valid']:
-        labels_dir = f'dataset/{split}/labels'
-        
-        for label_file in os.listdir(labels_dir):
-            with open(os.path.join(labels_dir, label_file), 'r') as f:
-                for line in f:
-                    class_id = int(line.strip().split()[0])
-                    class_counts[class_id] += 1
+    class_counts = count_classes(['train', 'valid'], num_classes=len(class_names))
     
     print("📊 Распределение классов:")
-    total = sum(class_counts.values())
-    for class_id, count in class_counts.items():
-        percentage = (count / total) * 100
-        print(f"   {class_names[class_id]}: {count} ({percentage:.1f}%)")
+    print_class_distribution(class_counts, class_names)
     
     return class_counts
 
@@ -36,6 +24,9 @@ def gentle_augment_weak_classes():
         images_dir = f'dataset/{split}/images'
         labels_dir = f'dataset/{split}/labels'
         
+        # Изображения со слабыми классами — одним запросом к индексу разметки
+        weak_images = set(load_index(split).images_with_classes(weak_classes_ids, originals_only=True))
+        
         # Только оригинальные файлы (не аугментированные)
         image_files = [f for f in os.listdir(images_dir) 
                       if f.endswith(('.jpg', '.png', '.jpeg')) 
@@ -50,16 +41,7 @@ def gentle_augment_weak_classes():
             if not os.path.exists(label_path):
                 continue
                 
-            # Проверяем есть ли слабые классы
-            has_weak_class = False
-            with open(label_path, 'r') as f:
-                for line in f:
-                    class_id = int(line.strip().split()[0])
-                    if class_id in weak_classes_ids:
-                        has_weak_class = True
-                        break
-            
-            if not has_weak_class:
+            if image_file.rsplit('.', 1)[0] not in weak_images:
                 continue
             
             # Загружаем и аугментируем
@@ -0,0 +1,274 @@
+import os
+import json
+import time
+import zlib
+import random
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import cv2
+import albumentations as A
+from dataset_index import load_index, print_class_distribution
+
+CLASS_NAMES = ['Burn Mark', 'Coating_defects', 'Crack', 'EROSION']
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+# Префикс aug_ — копии удаляет clean_augmented.py и не учитывает индекс разметки как оригиналы
+OUTPUT_PREFIX = 'aug_'
+MANIFEST_NAME = 'augment_manifest.jsonl'
+
+_transform = None
+
+
+def build_transform():
+    """Мягкие преобразования с учетом боксов: отражение, небольшой сдвиг/масштаб/поворот, яркость и контраст"""
+    return A.Compose(
+        [
+            A.HorizontalFlip(p=0.5),
+            A.Affine(scale=(0.9, 1.1), translate_percent=(-0.05, 0.05), rotate=(-10, 10), p=0.7),
+            A.RandomBrightnessContrast(brightness_limit=0.1, contrast_limit=(-0.1, 0.2), p=0.5)
+        ],
+        bbox_params=A.BboxParams(format='yolo', label_fields=['class_labels'], min_visibility=0.3)
+    )
+
+
+def clip_boxes(boxes):
+    """Нормализованные xywh в пределах кадра (albumentations отвергает боксы, выходящие за край)"""
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    x1 = np.clip(boxes[:, 0] - boxes[:, 2] / 2, 0.0, 1.0)
+    y1 = np.clip(boxes[:, 1] - boxes[:, 3] / 2, 0.0, 1.0)
+    x2 = np.clip(boxes[:, 0] + boxes[:, 2] / 2, 0.0, 1.0)
+    y2 = np.clip(boxes[:, 1] + boxes[:, 3] / 2, 0.0, 1.0)
+    return np.stack([(x1 + x2) / 2, (y1 + y2) / 2, x2 - x1, y2 - y1], axis=1)
+
+
+def apply_transform(transform, image, classes, boxes, seed):
+    """Одно детерминированное применение преобразований: тот же seed — та же копия"""
+    if hasattr(transform, 'set_random_seed'):
+        transform.set_random_seed(seed)
+    else:
+        # Старые albumentations берут случайность из глобальных генераторов
+        random.seed(seed)
+        np.random.seed(seed)
+
+    boxes = clip_boxes(boxes)
+    keep = (boxes[:, 2] > 0) & (boxes[:, 3] > 0)
+    result = transform(image=image, bboxes=boxes[keep], class_labels=np.asarray(classes)[keep].tolist())
+    return result['image'], [int(c) for c in result['class_labels']], np.asarray(result['bboxes'], dtype=np.float32).reshape(-1, 4)
+
+
+def _job_seed(seed, source, variant):
+    # crc32, а не hash(): значение не должно зависеть от процесса и PYTHONHASHSEED
+    return zlib.crc32(f"{seed}:{source}:{variant}".encode('utf-8'))
+
+
+def plan_jobs(index, targets, seed=0, max_per_image=5):
+    """Список копий (источник, номер варианта), доводящий число боксов классов до targets.
+
+    План строится только по оригиналам, поэтому при том же seed и targets он одинаков
+    при каждом запуске — на этом основано возобновление по манифесту. Копия добавляет
+    боксы всех классов своего источника, это учитывается при подборе следующих.
+    """
+    num_classes = max([index.num_classes] + [class_id + 1 for class_id in targets])
+    per_image = np.zeros((len(index), num_classes), dtype=np.int64)
+    np.add.at(per_image, (index.image_id, index.cls), 1)
+    originals = ~index.augmented_mask()
+    counts = per_image[originals].sum(axis=0)
+
+    rng = np.random.default_rng(seed)
+    uses = np.zeros(len(index), dtype=np.int64)
+    jobs = []
+    # Сначала самые редкие классы: их копии заодно добавляют боксы частых
+    for class_id in sorted(targets, key=lambda c: counts[c]):
+        candidates = rng.permutation(np.flatnonzero(originals & (per_image[:, class_id] > 0)))
+        while counts[class_id] < targets[class_id]:
+            available = candidates[uses[candidates] < max_per_image]
+            if not len(available):
+                print(f"⚠️ {CLASS_NAMES[class_id] if class_id < len(CLASS_NAMES) else class_id}: "
+                      f"достигнут предел {max_per_image} копий на снимок, {counts[class_id]} из {targets[class_id]}")
+                break
+            for i in available:
+                if counts[class_id] >= targets[class_id]:
+                    break
+                jobs.append((str(index.images[i]), int(uses[i])))
+                uses[i] += 1
+                counts += per_image[i]
+    return jobs, counts
+
+
+class Manifest:
+    """Журнал готовых копий (JSON Lines): строка пишется после того, как снимок и разметка на диске"""
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # Недописанная строка после прерывания
+                    self.entries[entry['name']] = entry
+        self._file = None
+
+    def is_done(self, name, seed, images_dir, labels_dir):
+        entry = self.entries.get(name)
+        return entry is not None and entry['seed'] == seed \
+            and os.path.exists(os.path.join(images_dir, entry['image'])) \
+            and os.path.exists(os.path.join(labels_dir, f"{name}.txt"))
+
+    def record(self, entry):
+        if self._file is None:
+            self._file = open(self.path, 'a', encoding='utf-8')
+        self._file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        self._file.flush()
+        self.entries[entry['name']] = entry
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def _write_atomic(path, data):
+    tmp_path = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.{os.getpid()}.tmp")
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _init_worker():
+    global _transform
+    cv2.setNumThreads(1)  # Параллелизм — процессами пула
+    _transform = build_transform()
+
+
+def _augment_one(job):
+    """Одна копия в процессе пула: чтение, преобразование, атомарная запись снимка и разметки"""
+    name, image_path, out_image_path, out_label_path, classes, boxes, seed = job
+    try:
+        image = cv2.imread(image_path)
+        if image is None:
+            return name, 'failed', "не удалось прочитать снимок"
+
+        image, classes, boxes = apply_transform(_transform, image, classes, boxes, seed)
+        if not classes:
+            return name, 'empty', None  # Все боксы ушли за край кадра
+
+        ext = os.path.splitext(out_image_path)[1].lower()
+        params = [cv2.IMWRITE_JPEG_QUALITY, 95] if ext in ('.jpg', '.jpeg') else []
+        ok, encoded = cv2.imencode(ext, image, params)
+        if not ok:
+            return name, 'failed', "ошибка кодирования"
+        _write_atomic(out_image_path, encoded.tobytes())
+
+        lines = [f"{c} {x:.6f} {y:.6f} {w:.6f} {h:.6f}" for c, (x, y, w, h) in zip(classes, boxes)]
+        _write_atomic(out_label_path, ('\n'.join(lines) + '\n').encode('utf-8'))
+        return name, 'done', classes
+    except Exception as e:
+        return name, 'failed', str(e)
+
+
+def run_augmentation(targets, split='train', seed=0, workers=None, max_per_image=5, dataset_dir=None):
+    """Параллельная офлайн-аугментация до целевого числа боксов каждого класса.
+
+    targets: {id класса: целевое число боксов}. Готовые копии из манифеста пропускаются,
+    поэтому повторный запуск с теми же параметрами ничего не делает, а прерванный — доделывает.
+    """
+    index = load_index(split, dataset_dir)
+    split_dir = os.path.dirname(index.labels_dir)
+    images_dir = os.path.join(split_dir, 'images')
+
+    images = {}
+    for file_name in os.listdir(images_dir):
+        stem, ext = os.path.splitext(file_name)
+        if ext.lower() in IMAGE_EXTENSIONS:
+            images[stem] = file_name
+
+    jobs, planned_counts = plan_jobs(index, targets, seed, max_per_image)
+    manifest = Manifest(os.path.join(split_dir, MANIFEST_NAME))
+
+    order = np.argsort(index.image_id, kind='stable')
+    bounds = np.searchsorted(index.image_id[order], np.arange(len(index) + 1))
+    positions = {str(name): i for i, name in enumerate(index.images)}
+
+    pending, skipped, missing = [], 0, 0
+    for source, variant in jobs:
+        if source not in images:
+            missing += 1
+            continue
+        name = f"{OUTPUT_PREFIX}{source}_{variant}"
+        if manifest.is_done(name, seed, images_dir, index.labels_dir):
+            skipped += 1
+            continue
+        rows = order[bounds[positions[source]]:bounds[positions[source] + 1]]
+        image_name = name + os.path.splitext(images[source])[1]
+        pending.append((name, os.path.join(images_dir, images[source]), os.path.join(images_dir, image_name),
+                        os.path.join(index.labels_dir, f"{name}.txt"), index.cls[rows].tolist(),
+                        index.boxes[rows].tolist(), _job_seed(seed, source, variant)))
+
+    print(f"🧮 Копий в плане: {len(jobs)}, готово ранее: {skipped}, к созданию: {len(pending)}"
+          + (f", нет снимка: {missing}" if missing else ""))
+
+    summary = {'planned': len(jobs), 'skipped': skipped, 'done': 0, 'empty': 0, 'failed': 0,
+               'planned_counts': planned_counts.tolist()}
+    started = last_report = time.perf_counter()
+    try:
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), initializer=_init_worker) as pool:
+            for job, (name, status, detail) in zip(pending, pool.map(_augment_one, pending, chunksize=8)):
+                summary[status] += 1
+                if status == 'done':
+                    manifest.record({'name': name, 'image': os.path.basename(job[2]), 'source': job[1],
+                                     'seed': seed, 'classes': detail})
+                elif status == 'failed':
+                    print(f"❌ {name}: {detail}")
+
+                now = time.perf_counter()
+                processed = summary['done'] + summary['empty'] + summary['failed']
+                if now - last_report >= 2.0 or processed == len(pending):
+                    last_report = now
+                    rate = processed / (now - started) if now > started else 0.0
+                    print(f"   {processed}/{len(pending)}, {rate:.1f} изобр/с")
+    finally:
+        manifest.close()
+    return summary
+
+
+def parse_targets(values, class_names):
+    """Цели вида 'Coating_defects=600' или '1=600'"""
+    targets = {}
+    for value in values:
+        key, _, count = value.partition('=')
+        class_id = int(key) if key.isdigit() else class_names.index(key)
+        targets[class_id] = int(count)
+    return targets
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Параллельная аугментация слабых классов до целевого числа боксов")
+    parser.add_argument('--target', action='append', default=[],
+                        help="Класс=число боксов (имя или id), можно несколько раз; без целей — выравнивание по самому частому")
+    parser.add_argument('--split', default='train')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None, help="Процессов пула (по умолчанию — число ядер)")
+    parser.add_argument('--max-per-image', type=int, default=5, help="Не больше копий одного снимка")
+    args = parser.parse_args()
+
+    index = load_index(args.split)
+    counts = index.class_counts(len(CLASS_NAMES), originals_only=True)
+    print("📊 Распределение классов (оригиналы):")
+    print_class_distribution(counts, CLASS_NAMES)
+
+    targets = parse_targets(args.target, CLASS_NAMES) if args.target \
+        else {class_id: int(counts.max()) for class_id in range(len(CLASS_NAMES))}
+    summary = run_augmentation(targets, args.split, args.seed, args.workers, args.max_per_image)
+
+    print(f"\n📈 Создано: {summary['done']}, пропущено готовых: {summary['skipped']}, "
+          f"без боксов: {summary['empty']}, ошибок: {summary['failed']}")
+    print("📊 Ожидаемое распределение:")
+    print_class_distribution(np.asarray(summary['planned_counts']), CLASS_NAMES)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+import os
+import numpy as np
+from ultralytics.models.yolo.detect import DetectionTrainer
+from ultralytics.utils.instance import Instances
+from augmentation import build_transform, apply_transform
+from image_cache import CachedYOLODataset, attach as attach_image_cache
+
+# Степень выравнивания: 0 — без перевзвешивания, 1 — все классы встречаются одинаково часто
+BALANCE_POWER = float(os.getenv('BALANCE_POWER', 0.5))
+
+# Вероятность дополнительной аугментации в памяти для снимков со слабыми классами
+WEAK_AUGMENT_P = float(os.getenv('WEAK_AUGMENT_P', 0.5))
+
+
+def class_weights(counts, power=BALANCE_POWER):
+    """Вес класса (max / count) ** power; у отсутствующих классов вес 0"""
+    counts = np.asarray(counts, dtype=np.float64)
+    weights = np.zeros_like(counts)
+    present = counts > 0
+    weights[present] = (counts[present].max() / counts[present]) ** power
+    return weights
+
+
+class BalancedYOLODataset(CachedYOLODataset):
+    """Обучающий датасет ultralytics с взвешенной выборкой снимков и аугментацией слабых классов в памяти.
+
+    Индекс, запрошенный загрузчиком, заменяется случайным с вероятностью, пропорциональной весу
+    снимка (максимум весов его классов), поэтому редкие классы встречаются чаще без копий на диске.
+    Снимки со слабыми классами (реже среднего) дополнительно проходят мягкие преобразования
+    из augmentation.py — в процессах загрузчика, до мозаики и остальных преобразований ultralytics.
+    """
+
+    @classmethod
+    def from_dataset(cls, dataset, power=BALANCE_POWER, weak_augment_p=WEAK_AUGMENT_P):
+        dataset.__class__ = cls
+        dataset._init_balancing(power, weak_augment_p)
+        return dataset
+
+    def _init_balancing(self, power, weak_augment_p):
+        image_classes = [label['cls'].reshape(-1).astype(np.int64) for label in self.labels]
+        all_classes = np.concatenate(image_classes) if image_classes else np.array([], dtype=np.int64)
+        counts = np.bincount(all_classes, minlength=len(self.data['names']))
+        weights = class_weights(counts, power)
+        weak = (counts > 0) & (counts < counts[counts > 0].mean()) if counts.any() else np.zeros(len(counts), dtype=bool)
+
+        # Снимки без разметки (фон) остаются с весом 1
+        self.sampling_weights = np.array([weights[c].max() if len(c) else 1.0 for c in image_classes])
+        self._cumulative = np.cumsum(self.sampling_weights)
+        self.weak_mask = np.array([bool(weak[c].any()) if len(c) else False for c in image_classes])
+        self.weak_augment_p = weak_augment_p
+        self.weak_transform = build_transform() if weak_augment_p > 0 else None
+
+        # Ожидаемое число боксов каждого класса за эпоху при такой выборке
+        probabilities = self.sampling_weights / self._cumulative[-1]
+        expected = np.zeros(len(counts))
+        for p, c in zip(probabilities, image_classes):
+            np.add.at(expected, c, p * len(self.labels))
+        names = self.data['names']
+        print("⚖️ Взвешенная выборка классов (бокс за эпоху: было → ожидается):")
+        for class_id, count in enumerate(counts):
+            marker = " [аугментация в памяти]" if weak[class_id] and self.weak_transform is not None else ""
+            print(f"   {names[class_id]}: {count} → {expected[class_id]:.0f}{marker}")
+
+    def __getitem__(self, index):
+        # В режиме rect порядок индексов задает форму батча — выборку не подменяем
+        if not self.rect and len(self._cumulative):
+            index = int(np.searchsorted(self._cumulative, np.random.random() * self._cumulative[-1], side='right'))
+            index = min(index, len(self.labels) - 1)
+        return super().__getitem__(index)
+
+    def get_image_and_label(self, index):
+        label = super().get_image_and_label(index)
+        if self.weak_transform is not None and self.weak_mask[index] and np.random.random() < self.weak_augment_p:
+            self._augment_in_memory(label)
+        return label
+
+    def _augment_in_memory(self, label):
+        instances = label['instances']
+        instances.convert_bbox('xywh')
+        if not instances.normalized:
+            instances.normalize(label['img'].shape[1], label['img'].shape[0])
+
+        image, classes, boxes = apply_transform(self.weak_transform, label['img'], label['cls'].reshape(-1),
+                                                instances.bboxes, seed=int(np.random.randint(2**31)))
+        if not classes:
+            return  # Все боксы ушли за край кадра — оставляем исходный снимок
+
+        label['img'] = image
+        label['cls'] = np.asarray(classes, dtype=np.float32).reshape(-1, 1)
+        label['instances'] = Instances(boxes, segments=np.zeros((0, 1000, 2), dtype=np.float32),
+                                       bbox_format='xywh', normalized=True)
+
+
+class TurbineTrainer(DetectionTrainer):
+    """DetectionTrainer для model.train(trainer=...): взвешенная выборка (BALANCED_SAMPLING) и кэш снимков (IMAGE_CACHE)"""
+
+    def build_dataset(self, img_path, mode='train', batch=None):
+        dataset = super().build_dataset(img_path, mode, batch)
+        if mode == 'train' and os.getenv('BALANCED_SAMPLING', '1') == '1':
+            dataset = BalancedYOLODataset.from_dataset(dataset)
+        return attach_image_cache(dataset, self.args.imgsz, max(self.args.workers, 1))
@@ -0,0 +1,425 @@
+import os
+import csv
+import json
+import time
+import uuid
+import zipfile
+import argparse
+import threading
+import functools
+from collections import deque, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from ingest import decode_image, ImageTooLarge, MAX_UPLOAD_BYTES
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+# Предел суммарного размера снимков архива после распаковки (защита от zip-бомб)
+MAX_ZIP_UNCOMPRESSED_BYTES = int(float(os.getenv('BATCH_MAX_ZIP_MB', 4096)) * 1024**2)
+
+CSV_FIELDS = ['engine_number', 'blade_number', 'file', 'defect_id', 'type', 'type_en',
+              'criticality', 'confidence', 'x1', 'y1', 'x2', 'y2', 'model_source', 'error']
+
+
+def _read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def _read_zip_member(archive, name):
+    # Размер из заголовка проверяется до распаковки; больше заявленного zipfile не распакует
+    if archive.getinfo(name).file_size > MAX_UPLOAD_BYTES:
+        raise ImageTooLarge(f"Файл больше {MAX_UPLOAD_BYTES // 1024**2} МБ")
+    return archive.read(name)
+
+
+class Sources(list):
+    """Список источников вместе с открытыми zip-архивами, из которых они читаются"""
+
+    def __init__(self):
+        super().__init__()
+        self.archives = []
+
+    def close(self):
+        for archive in self.archives:
+            archive.close()
+        self.archives = []
+
+
+def collect_sources(paths):
+    """Список (имя, функция чтения байтов) из файлов, каталогов и zip-архивов.
+
+    Имя относительно каталога/архива: первый подкаталог используется как номер двигателя,
+    имя файла без расширения — как номер лопатки. Архивы остаются открытыми до sources.close().
+    Архив, снимки которого после распаковки больше BATCH_MAX_ZIP_MB, отклоняется с ImageTooLarge.
+    """
+    sources = Sources()
+    try:
+        for path in paths:
+            if os.path.isdir(path):
+                for root, dirs, files in os.walk(path):
+                    dirs.sort()
+                    for name in sorted(files):
+                        if name.lower().endswith(IMAGE_EXTENSIONS):
+                            full_path = os.path.join(root, name)
+                            sources.append((os.path.relpath(full_path, path), functools.partial(_read_file, full_path)))
+            elif zipfile.is_zipfile(path):
+                archive = zipfile.ZipFile(path)
+                sources.archives.append(archive)
+                members = [info for info in archive.infolist()
+                           if info.filename.lower().endswith(IMAGE_EXTENSIONS) and not info.filename.startswith('__MACOSX/')]
+                if sum(info.file_size for info in members) > MAX_ZIP_UNCOMPRESSED_BYTES:
+                    raise ImageTooLarge(f"Архив {os.path.basename(path)} после распаковки больше "
+                                        f"{MAX_ZIP_UNCOMPRESSED_BYTES // 1024**2} МБ")
+                for name in sorted(info.filename for info in members):
+                    sources.append((name, functools.partial(_read_zip_member, archive, name)))
+            elif os.path.isfile(path):
+                sources.append((os.path.basename(path), functools.partial(_read_file, path)))
+            else:
+                raise FileNotFoundError(f"Не найден источник изображений: {path}")
+    except Exception:
+        sources.close()
+        raise
+    return sources
+
+
+def identify(name, engine_number=None):
+    """(номер двигателя, номер лопатки) по относительному имени файла"""
+    parts = name.replace('\\', '/').split('/')
+    blade_number = os.path.splitext(parts[-1])[0]
+    if engine_number is None:
+        engine_number = parts[0] if len(parts) > 1 else 'unknown'
+    return engine_number, blade_number
+
+
+def _load(read, reduce_to):
+    return decode_image(read(), reduce_to=reduce_to)
+
+
+def prefetch_decode(sources, workers=4, depth=None, reduce_to=None):
+    """Чтение и декодирование в пуле потоков на depth кадров вперед, порядок сохраняется.
+
+    Выдает (имя, изображение, scale, ошибка); cv2.imdecode отпускает GIL,
+    поэтому декодирование идет параллельно с инференсом предыдущего батча.
+    """
+    depth = depth or workers * 4
+    source_iter = iter(sources)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='decode') as executor:
+        pending = deque()
+        for name, read in source_iter:
+            pending.append((name, executor.submit(_load, read, reduce_to)))
+            if len(pending) >= depth:
+                break
+
+        while pending:
+            name, future = pending.popleft()
+            source = next(source_iter, None)
+            if source is not None:
+                pending.append((source[0], executor.submit(_load, source[1], reduce_to)))
+            try:
+                image, scale = future.result()
+            except Exception as e:
+                yield name, None, None, e
+                continue
+            yield name, image, scale, None
+
+
+def plain_formatter(class_names):
+    """Формат результата без DefectAnalyzer (для CLI): классы, уверенность и боксы"""
+    def format_detections(detections, scale=1.0):
+        defects = []
+        for i, det in enumerate(detections):
+            x1, y1, x2, y2 = (round(float(v) * scale, 1) for v in det['xyxy'])
+            defects.append({
+                'id': i + 1,
+                'type': class_names[int(det['cls'])],
+                'confidence': float(det['conf']),
+                'bbox': [x1, y1, x2, y2],
+                'model_source': det.get('model', 'ensemble')
+            })
+        return {'defects_found': len(defects), 'defects': defects}
+    return format_detections
+
+
+class ResultWriter:
+    """Инкрементальная запись результатов: JSON Lines (строка на снимок) и CSV (строка на дефект).
+
+    Сводка по двигателям и лопаткам копится в памяти и пишется в summary.json при закрытии.
+    """
+
+    def __init__(self, output_dir, csv_output=True):
+        os.makedirs(output_dir, exist_ok=True)
+        self.jsonl_path = os.path.join(output_dir, 'results.jsonl')
+        self.csv_path = os.path.join(output_dir, 'results.csv') if csv_output else None
+        self.summary_path = os.path.join(output_dir, 'summary.json')
+
+        self._jsonl = open(self.jsonl_path, 'w', encoding='utf-8')
+        self._csv_file = None
+        self._csv = None
+        if self.csv_path:
+            self._csv_file = open(self.csv_path, 'w', encoding='utf-8', newline='')
+            self._csv = csv.DictWriter(self._csv_file, fieldnames=CSV_FIELDS)
+            self._csv.writeheader()
+
+        self.groups = defaultdict(lambda: defaultdict(lambda: {'images': 0, 'defects': 0, 'critical': 0,
+                                                               'errors': 0, 'types': defaultdict(int)}))
+
+    def write(self, name, engine_number, blade_number, result):
+        record = {'file': name, 'engine_number': engine_number, 'blade_number': blade_number, **result}
+        self._jsonl.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+        group = self.groups[engine_number][blade_number]
+        group['images'] += 1
+        group['defects'] += len(result['defects'])
+        for defect in result['defects']:
+            group['types'][defect['type']] += 1
+            if defect.get('criticality') == 'Критический':
+                group['critical'] += 1
+
+        if self._csv:
+            row = {'engine_number': engine_number, 'blade_number': blade_number, 'file': name}
+            if not result['defects']:
+                self._csv.writerow(row)  # Чистая лопатка тоже попадает в отчет
+            for defect in result['defects']:
+                x1, y1, x2, y2 = defect['bbox']
+                self._csv.writerow({
+                    **row,
+                    'defect_id': defect['id'],
+                    'type': defect['type'],
+                    'type_en': defect.get('type_en', ''),
+                    'criticality': defect.get('criticality', ''),
+                    'confidence': round(defect['confidence'], 4),
+                    'x1': x1, 'y1': y1, 'x2': x2, 'y2': y2,
+                    'model_source': defect.get('model_source', '')
+                })
+
+    def write_error(self, name, engine_number, blade_number, error):
+        record = {'file': name, 'engine_number': engine_number, 'blade_number': blade_number, 'error': str(error)}
+        self._jsonl.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self.groups[engine_number][blade_number]['errors'] += 1
+        if self._csv:
+            self._csv.writerow({'engine_number': engine_number, 'blade_number': blade_number,
+                                'file': name, 'error': str(error)})
+
+    def flush(self):
+        self._jsonl.flush()
+        if self._csv_file:
+            self._csv_file.flush()
+
+    def close(self, stats=None):
+        self._jsonl.close()
+        if self._csv_file:
+            self._csv_file.close()
+
+        summary = {
+            'stats': stats or {},
+            'engines': {
+                engine: {blade: {**group, 'types': dict(group['types'])} for blade, group in sorted(blades.items())}
+                for engine, blades in sorted(self.groups.items())
+            }
+        }
+        with open(self.summary_path, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+
+
+class BatchProgress:
+    """Прогресс пакетного анализа; пропускная способность — в снимках в секунду"""
+
+    def __init__(self, total):
+        self.total = total
+        self.processed = 0
+        self.failed = 0
+        self.defects = 0
+        self.started = time.perf_counter()
+        self.finished = None
+
+    def stats(self):
+        elapsed = (self.finished or time.perf_counter()) - self.started
+        done = self.processed + self.failed
+        rate = self.processed / elapsed if elapsed > 0 else 0.0
+        return {
+            'total': self.total,
+            'processed': self.processed,
+            'failed': self.failed,
+            'defects': self.defects,
+            'percent': round(done / self.total * 100, 1) if self.total else 100.0,
+            'elapsed_sec': round(elapsed, 2),
+            'images_per_sec': round(rate, 2),
+            'eta_sec': round((self.total - done) / rate, 1) if rate and not self.finished else 0.0
+        }
+
+
+def run_batch(model, sources, writer, format_fn, conf_threshold=0.25, batch_size=8,
+              engine_number=None, decode_workers=4, progress=None, on_batch=None, cancel_event=None):
+    """Прогон снимков через ансамбль батчами по batch_size с упреждающим декодированием.
+
+    model — FinalEnsemble/OnnxEnsemble/BatchScheduler (нужен predict_batch),
+    format_fn(detections, scale) -> dict результата снимка. Результаты пишутся после каждого батча.
+    """
+    progress = progress or BatchProgress(len(sources))
+    batch = []
+
+    def flush_batch():
+        images = [item[1] for item in batch]
+        try:
+            results = model.predict_batch(images, conf_threshold)
+        except Exception as e:
+            for name, _, _ in batch:
+                writer.write_error(name, *identify(name, engine_number), e)
+            progress.failed += len(batch)
+        else:
+            for (name, _, scale), detections in zip(batch, results):
+                result = format_fn(detections, scale)
+                writer.write(name, *identify(name, engine_number), result)
+                progress.processed += 1
+                progress.defects += len(result['defects'])
+        writer.flush()
+        batch.clear()
+        if on_batch:
+            on_batch(progress)
+
+    for name, image, scale, error in prefetch_decode(sources, decode_workers):
+        if cancel_event is not None and cancel_event.is_set():
+            break
+        if error is not None:
+            writer.write_error(name, *identify(name, engine_number), error)
+            progress.failed += 1
+            continue
+        batch.append((name, image, scale))
+        if len(batch) >= batch_size:
+            flush_batch()
+
+    if batch:
+        flush_batch()
+
+    progress.finished = time.perf_counter()
+    return progress
+
+
+class BatchJob:
+    """Фоновое задание пакетного анализа для API: свой поток, результаты в output_dir"""
+
+    def __init__(self, sources, output_dir, model, format_fn, engine_number=None,
+                 conf_threshold=0.25, batch_size=None, decode_workers=None):
+        self.job_id = os.path.basename(os.path.normpath(output_dir))
+        self.sources = sources
+        self.output_dir = output_dir
+        self.model = model
+        self.format_fn = format_fn
+        self.engine_number = engine_number
+        self.conf_threshold = conf_threshold
+        self.batch_size = int(batch_size or os.getenv('BATCH_JOB_SIZE', 8))
+        self.decode_workers = int(decode_workers or os.getenv('BATCH_DECODE_WORKERS', 4))
+
+        self.status = 'queued'
+        self.error = None
+        self.created = datetime.now().isoformat()
+        self.progress = BatchProgress(len(sources))
+        self.writer = None
+        self._cancel = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f'batch-job-{self.job_id}', daemon=True)
+
+    @staticmethod
+    def new_id():
+        return uuid.uuid4().hex[:12]
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        self._cancel.set()
+
+    def _run(self):
+        self.status = 'running'
+        self.progress.started = time.perf_counter()
+        try:
+            self.writer = ResultWriter(self.output_dir)
+            run_batch(self.model, self.sources, self.writer, self.format_fn, self.conf_threshold,
+                      self.batch_size, self.engine_number, self.decode_workers,
+                      progress=self.progress, cancel_event=self._cancel)
+            self.status = 'cancelled' if self._cancel.is_set() else 'completed'
+        except Exception as e:
+            self.progress.finished = time.perf_counter()
+            self.status = 'failed'
+            self.error = str(e)
+        finally:
+            if self.writer:
+                self.writer.close(self.progress.stats())
+            if isinstance(self.sources, Sources):
+                self.sources.close()
+
+    def info(self):
+        return {
+            'job_id': self.job_id,
+            'status': self.status,
+            'error': self.error,
+            'created': self.created,
+            'engine_number': self.engine_number,
+            'progress': self.progress.stats(),
+            'results': {
+                'jsonl': f"/api/batch-jobs/{self.job_id}/results?format=jsonl",
+                'csv': f"/api/batch-jobs/{self.job_id}/results?format=csv",
+                'summary': f"/api/batch-jobs/{self.job_id}/results?format=summary"
+            }
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пакетный анализ снимков лопаток (каталог, zip или файлы)")
+    parser.add_argument('inputs', nargs='+', help="Каталоги, zip-архивы или отдельные изображения")
+    parser.add_argument('--output', default=None, help="Каталог результатов (по умолчанию batch_results/<время>)")
+    parser.add_argument('--engine', default=None,
+                        help="Номер двигателя; по умолчанию — первый подкаталог в пути снимка")
+    parser.add_argument('--conf', type=float, default=0.25)
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--decode-workers', type=int, default=4)
+    parser.add_argument('--no-csv', action='store_true')
+    args = parser.parse_args()
+
+    import model_registry
+
+    sources = collect_sources(args.inputs)
+    if not sources:
+        sources.close()
+        print("❌ Изображения не найдены")
+        return
+
+    output_dir = args.output or os.path.join('batch_results', datetime.now().strftime('%Y%m%d_%H%M%S'))
+    print("🔄 Загрузка ансамбля...")
+    ensemble = model_registry.get_ensemble()
+    if not ensemble.models:
+        sources.close()
+        print("❌ Не найдено моделей для ensemble!")
+        return
+
+    print(f"🔍 Снимков: {len(sources)}, батч: {args.batch_size}, результаты: {output_dir}")
+    writer = ResultWriter(output_dir, csv_output=not args.no_csv)
+    last_report = [0.0]
+
+    def report(progress):
+        now = time.perf_counter()
+        if now - last_report[0] >= 2.0 or progress.processed + progress.failed == progress.total:
+            last_report[0] = now
+            s = progress.stats()
+            print(f"   {s['processed'] + s['failed']}/{s['total']} ({s['percent']}%), "
+                  f"{s['images_per_sec']} изобр/с, осталось ~{s['eta_sec']} с")
+
+    try:
+        progress = run_batch(ensemble, sources, writer, plain_formatter(ensemble.class_names), args.conf,
+                             args.batch_size, args.engine, args.decode_workers, on_batch=report)
+    finally:
+        sources.close()
+    stats = progress.stats()
+    writer.close(stats)
+
+    print(f"✅ Готово: {stats['processed']} снимков, ошибок: {stats['failed']}, дефектов: {stats['defects']}")
+    print(f"📈 Пропускная способность: {stats['images_per_sec']} изобр/с")
+    print(f"📁 {writer.jsonl_path}")
+    if writer.csv_path:
+        print(f"📁 {writer.csv_path}")
+    print(f"📁 {writer.summary_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+import os
+import time
+import queue
+import threading
+from collections import Counter
+from concurrent.futures import Future
+import metrics
+
+
+class BatchScheduler:
+    """Динамический micro-batching перед FinalEnsemble.
+
+    Запросы копятся до window_ms миллисекунд (или до max_batch_size штук)
+    и прогоняются через ансамбль одним батчем. Интерфейс predict/class_names
+    совпадает с FinalEnsemble, поэтому планировщик можно передать в DefectAnalyzer.
+    """
+
+    def __init__(self, ensemble, max_batch_size=None, window_ms=None):
+        self.ensemble = ensemble
+        self.class_names = ensemble.class_names
+        self.max_batch_size = int(max_batch_size or os.getenv('BATCH_MAX_SIZE', 8))
+        self.window = float(window_ms if window_ms is not None else os.getenv('BATCH_WINDOW_MS', 10)) / 1000
+
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._requests = 0
+        self._batch_sizes = Counter()
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._last_batch_size = 0
+
+        self._thread = threading.Thread(target=self._loop, name='batch-scheduler', daemon=True)
+        self._thread.start()
+
+    def swap(self, ensemble):
+        """Замена ансамбля; батч, который уже выполняется, доработает на прежнем"""
+        self.class_names = ensemble.class_names
+        self.ensemble = ensemble
+
+    def submit(self, image, conf_threshold=0.25) -> Future:
+        """Постановка кадра в очередь; Future вернет список детекций"""
+        future = Future()
+        # Разбивка по этапам вызывающего потока дополняется этапами батча
+        self._queue.put((image, conf_threshold, time.perf_counter(), future, metrics.current_profile()))
+        return future
+
+    def predict_batch(self, images, conf_threshold=0.25):
+        """Все кадры ставятся в очередь сразу и попадают в общие батчи с другими запросами"""
+        futures = [self.submit(image, conf_threshold) for image in images]
+        return [future.result() for future in futures]
+
+    def predict_tiled(self, image, conf_threshold=0.25, **kwargs):
+        return self.ensemble.predict_tiled(image, conf_threshold, predict_batch=self.predict_batch, **kwargs)
+
+    def predict(self, image, conf_threshold=0.25):
+        """Тот же контракт, что у FinalEnsemble.predict"""
+        detections = self.submit(image, conf_threshold).result()
+
+        # Визуализация выполняется в потоке вызывающего, а не планировщика
+        result_image = self.ensemble._visualize_detections(image, detections)
+
+        return result_image, detections
+
+    def _loop(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                break
+
+            # Окно отсчитывается от прихода первого запроса в батче
+            batch = [item]
+            deadline = item[2] + self.window
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        started = time.perf_counter()
+        waits = [started - item[2] for item in batch]
+
+        # Разные пороги уверенности нельзя смешивать в одном вызове
+        groups = {}
+        for item in batch:
+            groups.setdefault(item[1], []).append(item)
+
+        for wait in waits:
+            metrics.record('batch_wait', wait)
+
+        for conf_threshold, items in groups.items():
+            try:
+                with metrics.profile() as batch_stages:
+                    results = self.ensemble.predict_batch([item[0] for item in items], conf_threshold)
+            except Exception as e:
+                for item in items:
+                    item[3].set_exception(e)
+                continue
+
+            for item, detections in zip(items, results):
+                if item[4] is not None:
+                    item[4].append(('batch_wait', started - item[2]))
+                    item[4].extend(batch_stages)
+                item[3].set_result(detections)
+
+        with self._stats_lock:
+            self._batches += 1
+            self._requests += len(batch)
+            self._batch_sizes[len(batch)] += 1
+            self._total_wait += sum(waits)
+            self._max_wait = max(self._max_wait, max(waits))
+            self._last_batch_size = len(batch)
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'queue_depth': self._queue.qsize(),
+                'max_batch_size': self.max_batch_size,
+                'window_ms': self.window * 1000,
+                'batches': self._batches,
+                'requests': self._requests,
+                'last_batch_size': self._last_batch_size,
+                'avg_batch_size': round(self._requests / self._batches, 2) if self._batches else 0,
+                'batch_size_histogram': dict(sorted(self._batch_sizes.items())),
+                'avg_wait_ms': round(self._total_wait / self._requests * 1000, 2) if self._requests else 0,
+                'max_wait_ms': round(self._max_wait * 1000, 2)
+            }
+
+    def shutdown(self):
+        self._queue.put(None)
+        self._thread.join(timeout=5)
@@ -0,0 +1,364 @@
+import os
+import sys
+import json
+import time
+import uuid
+import platform
+import argparse
+import resource
+import urllib.request
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import numpy as np
+import cv2
+from ingest import decode_image
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+def latency_stats(samples):
+    """Перцентили задержки в миллисекундах по списку длительностей в секундах"""
+    if not samples:
+        return {'n': 0}
+    ms = np.asarray(samples) * 1000
+    return {
+        'n': len(ms),
+        'mean_ms': round(float(ms.mean()), 3),
+        'p50_ms': round(float(np.percentile(ms, 50)), 3),
+        'p95_ms': round(float(np.percentile(ms, 95)), 3),
+        'p99_ms': round(float(np.percentile(ms, 99)), 3),
+        'max_ms': round(float(ms.max()), 3)
+    }
+
+
+def timed(fn, *args, repeat=1):
+    samples = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn(*args)
+        samples.append(time.perf_counter() - started)
+    return result, samples
+
+
+def load_image_files(images_dir, limit=None):
+    files = sorted(f for f in os.listdir(images_dir) if f.lower().endswith(IMAGE_EXTENSIONS))
+    if limit:
+        files = files[:limit]
+    payloads = []
+    for name in files:
+        with open(os.path.join(images_dir, name), 'rb') as f:
+            payloads.append((name, f.read()))
+    return payloads
+
+
+def peak_memory(backend):
+    """Пиковая память процесса (RSS) и, для torch на GPU, пик выделенной видеопамяти"""
+    memory = {'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}
+    if backend == 'torch':
+        import torch
+        if torch.cuda.is_available():
+            memory['peak_gpu_allocated_mb'] = round(torch.cuda.max_memory_allocated() / 1024**2, 1)
+            memory['peak_gpu_reserved_mb'] = round(torch.cuda.max_memory_reserved() / 1024**2, 1)
+    return memory
+
+
+def benchmark_models(images_dir, limit=None, batch_sizes=(1, 2, 4, 8), warmup=3, conf_threshold=0.25,
+                     backend=None):
+    """Задержки каждой модели и ансамбля, стоимость объединения, декодирования и кодирования,
+    пропускная способность в зависимости от размера батча"""
+    import model_registry
+
+    backend = backend or os.getenv('ENSEMBLE_BACKEND', 'torch')
+    payloads = load_image_files(images_dir, limit)
+    if not payloads:
+        raise FileNotFoundError(f"Нет изображений в {images_dir}")
+
+    print(f"🖼️ Изображений: {len(payloads)} из {images_dir}")
+    decoded, decode_samples = [], []
+    for _, data in payloads:
+        (image, _), samples = timed(decode_image, data, 0)
+        decoded.append(image)
+        decode_samples.extend(samples)
+
+    encode_samples = []
+    for image in decoded:
+        _, samples = timed(cv2.imencode, '.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 85])
+        encode_samples.extend(samples)
+
+    print(f"🔄 Загрузка ансамбля ({backend})...")
+    ensemble = model_registry.get_ensemble(backend)
+    if not ensemble.models:
+        raise RuntimeError("Не найдено моделей для ensemble!")
+    members = list(ensemble.models)
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(),
+            'backend': backend,
+            'device': str(getattr(ensemble, 'device', 'cpu')),
+            'model_version': ensemble.version,
+            'merge_mode': ensemble.merge_mode,
+            'models': [{'name': m['name'], 'path': m['path'], 'weight': m['weight'],
+                        'load_ms': round(m['load_time'] * 1000, 1)} for m in members],
+            'images_dir': images_dir,
+            'images': len(payloads),
+            'image_shapes': sorted({f"{image.shape[1]}x{image.shape[0]}" for image in decoded}),
+            'conf_threshold': conf_threshold,
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cpu_count': os.cpu_count()
+        },
+        'decode': latency_stats(decode_samples),
+        'encode': latency_stats(encode_samples),
+        'models': {}
+    }
+
+    # Каждая модель по отдельности: ансамбль временно сужается до одного участника
+    raw_detections = [[] for _ in decoded]
+    try:
+        for member in members:
+            ensemble.models = [member]
+            for image in decoded[:warmup]:
+                ensemble.predict_batch([image], conf_threshold)
+            samples = []
+            for i, image in enumerate(decoded):
+                (detections,), sample = timed(ensemble.predict_batch, [image], conf_threshold)
+                raw_detections[i].extend(detections)
+                samples.extend(sample)
+            report['models'][member['name']] = latency_stats(samples)
+            print(f"   {member['name']}: p50 {report['models'][member['name']]['p50_ms']} мс")
+    finally:
+        ensemble.models = members
+
+    # Объединение (NMS/WBF) на тех же детекциях, что приходят от участников ансамбля
+    merge_samples = []
+    for detections in raw_detections:
+        _, samples = timed(ensemble._merge_detections, list(detections), repeat=5)
+        merge_samples.extend(samples)
+    report['merge'] = latency_stats(merge_samples)
+    report['merge']['avg_input_detections'] = round(float(np.mean([len(d) for d in raw_detections])), 1)
+
+    for image in decoded[:warmup]:
+        ensemble.predict_batch([image], conf_threshold)
+    ensemble_samples = []
+    for image in decoded:
+        _, samples = timed(ensemble.predict_batch, [image], conf_threshold)
+        ensemble_samples.extend(samples)
+    report['ensemble'] = latency_stats(ensemble_samples)
+    print(f"   ensemble: p50 {report['ensemble']['p50_ms']} мс")
+
+    report['throughput'] = []
+    for batch_size in batch_sizes:
+        batches = [decoded[i:i + batch_size] for i in range(0, len(decoded), batch_size)]
+        ensemble.predict_batch(batches[0], conf_threshold)
+        started = time.perf_counter()
+        batch_samples = []
+        for batch in batches:
+            _, samples = timed(ensemble.predict_batch, batch, conf_threshold)
+            batch_samples.extend(samples)
+        elapsed = time.perf_counter() - started
+        report['throughput'].append({
+            'batch_size': batch_size,
+            'images_per_sec': round(len(decoded) / elapsed, 2),
+            'batch_latency': latency_stats(batch_samples)
+        })
+        print(f"   batch {batch_size}: {report['throughput'][-1]['images_per_sec']} изобр/с")
+
+    report['memory'] = peak_memory(backend)
+    return report
+
+
+def _multipart(name, data, content_type='image/jpeg'):
+    boundary = uuid.uuid4().hex
+    body = (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="file"; filename="{name}"\r\n'
+        f"Content-Type: {content_type}\r\n\r\n"
+    ).encode('utf-8') + data + f"\r\n--{boundary}--\r\n".encode('utf-8')
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+def _unique_payload(data, i):
+    """Копия снимка с номером запроса после конца файла: декодеры JPEG/PNG игнорируют хвост,
+    а ключ кэша результатов (хэш байтов) у каждого запроса свой"""
+    return data + f"\n#benchmark-{i}".encode('utf-8')
+
+
+def _result_cache_stats(url, timeout=10):
+    """Счетчики кэша результатов сервиса из /health; None, если их нет"""
+    try:
+        with urllib.request.urlopen(f"{url.rstrip('/')}/health", timeout=timeout) as response:
+            return json.loads(response.read()).get('result_cache')
+    except (urllib.error.URLError, ValueError, OSError):
+        return None
+
+
+def benchmark_load(url, images_dir, concurrency=4, requests_total=200, limit=None, annotate='none', timeout=60,
+                   cache_hits=False):
+    """Генератор нагрузки на /api/analyze-image: concurrency параллельных клиентов.
+
+    По умолчанию каждый запрос уникален, чтобы замер шел через инференс, а не через кэш результатов;
+    cache_hits=True повторяет снимки как есть (замер пути попадания в кэш).
+    """
+    payloads = load_image_files(images_dir, limit)
+    if not payloads:
+        raise FileNotFoundError(f"Нет изображений в {images_dir}")
+    endpoint = f"{url.rstrip('/')}/api/analyze-image?annotate={annotate}"
+
+    def send(i):
+        name, data = payloads[i % len(payloads)]
+        body, content_type = _multipart(name, data if cache_hits else _unique_payload(data, i))
+        request = urllib.request.Request(endpoint, data=body, headers={'Content-Type': content_type})
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            status = e.code
+        except Exception:
+            status = 0
+        return status, time.perf_counter() - started
+
+    cache_before = _result_cache_stats(url)
+    print(f"🚀 {requests_total} запросов к {endpoint}, параллельно: {concurrency}")
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(send, range(requests_total)))
+    elapsed = time.perf_counter() - started
+
+    statuses = {}
+    for status, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    ok = [duration for status, duration in results if status == 200]
+
+    cache_after = _result_cache_stats(url)
+    result_cache = None
+    if cache_before is not None and cache_after is not None:
+        result_cache = {
+            'enabled': cache_after.get('max_mb', 0) > 0 or bool(cache_after.get('disk_dir')),
+            'hits': (cache_after['hits'] + cache_after['disk_hits']) - (cache_before['hits'] + cache_before['disk_hits']),
+            'misses': cache_after['misses'] - cache_before['misses']
+        }
+
+    return {
+        'meta': {
+            'timestamp': datetime.now().isoformat(),
+            'url': endpoint,
+            'images_dir': images_dir,
+            'images': len(payloads),
+            'concurrency': concurrency,
+            'requests': requests_total,
+            'unique_payloads': not cache_hits,
+            'result_cache': result_cache  # None — сервис не сообщил о кэше
+        },
+        'load': {
+            'elapsed_sec': round(elapsed, 2),
+            'requests_per_sec': round(requests_total / elapsed, 2),
+            'images_per_sec': round(len(ok) / elapsed, 2),
+            'statuses': statuses,
+            'latency': latency_stats(ok)
+        }
+    }
+
+
+def _flatten(report, prefix=''):
+    """Плоский словарь метрик *_ms и *_per_sec для сравнения прогонов"""
+    flat = {}
+    for key, value in report.items():
+        if key == 'meta':
+            continue
+        if key == 'throughput':
+            for item in value:
+                flat[f"throughput.batch_{item['batch_size']}.images_per_sec"] = item['images_per_sec']
+            continue
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{name}."))
+        elif isinstance(value, (int, float)) and (key.endswith('_ms') or key.endswith('_per_sec') or key.endswith('_mb')):
+            flat[name] = value
+    return flat
+
+
+def compare_reports(old_path, new_path):
+    """Сравнение двух прогонов: изменение каждой метрики в процентах"""
+    with open(old_path, 'r', encoding='utf-8') as f:
+        old = json.load(f)
+    with open(new_path, 'r', encoding='utf-8') as f:
+        new = json.load(f)
+
+    old_flat, new_flat = _flatten(old), _flatten(new)
+    rows = []
+    for key in sorted(old_flat.keys() & new_flat.keys()):
+        before, after = old_flat[key], new_flat[key]
+        delta = (after - before) / before * 100 if before else 0.0
+        rows.append({'metric': key, 'old': before, 'new': after, 'delta_pct': round(delta, 1)})
+
+    print(f"📊 {old_path} ({old['meta'].get('model_version', '-')}) → {new_path} ({new['meta'].get('model_version', '-')})")
+    for row in rows:
+        # Для задержек и памяти рост — регрессия, для пропускной способности — улучшение
+        worse = row['delta_pct'] < 0 if row['metric'].endswith('_per_sec') else row['delta_pct'] > 0
+        mark = '⚠️' if worse and abs(row['delta_pct']) >= 10 else '  '
+        print(f"{mark} {row['metric']:<45} {row['old']:>10} → {row['new']:>10} ({row['delta_pct']:+.1f}%)")
+    return rows
+
+
+def save_report(report, output):
+    output = output or os.path.join('benchmark_results', f"{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"✅ Результаты сохранены: {output}")
+    return output
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк ансамбля и API")
+    subparsers = parser.add_subparsers(dest='mode', required=True)
+
+    models_parser = subparsers.add_parser('models', help="Задержки моделей, ансамбля, NMS, декодирования")
+    models_parser.add_argument('--images', default='dataset/test/images')
+    models_parser.add_argument('--limit', type=int, default=None)
+    models_parser.add_argument('--batch-sizes', default='1,2,4,8')
+    models_parser.add_argument('--warmup', type=int, default=3)
+    models_parser.add_argument('--conf', type=float, default=0.25)
+    models_parser.add_argument('--backend', default=None, help="torch или onnx (по умолчанию ENSEMBLE_BACKEND)")
+    models_parser.add_argument('--output', default=None)
+
+    load_parser = subparsers.add_parser('load', help="Нагрузка на запущенный /api/analyze-image")
+    load_parser.add_argument('--url', default='http://localhost:8000')
+    load_parser.add_argument('--images', default='dataset/test/images')
+    load_parser.add_argument('--limit', type=int, default=None)
+    load_parser.add_argument('--concurrency', type=int, default=4)
+    load_parser.add_argument('--requests', type=int, default=200)
+    load_parser.add_argument('--annotate', default='none')
+    load_parser.add_argument('--cache-hits', action='store_true',
+                             help="Повторять снимки как есть: замер попаданий в кэш, а не инференса")
+    load_parser.add_argument('--output', default=None)
+
+    compare_parser = subparsers.add_parser('compare', help="Сравнение двух сохраненных прогонов")
+    compare_parser.add_argument('old')
+    compare_parser.add_argument('new')
+
+    args = parser.parse_args()
+
+    if args.mode == 'models':
+        batch_sizes = [int(size) for size in args.batch_sizes.split(',')]
+        report = benchmark_models(args.images, args.limit, batch_sizes, args.warmup, args.conf, args.backend)
+        save_report(report, args.output)
+    elif args.mode == 'load':
+        report = benchmark_load(args.url, args.images, args.concurrency, args.requests, args.limit, args.annotate,
+                                cache_hits=args.cache_hits)
+        print(f"📈 {report['load']['requests_per_sec']} запр/с, задержка: {report['load']['latency']}")
+        print(f"   Статусы: {report['load']['statuses']}")
+        if report['meta']['result_cache']:
+            print(f"   Кэш результатов: {report['meta']['result_cache']}")
+        save_report(report, args.output)
+    else:
+        compare_reports(args.old, args.new)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
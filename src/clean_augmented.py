@@ -1,4 +1,5 @@
 import os
+from dataset_index import AUGMENTED_PREFIXES, class_counts as count_classes, print_class_distribution
 
 def clean_augmented_files():
     """Удаляем все аугментированные файлы"""
@@ -9,13 +10,13 @@ def clean_augmented_files():
         
         # Удаляем аугментированные изображения
         for file in os.listdir(images_dir):
-            if file.startswith('aug_'):
+            if file.startswith(AUGMENTED_PREFIXES):
                 os.remove(os.path.join(images_dir, file))
                 print(f"🗑️ Удален: {file}")
         
         # Удаляем аугментированные разметки
         for file in os.listdir(labels_dir):
-            if file.startswith('aug_'):
+            if file.startswith(AUGMENTED_PREFIXES):
                 os.remove(os.path.join(labels_dir, file))
                 print(f"🗑️ Удален: {file}")
     
@@ -23,25 +24,11 @@ def clean_augmented_files():
 
 def check_dataset_size():
     """Проверяем размер датасета после очистки"""
-    from collections import Counter
-    
     class_names = ['Burn Mark', 'Coating_defects', 'Crack', 'EROSION']
-    class_counts = Counter()
-    
-    for split in ['train', 'valid']:
-        labels_dir = f'dataset/{split}/labels'
-        
-        for label_file in os.listdir(labels_dir):
-            with open(os.path.join(labels_dir, label_file), 'r') as f:
-                for line in f:
-                    class_id = int(line.strip().split()[0])
-                    class_counts[class_id] += 1
+    class_counts = count_classes(['train', 'valid'], num_classes=len(class_names))
     
     print("\n📊 Размер датасета после очистки:")
-    total = sum(class_counts.values())
-    for class_id, count in class_counts.items():
-        percentage = (count / total) * 100
-        print(f"   {class_names[class_id]}: {count} ({percentage:.1f}%)")
+    print_class_distribution(class_counts, class_names)
 
 if __name__ == "__main__":
     clean_augmented_files()
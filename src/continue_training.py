@@ -1,9 +1,11 @@
 from ultralytics import YOLO
-import torch
+from device import select_device, describe_device
 
 def train_100_epochs():
+    device = select_device()
+    
     print("🚀 ЗАПУСК ОБУЧЕНИЯ НА 100 ЭПОХ С ПРЕДОБУЧЕННЫМИ ВЕСАМИ")
-    print(f"🎯 GPU: {torch.cuda.get_device_name(0)}")
+    print(f"🎯 Устройство: {describe_device(device)}")
     
     model = YOLO('turbine_model/gpu_training_v1/weights/best.pt')
     
@@ -14,7 +16,7 @@ def train_100_epochs():
         epochs=100,     
         imgsz=640,
         batch=16,
-        device=0,
+        device=device,
         workers=2,
         lr0=0.01,    
         patience=25,
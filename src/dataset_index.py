@@ -0,0 +1,219 @@
+import os
+import numpy as np
+
+DATASET_DIR = os.getenv('DATASET_DIR', 'dataset')
+
+# Префиксы файлов, созданных аугментацией (augment_weak_classes.py)
+AUGMENTED_PREFIXES = ('aug_', 'gentle_')
+
+# Меняется при изменении формата файла индекса — старый индекс перестраивается
+INDEX_FORMAT = 1
+
+_indexes = {}
+
+
+def _parse_label_file(path):
+    """Строки YOLO: класс и нормализованный xywh; полигоны сегментации сводятся к охватывающему боксу"""
+    classes, boxes = [], []
+    with open(path, 'r') as f:
+        for line in f:
+            values = line.split()
+            if not values:
+                continue
+            classes.append(int(values[0]))
+            if len(values) == 5:
+                boxes.append([float(v) for v in values[1:]])
+            else:
+                points = np.array(values[1:], dtype=np.float32).reshape(-1, 2)
+                x1, y1 = points.min(axis=0)
+                x2, y2 = points.max(axis=0)
+                boxes.append([(x1 + x2) / 2, (y1 + y2) / 2, x2 - x1, y2 - y1])
+    return classes, boxes
+
+
+class LabelIndex:
+    """Разметка одной части датасета (train/valid/test) в колоночном виде.
+
+    Одна строка на бокс: image_id (индекс в images), cls, box (нормализованный xywh).
+    Индекс хранится рядом с разметкой в labels.index.npz; при загрузке сверяются размер и mtime
+    каждого .txt, и заново разбираются только новые и измененные файлы.
+    """
+
+    def __init__(self, split, dataset_dir=None):
+        self.split = split
+        self.labels_dir = os.path.join(dataset_dir or DATASET_DIR, split, 'labels')
+        self.cache_path = os.path.join(dataset_dir or DATASET_DIR, split, 'labels.index.npz')
+
+        self.images = np.array([], dtype=str)  # Имена файлов разметки без .txt
+        self.mtimes = np.array([], dtype=np.int64)
+        self.sizes = np.array([], dtype=np.int64)
+        self.image_id = np.array([], dtype=np.int32)
+        self.cls = np.array([], dtype=np.int16)
+        self.boxes = np.zeros((0, 4), dtype=np.float32)
+        self.reparsed = 0
+
+    def load(self):
+        """Актуальный индекс: кэш с диска плюс разбор изменившихся файлов"""
+        files = self._scan()
+        cached = self._read_cache()
+        self.reparsed = 0
+
+        if cached is not None and cached['images'].tolist() == [name for name, _, _ in files] \
+                and np.array_equal(cached['mtimes'], [m for _, m, _ in files]) \
+                and np.array_equal(cached['sizes'], [s for _, _, s in files]):
+            self._assign(cached)
+            return self
+
+        # Строки неизменившихся файлов переносятся из кэша, остальные разбираются
+        previous = {}
+        if cached is not None:
+            order = np.argsort(cached['image_id'], kind='stable')
+            bounds = np.searchsorted(cached['image_id'][order], np.arange(len(cached['images']) + 1))
+            for i, name in enumerate(cached['images'].tolist()):
+                rows = order[bounds[i]:bounds[i + 1]]
+                previous[name] = (cached['mtimes'][i], cached['sizes'][i], cached['cls'][rows], cached['boxes'][rows])
+
+        ids, classes, boxes = [], [], []
+        for i, (name, mtime, size) in enumerate(files):
+            entry = previous.get(name)
+            if entry is not None and entry[0] == mtime and entry[1] == size:
+                file_classes, file_boxes = entry[2], entry[3]
+            else:
+                file_classes, file_boxes = _parse_label_file(os.path.join(self.labels_dir, f"{name}.txt"))
+                self.reparsed += 1
+            ids.append(np.full(len(file_classes), i, dtype=np.int32))
+            classes.append(np.asarray(file_classes, dtype=np.int16))
+            boxes.append(np.asarray(file_boxes, dtype=np.float32).reshape(-1, 4))
+
+        self._assign({
+            'images': np.array([name for name, _, _ in files], dtype=str),
+            'mtimes': np.array([m for _, m, _ in files], dtype=np.int64),
+            'sizes': np.array([s for _, _, s in files], dtype=np.int64),
+            'image_id': np.concatenate(ids) if ids else np.array([], dtype=np.int32),
+            'cls': np.concatenate(classes) if classes else np.array([], dtype=np.int16),
+            'boxes': np.concatenate(boxes) if boxes else np.zeros((0, 4), dtype=np.float32)
+        })
+        self._write_cache()
+        return self
+
+    def _scan(self):
+        if not os.path.isdir(self.labels_dir):
+            return []
+        files = []
+        with os.scandir(self.labels_dir) as entries:
+            for entry in entries:
+                if entry.name.endswith('.txt') and entry.is_file():
+                    stat = entry.stat()
+                    files.append((entry.name[:-4], stat.st_mtime_ns, stat.st_size))
+        files.sort()
+        return files
+
+    def _read_cache(self):
+        try:
+            with np.load(self.cache_path, allow_pickle=False) as data:
+                if int(data['format']) != INDEX_FORMAT:
+                    return None
+                return {key: data[key] for key in ('images', 'mtimes', 'sizes', 'image_id', 'cls', 'boxes')}
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def _write_cache(self):
+        # Атомарная запись: параллельно запущенный скрипт не прочитает половину файла
+        tmp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, format=INDEX_FORMAT, images=self.images, mtimes=self.mtimes, sizes=self.sizes,
+                         image_id=self.image_id, cls=self.cls, boxes=self.boxes)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            print(f"⚠️ Не удалось сохранить индекс разметки: {e}")
+
+    def _assign(self, data):
+        self.images = data['images']
+        self.mtimes = data['mtimes']
+        self.sizes = data['sizes']
+        self.image_id = data['image_id']
+        self.cls = data['cls']
+        self.boxes = data['boxes']
+
+    def __len__(self):
+        return len(self.images)
+
+    @property
+    def num_classes(self):
+        return int(self.cls.max()) + 1 if len(self.cls) else 0
+
+    def augmented_mask(self):
+        """Признак аугментированного изображения по префиксу имени, по одному на изображение"""
+        mask = np.zeros(len(self.images), dtype=bool)
+        for prefix in AUGMENTED_PREFIXES:
+            mask |= np.char.startswith(self.images, prefix)
+        return mask
+
+    def _box_mask(self, originals_only):
+        if not originals_only:
+            return slice(None)
+        return ~self.augmented_mask()[self.image_id]
+
+    def class_counts(self, num_classes=None, originals_only=False):
+        """Число боксов каждого класса"""
+        mask = self._box_mask(originals_only)
+        return np.bincount(self.cls[mask], minlength=num_classes or self.num_classes)
+
+    def class_matrix(self, num_classes=None):
+        """Множества классов изображений: bool-матрица (изображения × классы)"""
+        matrix = np.zeros((len(self.images), max(num_classes or 0, self.num_classes)), dtype=bool)
+        matrix[self.image_id, self.cls] = True
+        return matrix
+
+    def images_with_classes(self, class_ids, originals_only=False):
+        """Имена изображений (без расширения), где есть хотя бы один из классов"""
+        selected = np.zeros(len(self.images), dtype=bool)
+        selected[self.image_id[np.isin(self.cls, class_ids)]] = True
+        if originals_only:
+            selected &= ~self.augmented_mask()
+        return self.images[selected].tolist()
+
+    def box_size_histogram(self, bins=10, num_classes=None):
+        """Гистограммы размера боксов (sqrt(w*h) в долях кадра) по классам: (границы, {класс: счетчики})"""
+        sizes = np.sqrt(self.boxes[:, 2] * self.boxes[:, 3])
+        edges = np.histogram_bin_edges(sizes, bins=bins, range=(0.0, 1.0))
+        return edges, {
+            class_id: np.histogram(sizes[self.cls == class_id], bins=edges)[0]
+            for class_id in range(num_classes or self.num_classes)
+        }
+
+
+def load_index(split, dataset_dir=None):
+    """Индекс части датасета; в пределах процесса объект переиспользуется и только сверяется с диском"""
+    key = (dataset_dir or DATASET_DIR, split)
+    index = _indexes.get(key)
+    if index is None:
+        index = _indexes[key] = LabelIndex(split, dataset_dir)
+    return index.load()
+
+
+def class_counts(splits=('train', 'valid'), num_classes=None, dataset_dir=None):
+    """Суммарное число боксов каждого класса по нескольким частям датасета"""
+    indexes = [load_index(split, dataset_dir) for split in splits]
+    num_classes = max([num_classes or 0] + [index.num_classes for index in indexes])
+    return sum((index.class_counts(num_classes) for index in indexes), np.zeros(num_classes, dtype=np.int64))
+
+
+def print_class_distribution(counts, class_names):
+    total = int(counts.sum())
+    for class_id, count in enumerate(counts):
+        percentage = (count / total) * 100 if total else 0
+        name = class_names[class_id] if class_id < len(class_names) else str(class_id)
+        print(f"   {name}: {count} ({percentage:.1f}%)")
+
+
+if __name__ == "__main__":
+    class_names = ['Burn Mark', 'Coating_defects', 'Crack', 'EROSION']
+    for split in ('train', 'valid', 'test'):
+        index = load_index(split)
+        print(f"📂 {split}: изображений {len(index)}, боксов {len(index.cls)}, разобрано заново {index.reparsed}")
+        print_class_distribution(index.class_counts(len(class_names)), class_names)
+        edges, histograms = index.box_size_histogram(bins=5, num_classes=len(class_names))
+        for class_id, counts in histograms.items():
+            print(f"   📏 {class_names[class_id]}: {counts.tolist()} (границы {[round(float(e), 2) for e in edges]})")
@@ -0,0 +1,65 @@
+import os
+import torch
+
+
+def select_device(preference=None):
+    """Выбор устройства: 'auto', 'cpu', 'cuda' или 'cuda:N' (по умолчанию из DEVICE)"""
+    preference = str(preference or os.getenv('DEVICE', 'auto')).lower()
+
+    if preference.isdigit():
+        preference = f"cuda:{preference}"
+
+    if preference == 'cpu':
+        return 'cpu'
+
+    if not torch.cuda.is_available():
+        if preference != 'auto':
+            print(f"⚠️ CUDA недоступна, вместо {preference} используется CPU")
+        return 'cpu'
+
+    if preference in ('auto', 'cuda'):
+        return 'cuda:0'
+
+    index = int(preference.split(':', 1)[1]) if ':' in preference else 0
+    if index >= torch.cuda.device_count():
+        print(f"⚠️ Устройство {preference} не найдено, используется cuda:0")
+        index = 0
+    return f"cuda:{index}"
+
+
+def is_cuda(device):
+    return str(device).startswith('cuda')
+
+
+def configure_cpu_threads(num_threads=None):
+    """Число потоков torch для FP32-инференса на CPU (по умолчанию из CPU_THREADS или все ядра)"""
+    num_threads = int(num_threads or os.getenv('CPU_THREADS', 0) or os.cpu_count() or 1)
+    torch.set_num_threads(num_threads)
+    return num_threads
+
+
+def empty_cache(device):
+    if is_cuda(device):
+        torch.cuda.empty_cache()
+
+
+def gpu_memory():
+    """Выделенная и зарезервированная torch видеопамять по устройствам, в байтах"""
+    if not torch.cuda.is_available():
+        return {}
+    return {
+        f"cuda:{index}": {
+            'allocated': torch.cuda.memory_allocated(index),
+            'reserved': torch.cuda.memory_reserved(index)
+        }
+        for index in range(torch.cuda.device_count())
+    }
+
+
+def describe_device(device):
+    """Строка с описанием устройства для логов"""
+    if is_cuda(device):
+        index = int(device.split(':', 1)[1])
+        props = torch.cuda.get_device_properties(index)
+        return f"{torch.cuda.get_device_name(index)} ({props.total_memory / 1024**3:.1f} GB)"
+    return f"CPU ({torch.get_num_threads()} потоков)"
@@ -1,120 +1,118 @@
 import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import cv2
 import numpy as np
 from ultralytics import YOLO
 import torch
+from device import select_device, is_cuda, configure_cpu_threads, describe_device
+from ensemble_base import EnsembleBase
+from residency import get_manager
+import metrics
 
-class FinalEnsemble:
-    def __init__(self):
-        self.models = []
-        self.model_names = []
-        self.class_names = ['Burn Mark', 'Coating_defects', 'Crack', 'EROSION']
+class FinalEnsemble(EnsembleBase):
+    def __init__(self, merge_mode=None, iou_threshold=None, device=None, cascade=None, config=None, resident=None):
+        """config — состав ансамбля (по умолчанию dataset/ensemble.yaml); resident — текущий ансамбль,
+        модели которого с теми же весами переиспользуются без загрузки"""
+        super().__init__(merge_mode, iou_threshold, cascade, config)
         
-        self._load_models()
-    
-    def _load_models(self):
-        model_configs = [
-            {'path': 'turbine_model/augmented_training_v2/weights/best.pt', 'name': 'v2', 'weight': 1.0},
-            {'path': 'turbine_model/augmented_training_v3/weights/best.pt', 'name': 'v3', 'weight': 1.0},
-            {'path': 'turbine_model/augmented_training_yolo8n_v1/weights/best.pt', 'name': 'yolo8n', 'weight': 0.8},
-        ]
+        # FP16 на GPU, FP32 с настроенным числом потоков на CPU
+        self.device = select_device(device)
+        self.half = is_cuda(self.device)
+        if not self.half:
+            configure_cpu_threads()
+        print(f"Устройство: {describe_device(self.device)}, FP16: {self.half}")
+        
+        # Бюджет памяти моделей на устройстве (MODEL_MEMORY_BUDGET_MB), общий для всех ансамблей процесса
+        self.residency = get_manager(self.device)
+        self._load_models(resident if resident is not None and resident.device == self.device else None)
         
-        for config in model_configs:
-            if os.path.exists(config['path']):
+        # Модели ансамбля работают параллельно, по одному потоку на модель
+        self._executor = ThreadPoolExecutor(max_workers=max(1, len(self.models)),
+                                            thread_name_prefix='ensemble')
+    
+    def _load_models(self, resident=None):
+        for config in self.config['models']:
+            member = self._resident_member(resident, config['path'])
+            if member is not None:
+                self._keep_resident(member, config)
+            elif os.path.exists(config['path']):
                 try:
+                    started = time.perf_counter()
                     model = YOLO(config['path'])
-                    model.model.cuda()  # На GPU
+                    model.model.to(self.device)
+                    mtime = os.path.getmtime(config['path'])  # Для версии набора моделей
+                    # Предиктор YOLO не потокобезопасен: блокировка хранится вместе с моделью
+                    entry = self.residency.register(config['path'], mtime, model, threading.Lock())
                     self.models.append({
-                        'model': model,
+                        'entry': entry,
                         'name': config['name'],
-                        'weight': config['weight']
+                        'path': config['path'],
+                        'mtime': mtime,
+                        'weight': config['weight'],
+                        'load_time': time.perf_counter() - started
                     })
-                    print(f"Загружена: {config['name']} ({config['path']})")
+                    print(f"Загружена: {config['name']} ({config['path']}) за {self.models[-1]['load_time']:.2f} с")
                 except Exception as e:
                     print(f"Ошибка загрузки {config['name']}: {e}")
         
         print(f"Ensemble готов! Моделей: {len(self.models)}")
     
-    def predict(self, image, conf_threshold=0.25):
-        all_detections = []
-        
+    def _after_fork(self):
+        """Потоки и блокировки не переживают fork — пересоздаем их в дочернем процессе"""
+        super()._after_fork()
+        self.residency._after_fork()
         for model_info in self.models:
-            try:
-                results = model_info['model'](image, conf=conf_threshold, device=0, verbose=False)
-                
-                if len(results) > 0 and results[0].boxes is not None:
-                    for box in results[0].boxes:
-                        detection = {
-                            'xyxy': box.xyxy.cpu().numpy()[0],
-                            'conf': box.conf.cpu().numpy()[0] * model_info['weight'],  # Взвешенная уверенность
-                            'cls': box.cls.cpu().numpy()[0],
-                            'model': model_info['name']
-                        }
-                        all_detections.append(detection)
-            except Exception as e:
-                print(f"Ошибка в модели {model_info['name']}: {e}")
-        
-        # Применяем NMS к объединенным детекциям
-        final_detections = self._apply_nms(all_detections)
-        
-        # Визуализация
-        result_image = self._visualize_detections(image, final_detections)
-        
-        return result_image, final_detections
-    
-    def _apply_nms(self, detections, iou_threshold=0.5):
-        """Non-Maximum Suppression"""
-        if not detections:
-            return []
-        
-        detections.sort(key=lambda x: x['conf'], reverse=True)
-        final_detections = []
-        
-        while detections:
-            current = detections[0]
-            final_detections.append(current)
-            
-            detections = [det for det in detections[1:] 
-                         if self._calculate_iou(current['xyxy'], det['xyxy']) < iou_threshold]
-        
-        return final_detections
+            model_info['entry']['lock'] = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, len(self.models)),
+                                            thread_name_prefix='ensemble')
     
-    def _calculate_iou(self, box1, box2):
-        """Вычисление IoU"""
-        x1_1, y1_1, x2_1, y2_1 = box1
-        x1_2, y1_2, x2_2, y2_2 = box2
-        
-        xi1 = max(x1_1, x1_2)
-        yi1 = max(y1_1, y1_2)
-        xi2 = min(x2_1, x2_2)
-        yi2 = min(y2_1, y2_2)
+    def _run_members(self, members, images, conf_threshold):
+        """Все модели members запускаются одновременно, каждая на весь батч"""
+        futures = [self._executor.submit(self._run_model, model_info, images, conf_threshold)
+                   for model_info in members]
         
-        inter_area = max(0, xi2 - xi1) * max(0, yi2 - yi1)
-        box1_area = (x2_1 - x1_1) * (y2_1 - y1_1)
-        box2_area = (x2_2 - x1_2) * (y2_2 - y1_2)
-        union_area = box1_area + box2_area - inter_area
-        
-        return inter_area / union_area if union_area > 0 else 0
+        all_detections = [[] for _ in images]
+        for model_info, future in zip(members, futures):
+            batch_detections, duration = future.result()
+            metrics.record('model', duration, model=model_info['name'])
+            for i, detections in enumerate(batch_detections):
+                all_detections[i].extend(detections)
+        return all_detections
     
-    def _visualize_detections(self, image, detections):
-        """Визуализация детекций"""
-        result_image = image.copy()
-        colors = [(0, 255, 0), (255, 255, 0), (0, 0, 255), (255, 0, 0)]  # Зеленый, Желтый, Красный, Синий
+    def _run_model(self, model_info, images, conf_threshold):
+        """Прогон одной модели на батче; результат каждого кадра копируется на CPU одним тензором.
         
-        for det in detections:
-            x1, y1, x2, y2 = map(int, det['xyxy'])
-            cls_id = int(det['cls'])
-            conf = det['conf']
-            
-            color = colors[cls_id]
-            label = f"{self.class_names[cls_id]}: {conf:.2f}"
+        Возвращает (детекции по кадрам, время инференса без ожидания блокировки модели)
+        """
+        batch_detections = [[] for _ in images]
+        duration = 0.0
+        try:
+            entry = model_info['entry']
+            with entry['lock'], self.residency.use(entry) as model:
+                started = time.perf_counter()
+                results = model(list(images), conf=conf_threshold, device=self.device,
+                                half=self.half, verbose=False)
+                duration = time.perf_counter() - started
             
-            # Рисуем bbox и подпись
-            cv2.rectangle(result_image, (x1, y1), (x2, y2), color, 2)
-            cv2.putText(result_image, label, (x1, y1 - 10), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
+            for i, result in enumerate(results):
+                if result.boxes is None or len(result.boxes) == 0:
+                    continue
+                
+                # boxes.data: [x1, y1, x2, y2, conf, cls] — одна синхронизация на кадр
+                data = result.boxes.data.cpu().numpy()
+                for row in data:
+                    batch_detections[i].append({
+                        'xyxy': row[:4],
+                        'conf': row[4] * model_info['weight'],  # Взвешенная уверенность
+                        'cls': row[-1],
+                        'model': model_info['name']
+                    })
+        except Exception as e:
+            print(f"Ошибка в модели {model_info['name']}: {e}")
         
-        return result_image
+        return batch_detections, duration
 
 def test_final_ensemble():
     """Тестирование финального ensemble"""
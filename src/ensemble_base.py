@@ -0,0 +1,334 @@
+import os
+import json
+import hashlib
+import threading
+import cv2
+import numpy as np
+import metrics
+
+# Встроенный состав ансамбля, если нет dataset/ensemble.yaml (см. ensemble_config)
+MODEL_CONFIGS = [
+    {'path': 'turbine_model/augmented_training_v2/weights/best.pt', 'name': 'v2', 'weight': 1.0},
+    {'path': 'turbine_model/augmented_training_v3/weights/best.pt', 'name': 'v3', 'weight': 1.0},
+    {'path': 'turbine_model/augmented_training_yolo8n_v1/weights/best.pt', 'name': 'yolo8n', 'weight': 0.8},
+]
+
+CLASS_NAMES = ['Burn Mark', 'Coating_defects', 'Crack', 'EROSION']
+
+class Detections(list):
+    """Детекции кадра и путь через каскад: 'full' — весь ансамбль, 'fast' — только быстрая модель,
+    'escalated' — быстрая модель, затем остальные"""
+    def __init__(self, detections=(), path='full'):
+        super().__init__(detections)
+        self.path = path
+
+class EnsembleBase:
+    """Общая часть ансамблей: объединение детекций моделей и визуализация.
+    
+    Не зависит от torch/ultralytics, чтобы CPU-бэкенды не тянули их при импорте.
+    """
+    def __init__(self, merge_mode=None, iou_threshold=None, cascade=None, config=None):
+        if config is None:
+            from ensemble_config import load_config
+            config = load_config()
+        self.config = config
+        self.models = []
+        self.model_names = []
+        self.class_names = list(config['names'])
+        
+        # Способ объединения детекций моделей: 'nms' или 'wbf' (Weighted Boxes Fusion)
+        merge_mode = merge_mode or config['merge_mode']
+        iou_threshold = config['iou_threshold'] if iou_threshold is None else iou_threshold
+        if merge_mode not in ('nms', 'wbf'):
+            raise ValueError(f"Неизвестный режим объединения: {merge_mode}")
+        self.merge_mode = merge_mode
+        self.iou_threshold = iou_threshold
+        
+        # Каскад: сначала быстрая модель, остальные — только для кадров с находками или сомнениями.
+        # Кадр эскалируется, если у быстрой модели есть кандидат с уверенностью в [low, high)
+        self.cascade = os.getenv('CASCADE', '0') == '1' if cascade is None else cascade
+        self.cascade_first = os.getenv('CASCADE_FIRST', 'yolo8n')
+        low, high = (float(v) for v in os.getenv('CASCADE_BAND', '0.1,1.0').split(','))
+        self.cascade_band = (low, high)
+        self._cascade_counts = {'fast': 0, 'escalated': 0}
+        self._cascade_lock = threading.Lock()
+    
+    def predict(self, image, conf_threshold=0.25):
+        final_detections = self.predict_batch([image], conf_threshold)[0]
+        
+        # Визуализация
+        result_image = self._visualize_detections(image, final_detections)
+        
+        return result_image, final_detections
+    
+    def predict_batch(self, images, conf_threshold=0.25):
+        """Пакетное предсказание: каждая модель — один проход на весь список кадров"""
+        if not images:
+            return []
+        
+        first = self._cascade_member()
+        if first is not None:
+            return self._predict_cascade(first, images, conf_threshold)
+        
+        all_detections = self._run_members(self.models, images, conf_threshold)
+        
+        # Объединяем детекции моделей для каждого кадра
+        with metrics.span('merge'):
+            return [self._merge_detections(detections) for detections in all_detections]
+    
+    def _run_members(self, members, images, conf_threshold):
+        """Прогон моделей members на батче; детекции всех моделей по кадрам, без объединения"""
+        raise NotImplementedError
+    
+    def _cascade_member(self):
+        """Быстрая модель каскада или None, если каскад выключен или ее нет среди загруженных"""
+        if not self.cascade or len(self.models) < 2:
+            return None
+        return next((m for m in self.models if m['name'] == self.cascade_first), None)
+    
+    def _predict_cascade(self, first, images, conf_threshold):
+        """Быстрая модель на всех кадрах, остальные — только на кадрах с кандидатами в полосе неопределенности"""
+        low, high = self.cascade_band
+        first_pass = self._run_members([first], images, min(low, conf_threshold))
+        
+        results = [None] * len(images)
+        escalate, kept = [], {}
+        for i, detections in enumerate(first_pass):
+            # Порог и полоса сравниваются с исходной уверенностью модели, без веса голоса
+            raw_conf = [det['conf'] / first['weight'] for det in detections]
+            confident = [det for det, conf in zip(detections, raw_conf) if conf >= conf_threshold]
+            if any(low <= conf < high for conf in raw_conf):
+                escalate.append(i)
+                kept[i] = confident
+            else:
+                results[i] = Detections(confident, path='fast')
+        
+        if escalate:
+            rest = [m for m in self.models if m is not first]
+            rest_pass = self._run_members(rest, [images[i] for i in escalate], conf_threshold)
+            with metrics.span('merge'):
+                for i, detections in zip(escalate, rest_pass):
+                    results[i] = Detections(self._merge_detections(kept[i] + detections), path='escalated')
+        
+        with self._cascade_lock:
+            self._cascade_counts['escalated'] += len(escalate)
+            self._cascade_counts['fast'] += len(images) - len(escalate)
+        return results
+    
+    def cascade_stats(self):
+        with self._cascade_lock:
+            counts = dict(self._cascade_counts)
+        total = counts['fast'] + counts['escalated']
+        return {
+            'enabled': self._cascade_member() is not None,
+            'first': self.cascade_first,
+            'band': list(self.cascade_band),
+            **counts,
+            'escalation_rate': round(counts['escalated'] / total, 3) if total else 0
+        }
+    
+    def predict_tiled(self, image, conf_threshold=0.25, tile_size=640, overlap=0.2,
+                      min_tile_std=8.0, tile_batch=8, predict_batch=None):
+        """Нарезанный инференс для больших снимков: перекрывающиеся тайлы tile_size без сжатия.
+        
+        Тайлы идут через ансамбль батчами, плюс один проход по целому кадру для крупных дефектов;
+        модели объединяются внутри каждого прохода (NMS/WBF), а дубли на стыках тайлов — NMS.
+        Однородные тайлы (стандартное отклонение яркости ниже min_tile_std) — фон, они пропускаются;
+        None — не пропускать.
+        """
+        predict_batch = predict_batch or self.predict_batch
+        h, w = image.shape[:2]
+        if max(h, w) <= tile_size:
+            return predict_batch([image], conf_threshold)[0]
+        
+        tiles, offsets = [], []
+        for y, x in self._tile_origins(h, w, tile_size, overlap):
+            tile = image[y:y + tile_size, x:x + tile_size]
+            if min_tile_std is not None and self._is_background(tile, min_tile_std):
+                continue
+            tiles.append(tile)
+            offsets.append(np.array([x, y, x, y], dtype=np.float32))
+        
+        # Целый кадр — для дефектов крупнее тайла
+        whole = predict_batch([image], conf_threshold)[0]
+        all_detections = list(whole)
+        paths = {getattr(whole, 'path', 'full')}
+        for start in range(0, len(tiles), tile_batch):
+            results = predict_batch(tiles[start:start + tile_batch], conf_threshold)
+            for detections, offset in zip(results, offsets[start:start + tile_batch]):
+                all_detections.extend({**det, 'xyxy': det['xyxy'] + offset} for det in detections)
+                paths.add(getattr(detections, 'path', 'full'))
+        
+        # Снимок считается эскалированным, если эскалирован хотя бы один тайл
+        path = 'escalated' if 'escalated' in paths else 'fast' if paths == {'fast'} else 'full'
+        # Детекции кадра и тайлов уже объединены predict_batch; на стыках — только NMS:
+        # повторный WBF принял бы слитые боксы за голос одной модели и снова поделил уверенность
+        return Detections(self._apply_nms(all_detections, self.iou_threshold), path=path)
+    
+    @staticmethod
+    def _tile_origins(h, w, tile_size, overlap):
+        """Левые верхние углы тайлов; последний ряд и столбец прижаты к краю кадра"""
+        step = max(1, int(tile_size * (1 - overlap)))
+        ys = list(range(0, max(h - tile_size, 0) + 1, step))
+        xs = list(range(0, max(w - tile_size, 0) + 1, step))
+        if ys[-1] + tile_size < h:
+            ys.append(h - tile_size)
+        if xs[-1] + tile_size < w:
+            xs.append(w - tile_size)
+        return [(y, x) for y in ys for x in xs]
+    
+    @staticmethod
+    def _is_background(tile, min_tile_std):
+        """Однородный тайл без деталей (небо, фон, засветка)"""
+        # Прореживание, а не усреднение: тонкая трещина не должна размыться до фона
+        sample = np.ascontiguousarray(tile[::4, ::4])
+        gray = cv2.cvtColor(sample, cv2.COLOR_BGR2GRAY) if sample.ndim == 3 else sample
+        return gray.std() < min_tile_std
+    
+    @property
+    def version(self):
+        """Версия набора моделей: меняется при смене весов, состава ансамбля или способа объединения"""
+        members = [[m['name'], m['weight'], m['path'], m['mtime']] for m in self.models]
+        state = [members, self.merge_mode, self.iou_threshold]
+        if self._cascade_member() is not None:
+            state.append([self.cascade_first, list(self.cascade_band)])
+        state = json.dumps(state)
+        return hashlib.sha1(state.encode('utf-8')).hexdigest()[:12]
+    
+    @staticmethod
+    def _resident_member(resident, path):
+        """Модель предыдущего ансамбля с тем же файлом весов (путь и время изменения) — без перезагрузки"""
+        if resident is None or not os.path.exists(path):
+            return None
+        mtime = os.path.getmtime(path)
+        return next((m for m in resident.models if m['path'] == path and m['mtime'] == mtime), None)
+    
+    def _keep_resident(self, member, config):
+        """Участник из предыдущего ансамбля с именем и весом из новой конфигурации"""
+        self.models.append({**member, 'name': config['name'], 'weight': config['weight'],
+                            'load_time': 0.0, 'reused': True})
+        print(f"Оставлена в памяти: {config['name']} ({member['path']})")
+    
+    def _after_fork(self):
+        """Вызывается в дочернем процессе после fork"""
+        self._cascade_lock = threading.Lock()
+    
+    def _merge_detections(self, detections):
+        """Объединение детекций всех моделей выбранным способом"""
+        if self.merge_mode == 'wbf':
+            return self._apply_wbf(detections, self.iou_threshold)
+        return self._apply_nms(detections, self.iou_threshold)
+    
+    def _apply_nms(self, detections, iou_threshold=0.5):
+        """Векторизованный Non-Maximum Suppression отдельно по каждому классу"""
+        if not detections:
+            return []
+        
+        boxes, scores, classes = self._to_arrays(detections)
+        keep = self._nms_indices(boxes, scores, classes, iou_threshold)
+        
+        return [detections[j] for j in keep]
+    
+    @classmethod
+    def _nms_indices(cls, boxes, scores, classes, iou_threshold=0.5):
+        """Индексы оставшихся боксов (по убыванию уверенности) после NMS по классам"""
+        order = np.argsort(-scores, kind='stable')
+        
+        # Матрица IoU считается один раз; боксы разных классов друг друга не подавляют
+        iou = cls._iou_matrix(boxes[order], boxes[order])
+        suppress = (iou >= iou_threshold) & (classes[order][:, None] == classes[order][None, :])
+        
+        keep = np.ones(len(order), dtype=bool)
+        for i in range(len(order)):
+            if keep[i]:
+                keep[i + 1:] &= ~suppress[i, i + 1:]
+        
+        return order[keep]
+    
+    def _apply_wbf(self, detections, iou_threshold=0.5):
+        """Weighted Boxes Fusion с учетом весов моделей ансамбля"""
+        if not detections:
+            return []
+        
+        boxes, scores, classes = self._to_arrays(detections)
+        model_weights = {m['name']: m['weight'] for m in self.models}
+        total_weight = sum(model_weights.values()) or 1.0
+        
+        fused_detections = []
+        for cls_id in np.unique(classes):
+            idx = np.flatnonzero(classes == cls_id)
+            idx = idx[np.argsort(-scores[idx], kind='stable')]
+            
+            clusters = []  # Индексы детекций в каждом кластере
+            fused_boxes = np.empty((0, 4), dtype=np.float32)
+            
+            for j in idx:
+                if len(clusters):
+                    ious = self._iou_matrix(boxes[j:j + 1], fused_boxes)[0]
+                    best = int(np.argmax(ious))
+                    if ious[best] > iou_threshold:
+                        clusters[best].append(j)
+                        members = clusters[best]
+                        # Бокс кластера — среднее боксов, взвешенное по уверенности
+                        fused_boxes[best] = np.average(boxes[members], axis=0, weights=scores[members])
+                        continue
+                
+                clusters.append([j])
+                fused_boxes = np.vstack([fused_boxes, boxes[j]])
+            
+            for members, fused_box in zip(clusters, fused_boxes):
+                member_models = sorted({detections[k]['model'] for k in members})
+                # Штраф за кластеры, которые подтвердила только часть моделей
+                support = min(sum(model_weights.get(name, 1.0) for name in member_models), total_weight)
+                fused_detections.append({
+                    'xyxy': fused_box,
+                    'conf': scores[members].mean() * support / total_weight,
+                    'cls': np.float32(cls_id),
+                    'model': '+'.join(member_models)
+                })
+        
+        fused_detections.sort(key=lambda x: x['conf'], reverse=True)
+        return fused_detections
+    
+    @staticmethod
+    def _to_arrays(detections):
+        """Детекции в массивы: боксы (N, 4), уверенности (N,), классы (N,)"""
+        boxes = np.array([det['xyxy'] for det in detections], dtype=np.float32).reshape(-1, 4)
+        scores = np.array([det['conf'] for det in detections], dtype=np.float32)
+        classes = np.array([det['cls'] for det in detections]).astype(np.int64)
+        return boxes, scores, classes
+    
+    @staticmethod
+    def _iou_matrix(boxes1, boxes2):
+        """Матрица IoU между двумя наборами боксов (N, 4) и (M, 4)"""
+        xi1 = np.maximum(boxes1[:, None, 0], boxes2[None, :, 0])
+        yi1 = np.maximum(boxes1[:, None, 1], boxes2[None, :, 1])
+        xi2 = np.minimum(boxes1[:, None, 2], boxes2[None, :, 2])
+        yi2 = np.minimum(boxes1[:, None, 3], boxes2[None, :, 3])
+        
+        inter_area = np.clip(xi2 - xi1, 0, None) * np.clip(yi2 - yi1, 0, None)
+        area1 = (boxes1[:, 2] - boxes1[:, 0]) * (boxes1[:, 3] - boxes1[:, 1])
+        area2 = (boxes2[:, 2] - boxes2[:, 0]) * (boxes2[:, 3] - boxes2[:, 1])
+        union_area = area1[:, None] + area2[None, :] - inter_area
+        
+        return np.divide(inter_area, union_area, out=np.zeros_like(inter_area), where=union_area > 0)
+    
+    def _visualize_detections(self, image, detections):
+        """Визуализация детекций"""
+        result_image = image.copy()
+        colors = [(0, 255, 0), (255, 255, 0), (0, 0, 255), (255, 0, 0)]  # Зеленый, Желтый, Красный, Синий
+        
+        for det in detections:
+            x1, y1, x2, y2 = map(int, det['xyxy'])
+            cls_id = int(det['cls'])
+            conf = det['conf']
+            
+            color = colors[cls_id]
+            label = f"{self.class_names[cls_id]}: {conf:.2f}"
+            
+            # Рисуем bbox и подпись
+            cv2.rectangle(result_image, (x1, y1), (x2, y2), color, 2)
+            cv2.putText(result_image, label, (x1, y1 - 10), 
+                       cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
+        
+        return result_image
@@ -0,0 +1,72 @@
+import os
+import yaml
+from ensemble_base import MODEL_CONFIGS, CLASS_NAMES
+
+# Декларативный состав ансамбля рядом с dataset/data.yaml
+ENSEMBLE_CONFIG = os.getenv('ENSEMBLE_CONFIG', 'dataset/ensemble.yaml')
+
+
+class ConfigError(ValueError):
+    """Некорректная конфигурация ансамбля"""
+
+
+def _class_names(config_path, data):
+    if data.get('names'):
+        return list(data['names'])
+    data_yaml = os.path.join(os.path.dirname(config_path), 'data.yaml')
+    if os.path.exists(data_yaml):
+        with open(data_yaml, 'r', encoding='utf-8') as f:
+            names = (yaml.safe_load(f) or {}).get('names')
+        if names:
+            return list(names.values()) if isinstance(names, dict) else list(names)
+    return list(CLASS_NAMES)
+
+
+def load_config(path=None):
+    """Конфигурация ансамбля из YAML; без файла — встроенный состав (MODEL_CONFIGS)"""
+    path = path or ENSEMBLE_CONFIG
+    if not os.path.exists(path):
+        if path != ENSEMBLE_CONFIG:
+            raise ConfigError(f"Файл конфигурации не найден: {path}")
+        return {
+            'path': None,
+            'version': 'builtin',
+            'merge_mode': 'nms',
+            'iou_threshold': 0.5,
+            'names': list(CLASS_NAMES),
+            'models': [dict(config) for config in MODEL_CONFIGS]
+        }
+
+    with open(path, 'r', encoding='utf-8') as f:
+        try:
+            data = yaml.safe_load(f) or {}
+        except yaml.YAMLError as e:
+            raise ConfigError(f"Ошибка разбора {path}: {e}")
+
+    models = []
+    for entry in data.get('models') or []:
+        if not entry.get('name') or not entry.get('path'):
+            raise ConfigError(f"У модели должны быть name и path: {entry}")
+        weight = float(entry.get('weight', 1.0))
+        if weight <= 0:
+            raise ConfigError(f"Вес модели {entry['name']} должен быть положительным")
+        models.append({'name': str(entry['name']), 'path': entry['path'], 'weight': weight})
+
+    if not models:
+        raise ConfigError(f"В {path} не указано ни одной модели")
+    names = [model['name'] for model in models]
+    if len(set(names)) != len(names):
+        raise ConfigError(f"Имена моделей повторяются: {names}")
+
+    merge_mode = data.get('merge_mode', 'nms')
+    if merge_mode not in ('nms', 'wbf'):
+        raise ConfigError(f"Неизвестный режим объединения: {merge_mode}")
+
+    return {
+        'path': path,
+        'version': str(data.get('version', '')),
+        'merge_mode': merge_mode,
+        'iou_threshold': float(data.get('iou_threshold', 0.5)),
+        'names': _class_names(path, data),
+        'models': models
+    }
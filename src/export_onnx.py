@@ -0,0 +1,61 @@
+import os
+import argparse
+import cv2
+from ultralytics import YOLO
+from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+from ensemble_config import load_config
+from onnx_ensemble import onnx_path, to_blob
+
+class ValidCalibrationReader(CalibrationDataReader):
+    """Калибровочные кадры для INT8 из dataset/valid с тем же препроцессингом, что в OnnxEnsemble"""
+    def __init__(self, input_name, images_dir='dataset/valid/images', limit=200, imgsz=640):
+        files = sorted(f for f in os.listdir(images_dir) if f.lower().endswith(('.jpg', '.png', '.jpeg')))
+        self.paths = iter(os.path.join(images_dir, f) for f in files[:limit])
+        self.input_name = input_name
+        self.imgsz = imgsz
+
+    def get_next(self):
+        for path in self.paths:
+            image = cv2.imread(path)
+            if image is not None:
+                blob, _ = to_blob([image], self.imgsz)
+                return {self.input_name: blob}
+        return None
+
+def export_models(imgsz=640, int8=False, calib_images=200, config_path=None):
+    """Экспорт членов ансамбля в ONNX (и INT8) рядом с best.pt"""
+    for config in load_config(config_path)['models']:
+        if not os.path.exists(config['path']):
+            print(f"⚠️ Пропуск {config['name']}: нет {config['path']}")
+            continue
+
+        print(f"📦 Экспорт {config['name']} ({config['path']})...")
+        exported = YOLO(config['path']).export(format='onnx', imgsz=imgsz, dynamic=True, simplify=True)
+        target = onnx_path(config)
+        if os.path.abspath(exported) != os.path.abspath(target):
+            os.replace(exported, target)
+        print(f"✅ ONNX: {target}")
+
+        if int8:
+            int8_path = onnx_path(config, int8=True)
+            reader = ValidCalibrationReader('images', limit=calib_images, imgsz=imgsz)
+            quantize_static(
+                target,
+                int8_path,
+                reader,
+                quant_format=QuantFormat.QDQ,
+                per_channel=True,
+                activation_type=QuantType.QUInt8,
+                weight_type=QuantType.QInt8
+            )
+            print(f"✅ INT8: {int8_path}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Экспорт моделей ансамбля в ONNX")
+    parser.add_argument('--imgsz', type=int, default=640)
+    parser.add_argument('--int8', action='store_true', help="INT8-квантизация с калибровкой на dataset/valid")
+    parser.add_argument('--calib-images', type=int, default=200)
+    parser.add_argument('--config', default=None, help="Состав ансамбля (по умолчанию dataset/ensemble.yaml)")
+    args = parser.parse_args()
+
+    export_models(args.imgsz, args.int8, args.calib_images, args.config)
@@ -0,0 +1,171 @@
+import os
+import json
+import math
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import cv2
+from ultralytics.data import YOLODataset
+
+# Кэш декодированных снимков между запусками обучения; IMAGE_CACHE=0 — выключить
+IMAGE_CACHE_DIR = os.getenv('IMAGE_CACHE_DIR', 'dataset/.image_cache')
+
+# Предел размера файла кэша; снимки сверх него читаются и декодируются с диска как обычно (0 — без предела)
+IMAGE_CACHE_MB = float(os.getenv('IMAGE_CACHE_MB', 0))
+
+INDEX_FORMAT = 2
+
+
+def resize_to(image, imgsz, augment=False):
+    """Длинная сторона к imgsz с сохранением пропорций — как BaseDataset.load_image в ultralytics:
+    INTER_AREA при уменьшении без аугментаций (валидация), иначе INTER_LINEAR"""
+    h0, w0 = image.shape[:2]
+    r = imgsz / max(h0, w0)
+    if r != 1:
+        w, h = min(math.ceil(w0 * r), imgsz), min(math.ceil(h0 * r), imgsz)
+        interpolation = cv2.INTER_LINEAR if (augment or r > 1) else cv2.INTER_AREA
+        image = cv2.resize(image, (w, h), interpolation=interpolation)
+    return image
+
+
+class ImageCache:
+    """Снимки, уменьшенные до imgsz, в одном файле uint8 с индексом смещений.
+
+    Файл открывается через memory map только на чтение, поэтому процессы загрузчика делят одни
+    страницы кэша ОС, а следующий запуск обучения не декодирует JPEG заново. Индекс (JSON) хранит
+    смещение, размеры, mtime и размер исходника; измененные снимки дописываются в конец файла,
+    а при большой доле устаревших байтов файл собирается заново.
+    """
+
+    def __init__(self, name, imgsz, cache_dir=None, budget_mb=None, augment=False):
+        self.imgsz = imgsz
+        self.augment = augment
+        # Интерполяция уменьшения зависит от аугментаций, поэтому входит в имя кэша и в индекс
+        self.interpolation = 'linear' if augment else 'area'
+        cache_dir = cache_dir or IMAGE_CACHE_DIR
+        os.makedirs(cache_dir, exist_ok=True)
+        self.data_path = os.path.join(cache_dir, f"{name}_{imgsz}_{self.interpolation}.bin")
+        self.index_path = os.path.join(cache_dir, f"{name}_{imgsz}_{self.interpolation}.json")
+        self.budget = int((budget_mb if budget_mb is not None else IMAGE_CACHE_MB) * 1024**2)
+        self.entries = {}  # путь -> [смещение, h, w, h0, w0, mtime_ns, размер исходника]
+        self._mmap = None
+
+    def __getstate__(self):
+        # В процессы загрузчика передается только индекс, отображение открывается заново
+        state = self.__dict__.copy()
+        state['_mmap'] = None
+        return state
+
+    def _read_index(self):
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            if index.get('format') == INDEX_FORMAT and index.get('imgsz') == self.imgsz \
+                    and index.get('interpolation') == self.interpolation \
+                    and os.path.getsize(self.data_path) >= index.get('size', 0):
+                return index['entries']
+        except (OSError, ValueError):
+            pass
+        return {}
+
+    def _write_index(self, size):
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'format': INDEX_FORMAT, 'imgsz': self.imgsz, 'interpolation': self.interpolation,
+                       'size': size, 'entries': self.entries}, f)
+        os.replace(tmp_path, self.index_path)
+
+    def build(self, files, workers=8):
+        """Сверка с исходниками и декодирование недостающих снимков; возвращает число закэшированных"""
+        entries = self._read_index()
+        stats = {}
+        for path in files:
+            try:
+                stat = os.stat(path)
+                stats[path] = (stat.st_mtime_ns, stat.st_size)
+            except OSError:
+                continue
+
+        self.entries = {path: entry for path, entry in entries.items()
+                        if path in stats and (entry[5], entry[6]) == stats[path]}
+        used = sum(entry[1] * entry[2] * 3 for entry in self.entries.values())
+        size = os.path.getsize(self.data_path) if self.entries and os.path.exists(self.data_path) else 0
+        if size > 2 * used:
+            # Больше половины файла — устаревшие снимки: собираем заново
+            self.entries, size = {}, 0
+        if not size and os.path.exists(self.data_path):
+            os.remove(self.data_path)
+
+        missing = [path for path in stats if path not in self.entries]
+        if missing:
+            print(f"🗄️ Кэш снимков {os.path.basename(self.data_path)}: декодирование {len(missing)} из {len(stats)}")
+            self._mmap = None
+            with open(self.data_path, 'ab') as f, ThreadPoolExecutor(max_workers=workers) as pool:
+                # cv2 отпускает GIL при декодировании — потоков достаточно
+                decoded = pool.map(lambda p: (p, cv2.imread(p, cv2.IMREAD_COLOR)), missing)
+                for path, image in decoded:
+                    if image is None:
+                        continue
+                    h0, w0 = image.shape[:2]
+                    image = np.ascontiguousarray(resize_to(image, self.imgsz, self.augment))
+                    if self.budget and size + image.nbytes > self.budget:
+                        continue  # Сверх бюджета — снимок будет декодироваться при обучении
+                    f.write(image.tobytes())
+                    self.entries[path] = [size, image.shape[0], image.shape[1], h0, w0, *stats[path]]
+                    size += image.nbytes
+            self._write_index(size)
+
+        print(f"🗄️ Кэш снимков: {len(self.entries)}/{len(stats)} в {self.data_path} ({size / 1024**2:.0f} МБ)")
+        return len(self.entries)
+
+    def get(self, path):
+        """(копия снимка, (h0, w0), (h, w)) или None, если снимка нет в кэше"""
+        entry = self.entries.get(path)
+        if entry is None:
+            return None
+        if self._mmap is None:
+            self._mmap = np.memmap(self.data_path, dtype=np.uint8, mode='r')
+        offset, h, w, h0, w0 = entry[:5]
+        # Копия: преобразования ultralytics меняют снимок на месте
+        image = np.array(self._mmap[offset:offset + h * w * 3]).reshape(h, w, 3)
+        return image, (h0, w0), (h, w)
+
+
+class CachedYOLODataset(YOLODataset):
+    """YOLODataset, который берет снимки из ImageCache вместо декодирования JPEG"""
+
+    image_cache = None
+
+    def load_image(self, i, rect_mode=True):
+        if self.image_cache is None or not rect_mode or self.ims[i] is not None:
+            return super().load_image(i, rect_mode)
+        cached = self.image_cache.get(self.im_files[i])
+        if cached is None:
+            return super().load_image(i, rect_mode)
+
+        image, hw0, hw = cached
+        if self.augment:
+            # Буфер снимков для мозаики — как в BaseDataset.load_image
+            self.ims[i], self.im_hw0[i], self.im_hw[i] = image, hw0, hw
+            self.buffer.append(i)
+            if len(self.buffer) >= self.max_buffer_length:
+                j = self.buffer.pop(0)
+                if self.cache != 'ram':
+                    self.ims[j], self.im_hw0[j], self.im_hw[j] = None, None, None
+        return image, hw0, hw
+
+
+def attach(dataset, imgsz, workers=8):
+    """Подключение кэша к датасету ultralytics (train или val) перед созданием загрузчика"""
+    if os.getenv('IMAGE_CACHE', '1') != '1' or dataset.cache == 'ram':
+        return dataset
+    # Имя кэша — от каталога снимков, чтобы train и valid не смешивались
+    source = os.path.abspath(str(dataset.img_path))
+    name = f"{os.path.basename(os.path.dirname(source)) or 'images'}_{hashlib.sha1(source.encode('utf-8')).hexdigest()[:8]}"
+    cache = ImageCache(name, imgsz, augment=dataset.augment)
+    cache.build(dataset.im_files, workers)
+
+    if not isinstance(dataset, CachedYOLODataset):
+        dataset.__class__ = CachedYOLODataset
+    dataset.image_cache = cache
+    return dataset
@@ -0,0 +1,94 @@
+import os
+import asyncio
+import functools
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+
+class PoolOverloaded(Exception):
+    """Очередь пула заполнена — запрос нужно отклонить (backpressure)"""
+
+
+class InferencePool:
+    """Пул для тяжелой синхронной работы (декодирование, инференс, отрисовка) вне event loop"""
+
+    def __init__(self, workers=None, queue_size=None, kind=None, initializer=None, initargs=()):
+        self.workers = int(workers or os.getenv('INFERENCE_WORKERS', 2))
+        self.queue_size = int(queue_size if queue_size is not None else os.getenv('INFERENCE_QUEUE_SIZE', 8))
+        self.kind = kind or os.getenv('INFERENCE_POOL', 'thread')
+
+        if self.kind == 'process':
+            # Каждый процесс загружает свои модели через initializer. По умолчанию spawn:
+            # после fork CUDA в дочернем процессе не инициализируется
+            self.start_method = os.getenv('INFERENCE_POOL_START', 'spawn')
+            self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context(self.start_method),
+                                                 initializer=initializer, initargs=initargs)
+        elif self.kind == 'thread':
+            self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                thread_name_prefix='inference')
+        else:
+            raise ValueError(f"Неизвестный тип пула: {self.kind}")
+
+        # Задачи в работе + ожидающие; меняется только из event loop
+        self.pending = 0
+        self.rejected = 0
+
+    @property
+    def capacity(self):
+        return self.workers + self.queue_size
+
+    async def run(self, func, *args, **kwargs):
+        """Выполнение func в пуле; PoolOverloaded, если очередь заполнена"""
+        if self.pending >= self.capacity:
+            self.rejected += 1
+            raise PoolOverloaded(f"Очередь инференса заполнена ({self.pending}/{self.capacity})")
+
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+        finally:
+            self.pending -= 1
+
+    def stats(self):
+        return {
+            'kind': self.kind,
+            'workers': self.workers,
+            'pending': self.pending,
+            'capacity': self.capacity,
+            'rejected': self.rejected
+        }
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+class PooledEnsemble:
+    """Ансамбль, который живет только в процессах пула (INFERENCE_POOL=process).
+
+    Родитель не загружает модели: описание (классы, версия, состав) берется у воркера при старте,
+    а predict_batch из потоков родителя (пакетные задания) выполняется в пуле. Функции
+    info_func и predict_func должны быть функциями модуля, чтобы их можно было передать в процесс.
+    """
+
+    def __init__(self, pool, info_func, predict_func):
+        self._executor = pool._executor
+        self._predict_func = predict_func
+        # Первая задача запускает воркер, и его initializer загружает модели
+        info = self._executor.submit(info_func).result()
+        self.class_names = info['class_names']
+        self.version = info['version']
+        self.merge_mode = info['merge_mode']
+        self.config = info['config']
+        self.models = info['models']
+        self._cascade = info['cascade']
+
+    def predict_batch(self, images, conf_threshold=0.25):
+        if not images:
+            return []
+        return self._executor.submit(self._predict_func, images, conf_threshold).result()
+
+    def cascade_stats(self):
+        # Счетчики каскада ведут процессы пула — в родителе только настройки
+        return dict(self._cascade)
@@ -0,0 +1,222 @@
+import os
+import atexit
+import argparse
+import threading
+from multiprocessing.connection import Listener, Client
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+
+# Адрес по умолчанию: Unix-сокет (на Windows — именованный канал вида \\.\pipe\tagat-inference)
+DEFAULT_ADDRESS = '/tmp/tagat-inference.sock'
+
+
+def describe_ensemble(ensemble):
+    """Описание ансамбля для процесса без моделей: классы, версия и состав"""
+    return {
+        'pid': os.getpid(),
+        'class_names': list(ensemble.class_names),
+        'version': ensemble.version,
+        'merge_mode': ensemble.merge_mode,
+        'config': {'path': ensemble.config['path'], 'version': ensemble.config['version']},
+        'models': [{'name': m['name'], 'path': m['path'], 'weight': m['weight'], 'mtime': m['mtime'],
+                    'load_time': m.get('load_time', 0.0)} for m in ensemble.models]
+    }
+
+
+def server_key():
+    """Общий ключ сервера и клиентов (INFERENCE_SERVER_KEY); без него сервер и клиенты не запускаются"""
+    key = os.getenv('INFERENCE_SERVER_KEY')
+    if not key:
+        raise RuntimeError("Не задан INFERENCE_SERVER_KEY: сокет сервера инференса доступен любому локальному процессу")
+    return key.encode('utf-8')
+
+
+class InferenceServer:
+    """Единственный процесс с моделями на устройство: HTTP-воркеры присылают кадры через разделяемую память.
+
+    Каждое соединение обслуживается своим потоком; все кадры проходят через общий BatchScheduler,
+    поэтому запросы разных HTTP-воркеров попадают в одни батчи. По сети передаются только
+    имя сегмента разделяемой памяти, смещения и детекции — пиксели не копируются через сокет.
+    """
+
+    def __init__(self, address=None):
+        import model_registry
+        from batching import BatchScheduler
+
+        self.address = address or os.getenv('INFERENCE_SERVER', DEFAULT_ADDRESS)
+        self._key = server_key()  # До загрузки моделей: без ключа сервер не стартует
+        self.ensemble = model_registry.get_ensemble()
+        self.scheduler = BatchScheduler(self.ensemble)
+        self._model_registry = model_registry
+
+    def info(self):
+        return describe_ensemble(self.scheduler.ensemble)
+
+    def stats(self):
+        return {'pid': os.getpid(), 'models': self._model_registry.stats(), 'batching': self.scheduler.stats()}
+
+    def serve_forever(self):
+        if isinstance(self.address, str) and not self.address.startswith('\\\\') and os.path.exists(self.address):
+            os.unlink(self.address)  # Сокет от прошлого запуска
+
+        with Listener(self.address, authkey=self._key) as listener:
+            print(f"🚀 Сервер инференса: {self.address}, моделей: {len(self.ensemble.models)}")
+            while True:
+                try:
+                    conn = listener.accept()
+                except Exception as e:
+                    print(f"⚠️ Ошибка подключения: {e}")
+                    continue
+                threading.Thread(target=self._serve_connection, args=(conn,), daemon=True).start()
+
+    def _serve_connection(self, conn):
+        segments = {}  # Подключенные сегменты разделяемой памяти клиента
+        try:
+            while True:
+                method, args = conn.recv()
+                try:
+                    conn.send(('ok', self._dispatch(method, args, segments)))
+                except Exception as e:
+                    conn.send(('error', f"{type(e).__name__}: {e}"))
+        except (EOFError, ConnectionError):
+            pass
+        finally:
+            for segment in segments.values():
+                segment.close()
+            conn.close()
+
+    def _dispatch(self, method, args, segments):
+        if method == 'predict':
+            segment_name, layout, conf_threshold, tiled, options = args
+            images = self._attach_frames(segments, segment_name, layout)
+            try:
+                if tiled:
+                    return [self.scheduler.predict_tiled(images[0], conf_threshold, **options)]
+                return self.scheduler.predict_batch(images, conf_threshold)
+            finally:
+                del images  # Представления должны исчезнуть до закрытия сегмента
+        if method == 'info':
+            return self.info()
+        if method == 'stats':
+            return self.stats()
+        if method == 'cascade_stats':
+            return self.scheduler.ensemble.cascade_stats()
+        raise ValueError(f"Неизвестный метод: {method}")
+
+    @staticmethod
+    def _attach_frames(segments, segment_name, layout):
+        segment = segments.get(segment_name)
+        if segment is None:
+            # Клиент увеличил буфер — старый сегмент больше не нужен
+            for name in list(segments):
+                segments.pop(name).close()
+            segment = shared_memory.SharedMemory(name=segment_name)
+            # Сегментом владеет клиент: трекер сервера не должен удалять его при выходе
+            resource_tracker.unregister(segment._name, 'shared_memory')
+            segments[segment_name] = segment
+        return [np.ndarray(shape, dtype=np.uint8, buffer=segment.buf, offset=offset) for offset, shape in layout]
+
+
+class RemoteEnsemble:
+    """Клиент сервера инференса с контрактом ансамбля (predict_batch, predict_tiled, class_names, version).
+
+    У каждого потока свое соединение и свой сегмент разделяемой памяти, который растет по мере надобности.
+    """
+
+    def __init__(self, address=None):
+        self.address = address or os.getenv('INFERENCE_SERVER', DEFAULT_ADDRESS)
+        self._key = server_key()
+        self._local = threading.local()
+        self._segments = []
+        self._segments_lock = threading.Lock()
+        atexit.register(self.close)
+
+        info = self._call('info')
+        self.class_names = info['class_names']
+        self.version = info['version']
+        self.merge_mode = info['merge_mode']
+        self.config = info['config']
+        self.models = info['models']
+        self.server_pid = info['pid']
+        print(f"🔌 Подключение к серверу инференса {self.address} (pid {self.server_pid}), моделей: {len(self.models)}")
+
+    def _call(self, method, *args):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = Client(self.address, authkey=self._key)
+        try:
+            conn.send((method, args))
+            status, result = conn.recv()
+        except (EOFError, ConnectionError):
+            self._local.conn = None  # Сервер перезапущен — переподключение при следующем вызове
+            raise
+        if status == 'error':
+            raise RuntimeError(f"Сервер инференса: {result}")
+        return result
+
+    def _segment(self, size):
+        segment = getattr(self._local, 'segment', None)
+        if segment is not None and segment.size >= size:
+            return segment
+
+        if segment is not None:
+            self._release(segment)
+        # С запасом, чтобы кадры чуть большего размера не пересоздавали сегмент
+        segment = shared_memory.SharedMemory(create=True, size=max(size, 1) * 5 // 4)
+        with self._segments_lock:
+            self._segments.append(segment)
+        self._local.segment = segment
+        return segment
+
+    def _release(self, segment):
+        with self._segments_lock:
+            if segment in self._segments:
+                self._segments.remove(segment)
+        segment.close()
+        segment.unlink()
+
+    def _send_frames(self, images, conf_threshold, tiled, options=None):
+        images = [np.ascontiguousarray(image, dtype=np.uint8) for image in images]
+        segment = self._segment(sum(image.nbytes for image in images))
+
+        layout, offset = [], 0
+        for image in images:
+            np.ndarray(image.shape, dtype=np.uint8, buffer=segment.buf, offset=offset)[...] = image
+            layout.append((offset, image.shape))
+            offset += image.nbytes
+        return self._call('predict', segment.name, layout, conf_threshold, tiled, options or {})
+
+    def predict_batch(self, images, conf_threshold=0.25):
+        if not images:
+            return []
+        return self._send_frames(images, conf_threshold, False)
+
+    def predict_tiled(self, image, conf_threshold=0.25, **kwargs):
+        return self._send_frames([image], conf_threshold, True, kwargs)[0]
+
+    def cascade_stats(self):
+        return self._call('cascade_stats')
+
+    def stats(self):
+        return self._call('stats')
+
+    def close(self):
+        with self._segments_lock:
+            segments, self._segments = self._segments, []
+        for segment in segments:
+            try:
+                segment.close()
+                segment.unlink()
+            except (BufferError, FileNotFoundError):
+                pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Сервер инференса: модели одного устройства для всех HTTP-воркеров")
+    parser.add_argument('--address', default=None, help=f"Сокет (по умолчанию INFERENCE_SERVER или {DEFAULT_ADDRESS})")
+    parser.add_argument('--device', default=None, help="cpu, cuda или cuda:N (по умолчанию DEVICE)")
+    args = parser.parse_args()
+
+    if args.device:
+        os.environ['DEVICE'] = args.device
+    InferenceServer(args.address).serve_forever()
@@ -0,0 +1,90 @@
+import io
+import os
+import numpy as np
+import cv2
+from PIL import Image
+
+# Лимиты проверяются по заголовку, до выделения памяти под пиксели
+MAX_UPLOAD_BYTES = int(float(os.getenv('MAX_UPLOAD_MB', 50)) * 1024**2)
+MAX_IMAGE_PIXELS = int(float(os.getenv('MAX_IMAGE_MEGAPIXELS', 50)) * 1_000_000)
+
+# Длинная сторона, до которой JPEG можно декодировать с уменьшением в 2/4/8 раз
+# средствами libjpeg (масштабирование в DCT). 0 — декодировать в полном размере
+DECODE_REDUCE_TO = int(os.getenv('DECODE_REDUCE_TO', 0))
+
+_REDUCED_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+
+class ImageRejected(ValueError):
+    """Файл не удалось декодировать как изображение"""
+    status_code = 400
+
+
+class ImageTooLarge(ImageRejected):
+    """Файл или разрешение изображения превышают лимит"""
+    status_code = 413
+
+
+def read_header(data: bytes):
+    """Ширина, высота и EXIF-ориентация без декодирования пикселей"""
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            width, height = image.size
+            orientation = image.getexif().get(0x0112, 1)
+    except Image.DecompressionBombError as e:
+        raise ImageTooLarge(str(e))
+    except Exception as e:
+        raise ImageRejected(f"Не удалось прочитать изображение: {e}")
+    return width, height, orientation
+
+
+def apply_orientation(image: np.ndarray, orientation: int) -> np.ndarray:
+    """Поворот/отражение по тегу EXIF Orientation"""
+    if orientation == 2:
+        return cv2.flip(image, 1)
+    if orientation == 3:
+        return cv2.rotate(image, cv2.ROTATE_180)
+    if orientation == 4:
+        return cv2.flip(image, 0)
+    if orientation == 5:
+        return cv2.transpose(image)
+    if orientation == 6:
+        return cv2.rotate(image, cv2.ROTATE_90_CLOCKWISE)
+    if orientation == 7:
+        return cv2.rotate(cv2.transpose(image), cv2.ROTATE_180)
+    if orientation == 8:
+        return cv2.rotate(image, cv2.ROTATE_90_COUNTERCLOCKWISE)
+    return image
+
+
+def decode_image(data: bytes, reduce_to: int = None):
+    """Единое декодирование загрузки в непрерывный BGR uint8 массив.
+
+    Цветовой порядок (BGR, как у cv2.imread) и ориентация нормализуются здесь один раз.
+    Возвращает (изображение, scale): scale — во сколько раз декодированный кадр меньше
+    исходного, координаты детекций нужно умножить на него.
+    """
+    if len(data) > MAX_UPLOAD_BYTES:
+        raise ImageTooLarge(f"Файл больше {MAX_UPLOAD_BYTES // 1024**2} МБ")
+
+    width, height, orientation = read_header(data)
+    if width * height > MAX_IMAGE_PIXELS:
+        raise ImageTooLarge(f"Изображение {width}x{height} больше {MAX_IMAGE_PIXELS / 1e6:.0f} Мп")
+
+    reduce_to = DECODE_REDUCE_TO if reduce_to is None else reduce_to
+    factor = 1
+    if reduce_to and data[:2] == b'\xff\xd8':  # Уменьшение в DCT есть только у JPEG
+        factor = next((f for f in (8, 4, 2) if max(width, height) / f >= reduce_to), 1)
+
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8),
+                         _REDUCED_FLAGS[factor] | cv2.IMREAD_IGNORE_ORIENTATION)
+    if image is None:
+        raise ImageRejected("Не удалось декодировать изображение")
+
+    scale = width / image.shape[1]
+    return np.ascontiguousarray(apply_orientation(image, orientation)), scale
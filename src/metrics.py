@@ -0,0 +1,118 @@
+import time
+import threading
+from contextlib import contextmanager
+
+# Границы корзин гистограмм в секундах (как у клиентов Prometheus, с запасом для тайлов)
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_local = threading.local()
+
+
+class Histogram:
+    """Потокобезопасная гистограмма с метками в текстовом формате Prometheus"""
+
+    def __init__(self, name, help_text, label_name, buckets=BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_name = label_name
+        self.buckets = buckets
+        self._series = {}  # значение метки -> [счетчики корзин, сумма, количество]
+        self._lock = threading.Lock()
+
+    def observe(self, label, value):
+        with self._lock:
+            series = self._series.get(label)
+            if series is None:
+                series = self._series[label] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label, (counts, total, count) in sorted(self._series.items()):
+                selector = f'{self.label_name}="{label}"'
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f'{self.name}_bucket{{{selector},le="{bound}"}} {bucket_count}')
+                lines.append(f'{self.name}_bucket{{{selector},le="+Inf"}} {count}')
+                lines.append(f'{self.name}_sum{{{selector}}} {total:.6f}')
+                lines.append(f'{self.name}_count{{{selector}}} {count}')
+        return lines
+
+
+STAGE_SECONDS = Histogram('tagat_stage_duration_seconds', 'Длительность этапов обработки запроса', 'stage')
+MODEL_SECONDS = Histogram('tagat_model_inference_seconds', 'Инференс участника ансамбля на батч', 'model')
+
+
+def record(stage, seconds, model=None):
+    """Наблюдение в гистограмму и в разбивку текущего запроса, если она собирается в этом потоке"""
+    if model is None:
+        STAGE_SECONDS.observe(stage, seconds)
+    else:
+        MODEL_SECONDS.observe(model, seconds)
+        stage = f"model_{model}"
+
+    stages = current_profile()
+    if stages is not None:
+        stages.append((stage, seconds))
+
+
+@contextmanager
+def span(stage):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - started)
+
+
+@contextmanager
+def profile():
+    """Сбор этапов, выполненных в текущем потоке, в список (этап, секунды)"""
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    stages = []
+    stack.append(stages)
+    try:
+        yield stages
+    finally:
+        stack.pop()
+
+
+def current_profile():
+    stack = getattr(_local, 'stack', None)
+    return stack[-1] if stack else None
+
+
+def summarize(stages):
+    """Сумма по этапам в миллисекундах, в порядке первого появления"""
+    summary = {}
+    for stage, seconds in stages:
+        summary[stage] = summary.get(stage, 0.0) + seconds * 1000
+    return {stage: round(ms, 3) for stage, ms in summary.items()}
+
+
+def server_timing(stages):
+    """Значение заголовка Server-Timing (видно во вкладке Network браузера)"""
+    return ', '.join(f"{stage};dur={ms}" for stage, ms in summarize(stages).items())
+
+
+def render(gauges=None):
+    """Текстовый формат Prometheus: гистограммы этапов и моделей плюс переданные gauge.
+
+    gauges: {имя: (описание, значение или {(метка, значение метки): значение})}
+    """
+    lines = STAGE_SECONDS.render() + MODEL_SECONDS.render()
+    for name, (help_text, value) in (gauges or {}).items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        if isinstance(value, dict):
+            for (label_name, label), series_value in sorted(value.items()):
+                lines.append(f'{name}{{{label_name}="{label}"}} {series_value}')
+        else:
+            lines.append(f"{name} {value}")
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,123 @@
+import os
+import gc
+import time
+import threading
+import numpy as np
+
+# Один экземпляр ансамбля на процесс и бэкенд ('torch' или 'onnx')
+_lock = threading.Lock()
+_ensembles = {}
+_warmup_times = {}
+
+
+def _create_ensemble(backend, config=None, resident=None):
+    # Импорт по требованию: с бэкендом onnx torch и ultralytics не загружаются
+    if backend == 'torch':
+        from ensemble import FinalEnsemble
+        return FinalEnsemble(config=config, resident=resident)
+    if backend == 'onnx':
+        from onnx_ensemble import OnnxEnsemble
+        return OnnxEnsemble(int8=os.getenv('ONNX_INT8', '0') == '1', config=config, resident=resident)
+    raise ValueError(f"Неизвестный бэкенд ансамбля: {backend}")
+
+
+def _warmup(ensemble, imgsz=640):
+    """Первый прогон выделяет память и компилирует ядра — делаем его до первого запроса"""
+    started = time.perf_counter()
+    ensemble.predict_batch([np.zeros((imgsz, imgsz, 3), dtype=np.uint8)])
+    return time.perf_counter() - started
+
+
+def get_ensemble(backend=None):
+    """Ансамбль текущего процесса; веса загружаются и прогреваются ровно один раз"""
+    backend = backend or os.getenv('ENSEMBLE_BACKEND', 'torch')
+    with _lock:
+        if backend not in _ensembles:
+            ensemble = _create_ensemble(backend)
+            _warmup_times[backend] = _warmup(ensemble) if ensemble.models else 0.0
+            _ensembles[backend] = ensemble
+        return _ensembles[backend]
+
+
+def reload(config_path=None, backend=None):
+    """Новый ансамбль по конфигурации, собранный рядом с текущим, и атомарная замена.
+
+    Модели с тем же файлом весов берутся из текущего ансамбля, новые загружаются и прогреваются
+    до замены; запросы, уже получившие старый ансамбль, дорабатывают на нем.
+    """
+    from ensemble_config import load_config
+
+    backend = backend or os.getenv('ENSEMBLE_BACKEND', 'torch')
+    config = load_config(config_path)
+    with _lock:
+        current = _ensembles.get(backend)
+
+    ensemble = _create_ensemble(backend, config, resident=current)
+    if not ensemble.models:
+        raise RuntimeError("Ни одна модель новой конфигурации не загружена")
+    warmup_time = _warmup(ensemble)
+
+    with _lock:
+        _ensembles[backend] = ensemble
+        _warmup_times[backend] = warmup_time
+    released = _release_unused(current, ensemble)
+    del current
+    if released:
+        # Прежний ансамбль больше не нужен реестру; его веса освобождаются вместе с последним запросом
+        from device import empty_cache
+
+        gc.collect()
+        empty_cache(ensemble.device)
+        print(f"🧹 Сняты с учета модели прежней конфигурации: {', '.join(released)}")
+    return ensemble
+
+
+def _release_unused(previous, ensemble):
+    """Модели прежнего ансамбля, которых нет в новом, снимаются с учета менеджера памяти устройства"""
+    if previous is None or not hasattr(previous, 'residency'):
+        return []
+    used = {m['path'] for m in ensemble.models}
+    return [m['name'] for m in previous.models
+            if m['path'] not in used and previous.residency.unregister(m['path']) is not None]
+
+
+def preload():
+    """Загрузка моделей до fork (gunicorn --preload), чтобы воркеры делили страницы весов.
+
+    CUDA не переживает fork, поэтому на GPU модели грузятся в каждом воркере после fork.
+    """
+    backend = os.getenv('ENSEMBLE_BACKEND', 'torch')
+    if backend == 'torch':
+        from device import select_device, is_cuda
+        if is_cuda(select_device()):
+            print("⚠️ Предзагрузка до fork недоступна на GPU, модели загрузятся в воркерах")
+            return None
+    return get_ensemble(backend)
+
+
+def stats():
+    """Время загрузки и прогрева каждой модели"""
+    with _lock:
+        return {
+            backend: {
+                'warmup_ms': round(_warmup_times[backend] * 1000, 1),
+                'models': {
+                    m['name']: {'load_ms': round(m.get('load_time', 0) * 1000, 1), 'weight': m['weight']}
+                    for m in ensemble.models
+                },
+                # Размещение моделей в памяти (только torch): на устройстве, в pinned-памяти или выгружены
+                'residency': ensemble.residency.stats() if hasattr(ensemble, 'residency') else None
+            }
+            for backend, ensemble in _ensembles.items()
+        }
+
+
+def _after_fork_in_child():
+    global _lock
+    _lock = threading.Lock()
+    for ensemble in _ensembles.values():
+        ensemble._after_fork()
+
+
+if hasattr(os, 'register_at_fork'):  # нет на Windows
+    os.register_at_fork(after_in_child=_after_fork_in_child)
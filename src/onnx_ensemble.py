@@ -0,0 +1,164 @@
+import os
+import time
+import cv2
+import numpy as np
+from ensemble_base import EnsembleBase
+import metrics
+
+def onnx_path(config, int8=False):
+    """Путь к экспортированному графу рядом с best.pt"""
+    base = os.path.splitext(config['path'])[0]
+    return f"{base}.int8.onnx" if int8 else f"{base}.onnx"
+
+def letterbox(image, imgsz=640):
+    """Масштабирование с сохранением пропорций и паддингом 114, как в ultralytics"""
+    h, w = image.shape[:2]
+    ratio = min(imgsz / h, imgsz / w)
+    new_w, new_h = round(w * ratio), round(h * ratio)
+    left, top = (imgsz - new_w) // 2, (imgsz - new_h) // 2
+
+    canvas = np.full((imgsz, imgsz, 3), 114, dtype=np.uint8)
+    canvas[top:top + new_h, left:left + new_w] = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+
+    return canvas, ratio, (left, top)
+
+def to_blob(images, imgsz=640):
+    """BGR-кадры в тензор NCHW float32 [0, 1] и параметры letterbox для обратного пересчета"""
+    blob = np.empty((len(images), 3, imgsz, imgsz), dtype=np.float32)
+    metas = []
+    for i, image in enumerate(images):
+        canvas, ratio, pad = letterbox(image, imgsz)
+        blob[i] = canvas[..., ::-1].transpose(2, 0, 1)  # BGR -> RGB, HWC -> CHW
+        metas.append((ratio, pad, image.shape[:2]))
+    blob /= 255.0
+    return blob, metas
+
+class OnnxEnsemble(EnsembleBase):
+    """Ансамбль на экспортированных ONNX-графах через onnxruntime или OpenVINO на CPU.
+
+    Контракт predict/predict_batch совпадает с FinalEnsemble, но без импорта torch и ultralytics.
+    """
+    def __init__(self, merge_mode=None, iou_threshold=None, runtime=None, int8=False,
+                 imgsz=640, num_threads=None, nms_iou=0.7, max_det=300, max_nms=None, cascade=None, config=None,
+                 resident=None):
+        super().__init__(merge_mode, iou_threshold, cascade, config)
+
+        self.runtime = runtime or os.getenv('ONNX_RUNTIME', 'onnxruntime')
+        self.int8 = int8
+        self.imgsz = imgsz
+        self.num_threads = int(num_threads or os.getenv('CPU_THREADS', 0) or os.cpu_count() or 1)
+        # Параметры NMS отдельной модели — как у predict в ultralytics
+        self.nms_iou = nms_iou
+        self.max_det = max_det
+        # Сколько самых уверенных кандидатов идет в NMS: матрица IoU квадратична по их числу
+        self.max_nms = int(max_nms or os.getenv('ONNX_MAX_NMS', 3000))
+
+        same_runtime = resident is not None and getattr(resident, 'runtime', None) == self.runtime
+        self._load_models(resident if same_runtime else None)
+
+    def _load_models(self, resident=None):
+        for config in self.config['models']:
+            path = onnx_path(config, self.int8)
+            member = self._resident_member(resident, path)
+            if member is not None:
+                self._keep_resident(member, config)
+            elif os.path.exists(path):
+                try:
+                    started = time.perf_counter()
+                    run, batch = self._create_runner(path)
+                    self.models.append({
+                        'run': run,
+                        'batch': batch,  # None — динамический батч
+                        'name': config['name'],
+                        'path': path,
+                        'mtime': os.path.getmtime(path),  # Для версии набора моделей
+                        'weight': config['weight'],
+                        'load_time': time.perf_counter() - started
+                    })
+                    print(f"Загружена: {config['name']} ({path}, {self.runtime}) за {self.models[-1]['load_time']:.2f} с")
+                except Exception as e:
+                    print(f"Ошибка загрузки {config['name']}: {e}")
+
+        print(f"ONNX Ensemble готов! Моделей: {len(self.models)}")
+
+    def _create_runner(self, path):
+        """Функция blob -> выход модели для выбранного рантайма"""
+        if self.runtime == 'openvino':
+            import openvino as ov
+
+            core = ov.Core()
+            compiled = core.compile_model(path, 'CPU', {'INFERENCE_NUM_THREADS': self.num_threads})
+            output = compiled.output(0)
+            batch = compiled.input(0).get_partial_shape()[0]
+            batch = batch.get_length() if batch.is_static else None
+            return (lambda blob: compiled(blob)[output]), batch
+
+        if self.runtime == 'onnxruntime':
+            import onnxruntime as ort
+
+            options = ort.SessionOptions()
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            options.intra_op_num_threads = self.num_threads
+            session = ort.InferenceSession(path, sess_options=options, providers=['CPUExecutionProvider'])
+            model_input = session.get_inputs()[0]
+            batch = model_input.shape[0] if isinstance(model_input.shape[0], int) else None
+            return (lambda blob: session.run(None, {model_input.name: blob})[0]), batch
+
+        raise ValueError(f"Неизвестный рантайм: {self.runtime}")
+
+    def _run_members(self, members, images, conf_threshold):
+        """Препроцессинг один раз, общий для всех моделей members"""
+        with metrics.span('letterbox'):
+            blob, metas = to_blob(images, self.imgsz)
+        all_detections = [[] for _ in images]
+
+        for model_info in members:
+            try:
+                step = model_info['batch'] or len(images)
+                started = time.perf_counter()
+                outputs = np.concatenate([model_info['run'](blob[i:i + step])
+                                          for i in range(0, len(images), step)])
+                metrics.record('model', time.perf_counter() - started, model=model_info['name'])
+
+                for i, (output, meta) in enumerate(zip(outputs, metas)):
+                    all_detections[i].extend(self._decode(output, meta, conf_threshold, model_info))
+            except Exception as e:
+                print(f"Ошибка в модели {model_info['name']}: {e}")
+
+        return all_detections
+
+    def _decode(self, output, meta, conf_threshold, model_info):
+        """Выход YOLOv8 (4 + nc, N) в список детекций в координатах исходного кадра"""
+        ratio, (left, top), (h, w) = meta
+        preds = output.T
+
+        class_scores = preds[:, 4:]
+        classes = class_scores.argmax(axis=1)
+        scores = class_scores[np.arange(len(preds)), classes]
+
+        mask = scores >= conf_threshold
+        if not mask.any():
+            return []
+        preds, scores, classes = preds[mask], scores[mask], classes[mask]
+
+        if len(scores) > self.max_nms:
+            best = np.argpartition(-scores, self.max_nms)[:self.max_nms]
+            preds, scores, classes = preds[best], scores[best], classes[best]
+
+        # cx, cy, w, h -> x1, y1, x2, y2 с учетом letterbox
+        boxes = np.empty((len(preds), 4), dtype=np.float32)
+        boxes[:, 0] = preds[:, 0] - preds[:, 2] / 2
+        boxes[:, 1] = preds[:, 1] - preds[:, 3] / 2
+        boxes[:, 2] = preds[:, 0] + preds[:, 2] / 2
+        boxes[:, 3] = preds[:, 1] + preds[:, 3] / 2
+        boxes -= np.array([left, top, left, top], dtype=np.float32)
+        boxes /= ratio
+        np.clip(boxes, 0, [w, h, w, h], out=boxes)
+
+        keep = self._nms_indices(boxes, scores, classes, self.nms_iou)[:self.max_det]
+        return [{
+            'xyxy': boxes[j],
+            'conf': scores[j] * model_info['weight'],  # Взвешенная уверенность
+            'cls': np.float32(classes[j]),
+            'model': model_info['name']
+        } for j in keep]
@@ -0,0 +1,176 @@
+import os
+import gc
+import time
+import threading
+import itertools
+from collections import OrderedDict
+from contextlib import contextmanager
+from ultralytics import YOLO
+from device import is_cuda, empty_cache
+
+# Один менеджер на устройство: его делят текущий ансамбль и ансамбли прошлых конфигураций
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get_manager(device):
+    with _managers_lock:
+        if device not in _managers:
+            _managers[device] = ResidencyManager(device)
+        return _managers[device]
+
+
+def _module_bytes(module):
+    return sum(t.numel() * t.element_size() for t in itertools.chain(module.parameters(), module.buffers()))
+
+
+class ResidencyManager:
+    """Модели ансамбля на устройстве в пределах бюджета памяти (MODEL_MEMORY_BUDGET_MB).
+
+    Когда новой модели не хватает места, давно не использованные модели вытесняются (LRU):
+    в закрепленную (pinned) память хоста, откуда быстро копируются обратно, или выгружаются
+    совсем (MODEL_OFFLOAD=unload) и читаются с диска при следующем обращении.
+    Вытесняется только модель, которая сейчас не выполняется (ее блокировка свободна).
+    Бюджет 0 — менеджер только считает обращения, модели всегда на устройстве.
+    """
+
+    def __init__(self, device, budget_mb=None, offload=None):
+        self.device = device
+        self.budget = int(float(budget_mb if budget_mb is not None else os.getenv('MODEL_MEMORY_BUDGET_MB', 0)) * 1024**2)
+        self.offload = offload or os.getenv('MODEL_OFFLOAD', 'pinned')
+        if self.offload not in ('pinned', 'unload'):
+            raise ValueError(f"Неизвестный режим вытеснения: {self.offload}")
+        if self.offload == 'pinned' and not is_cuda(device):
+            # На CPU модель и так в памяти хоста — вытеснение имеет смысл только как выгрузка
+            self.offload = 'unload'
+
+        self._entries = OrderedDict()  # путь весов -> запись, порядок LRU
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.budget > 0
+
+    def register(self, path, mtime, model, lock):
+        """Запись для загруженной модели; с теми же весами возвращается существующая"""
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry['mtime'] == mtime:
+                return entry
+
+            entry = {
+                'path': path,
+                'mtime': mtime,
+                'model': model,
+                'lock': lock,
+                'size': _module_bytes(model.model),  # Предварительно: уточняется после первого вызова в use()
+                'location': 'device',
+                'hits': 0,
+                'page_ins': 0,
+                'evictions': 0,
+                'page_in_time': 0.0,
+                'last_used': None
+            }
+            self._entries[path] = entry
+            if self.enabled:
+                self._make_room(0, exclude=entry)
+            return entry
+
+    def unregister(self, path):
+        """Модель больше не входит в ансамбль: запись удаляется из учета и статистики.
+
+        Менеджер перестает держать ссылку на модель; память освобождается, когда дорабатывают
+        запросы, еще использующие прежний ансамбль.
+        """
+        with self._lock:
+            return self._entries.pop(path, None)
+
+    @contextmanager
+    def use(self, entry):
+        """Модель на устройстве на время вызова; вызывающий держит entry['lock']"""
+        with self._lock:
+            if entry['path'] in self._entries:
+                self._entries.move_to_end(entry['path'])
+            entry['hits'] += 1
+            entry['last_used'] = time.time()
+            page_in = entry['location'] != 'device'
+            if page_in:
+                self._make_room(entry['size'], exclude=entry)
+
+        if page_in:
+            self._page_in(entry)
+        try:
+            yield entry['model']
+        finally:
+            # Предиктор при первом вызове сливает слои и переводит веса в FP16 — размер меняется
+            with self._lock:
+                entry['size'] = _module_bytes(entry['model'].model)
+
+    def _resident_bytes(self):
+        return sum(e['size'] for e in self._entries.values() if e['location'] == 'device')
+
+    def _make_room(self, size, exclude):
+        """Вытеснение простаивающих моделей в порядке LRU, пока size не поместится в бюджет"""
+        for entry in list(self._entries.values()):
+            if self._resident_bytes() + size <= self.budget:
+                return
+            if entry is exclude or entry['location'] != 'device':
+                continue
+            if not entry['lock'].acquire(blocking=False):
+                continue  # Модель сейчас выполняется
+            try:
+                self._evict(entry)
+            finally:
+                entry['lock'].release()
+
+        if self._resident_bytes() + size > self.budget:
+            print("⚠️ Бюджет памяти моделей превышен: все модели на устройстве заняты")
+
+    def _evict(self, entry):
+        if self.offload == 'pinned':
+            module = entry['model'].model
+            module.to('cpu')
+            for tensor in itertools.chain(module.parameters(), module.buffers()):
+                tensor.data = tensor.data.pin_memory()
+            entry['location'] = 'pinned'
+        else:
+            entry['model'] = None
+            entry['location'] = 'unloaded'
+            gc.collect()
+        entry['evictions'] += 1
+        empty_cache(self.device)
+
+    def _page_in(self, entry):
+        started = time.perf_counter()
+        if entry['location'] == 'unloaded':
+            entry['model'] = YOLO(entry['path'])
+            entry['model'].model.to(self.device)
+        else:
+            entry['model'].model.to(self.device, non_blocking=True)
+        entry['location'] = 'device'
+        entry['page_ins'] += 1
+        entry['page_in_time'] += time.perf_counter() - started
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'device': str(self.device),
+                'budget_mb': round(self.budget / 1024**2, 1),
+                'offload': self.offload,
+                'resident_mb': round(self._resident_bytes() / 1024**2, 1),
+                'models': {
+                    entry['path']: {
+                        'location': entry['location'],
+                        'size_mb': round(entry['size'] / 1024**2, 1),
+                        'hits': entry['hits'],
+                        'page_ins': entry['page_ins'],
+                        'evictions': entry['evictions'],
+                        'page_in_ms': round(entry['page_in_time'] * 1000, 1),
+                        'last_used': entry['last_used']
+                    }
+                    for entry in self._entries.values()
+                }
+            }
@@ -0,0 +1,147 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class ResultCache:
+    """LRU-кэш результатов анализа по содержимому изображения.
+
+    Ключ — хэш байтов изображения, версии набора моделей и порога уверенности,
+    поэтому смена весов или порога автоматически дает промах. Результаты хранятся
+    в виде JSON (UTF-8): размер памяти ограничен в байтах, а копия при чтении получается бесплатно.
+    Необязательный дисковый уровень (RESULT_CACHE_DIR) переживает перезапуск сервиса.
+    """
+
+    def __init__(self, max_mb=None, disk_dir=None):
+        self.max_bytes = int(float(max_mb if max_mb is not None else os.getenv('RESULT_CACHE_MB', 128)) * 1024**2)
+        self.disk_dir = disk_dir or os.getenv('RESULT_CACHE_DIR') or None
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(image_bytes: bytes, model_version: str, conf_threshold: float, options: str = '') -> str:
+        digest = hashlib.sha256(image_bytes)
+        digest.update(f"|{model_version}|{conf_threshold}|{options}".encode('utf-8'))
+        return digest.hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            payload = self._entries.get(key)
+            if payload is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return json.loads(payload)
+
+        payload = self._read_disk(key)
+        with self._lock:
+            if payload is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._store(key, payload)
+        return json.loads(payload)
+
+    def put(self, key, result: dict):
+        payload = json.dumps(result, ensure_ascii=False).encode('utf-8')
+        with self._lock:
+            self._store(key, payload)
+        self._write_disk(key, payload)
+
+    def _store(self, key, payload):
+        if len(payload) > self.max_bytes:
+            return
+        if key in self._entries:
+            self._size -= len(self._entries.pop(key))
+        self._entries[key] = payload
+        self._size += len(payload)
+
+        while self._size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key[:2], f"{key}.json")
+
+    def _read_disk(self, key):
+        if not self.disk_dir:
+            return None
+        try:
+            with open(self._disk_path(key), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _write_disk(self, key, payload):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Атомарная запись: параллельный читатель не увидит половину файла
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(payload)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"⚠️ Не удалось записать кэш на диск: {e}")
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'size_mb': round(self._size / 1024**2, 2),
+                'max_mb': round(self.max_bytes / 1024**2, 2),
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': round((self.hits + self.disk_hits) / lookups, 3) if lookups else 0,
+                'disk_dir': self.disk_dir
+            }
+
+
+class AnnotatedImageStore:
+    """LRU-хранилище готовых размеченных JPEG по тому же ключу, что и ResultCache.
+
+    Разметка рисуется и кодируется не больше одного раза на снимок и версию моделей
+    и отдается клиенту отдельным бинарным ресурсом, без base64 в JSON.
+    """
+
+    def __init__(self, max_mb=None):
+        self.max_bytes = int(float(max_mb if max_mb is not None else os.getenv('ANNOTATED_STORE_MB', 64)) * 1024**2)
+        self._images = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            jpeg = self._images.get(key)
+            if jpeg is not None:
+                self._images.move_to_end(key)
+            return jpeg
+
+    def put(self, key, jpeg: bytes):
+        with self._lock:
+            if len(jpeg) > self.max_bytes:
+                return
+            if key in self._images:
+                self._size -= len(self._images.pop(key))
+            self._images[key] = jpeg
+            self._size += len(jpeg)
+
+            while self._size > self.max_bytes:
+                _, evicted = self._images.popitem(last=False)
+                self._size -= len(evicted)
+
+    def stats(self):
+        with self._lock:
+            return {'images': len(self._images), 'size_mb': round(self._size / 1024**2, 2)}
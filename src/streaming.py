@@ -0,0 +1,130 @@
+import json
+import asyncio
+import numpy as np
+from starlette.websockets import WebSocketDisconnect
+from inference_pool import PoolOverloaded
+from ingest import decode_image
+from video_tracking import VideoSession
+
+
+def decode_frame(data: bytes, frame_format: str = 'jpeg', shape=None) -> np.ndarray:
+    """Кадр в BGR-массив; сырые BGR-байты используются без копирования"""
+    if frame_format == 'bgr':
+        if not shape:
+            raise ValueError("Для формата bgr нужны width и height")
+        height, width = shape
+        return np.frombuffer(data, dtype=np.uint8).reshape(height, width, 3)
+
+    if frame_format == 'jpeg':
+        return decode_image(data, reduce_to=0)[0]
+
+    raise ValueError(f"Неизвестный формат кадра: {frame_format}")
+
+
+async def serve_frame_stream(websocket, pool, analyze_fn, metadata=None):
+    """Обслуживание одного WebSocket-потока до отключения клиента.
+
+    Протокол:
+      * текстовое сообщение — JSON с настройками потока:
+          {"format": "jpeg" | "bgr", "width": 1280, "height": 720,
+           "annotate": false, "annotate_next": true, "tracking": false}
+        "annotate" включает размеченный кадр для всех ответов, "annotate_next" — только для следующего;
+        "tracking" включает режим видеосессии: ансамбль только на ключевых кадрах и стабильные
+        track_id дефектов (состояние живет в потоке пула, поэтому нужен INFERENCE_POOL=thread);
+      * бинарное сообщение — кадр: JPEG или сырые BGR-байты height*width*3;
+      * ответ на кадр — JSON с детекциями; если запрошена разметка, следом идет бинарный JPEG.
+
+    Если клиент шлет кадры быстрее, чем работает модель, устаревшие кадры отбрасываются:
+    обрабатывается только последний пришедший.
+
+    analyze_fn(data, frame_format, shape, annotate, session) -> (result: dict, annotated_jpeg: bytes | None)
+    выполняется в пуле инференса; session — VideoSession или None. Возвращает статистику потока.
+    """
+    config = {'format': 'jpeg', 'width': None, 'height': None, 'annotate': False, 'tracking': False}
+    annotate_next = False
+    latest = None  # (seq, data, format, shape, annotate, tracking) — только самый свежий кадр
+    session = None
+    frame_ready = asyncio.Event()
+    stats = {'received': 0, 'processed': 0, 'dropped': 0, 'errors': 0}
+
+    async def receive_frames():
+        nonlocal latest, annotate_next
+        while True:
+            message = await websocket.receive()
+            if message['type'] == 'websocket.disconnect':
+                return
+
+            if message.get('text') is not None:
+                try:
+                    update = json.loads(message['text'])
+                except ValueError:
+                    await websocket.send_json({'error': 'Некорректный JSON настроек'})
+                    continue
+                annotate_next = bool(update.pop('annotate_next', annotate_next))
+                config.update({k: v for k, v in update.items() if k in config})
+                continue
+
+            if message.get('bytes') is not None:
+                stats['received'] += 1
+                if latest is not None:
+                    stats['dropped'] += 1  # Предыдущий кадр так и не дождался модели
+
+                shape = (config['height'], config['width']) if config['width'] and config['height'] else None
+                latest = (stats['received'], message['bytes'], config['format'], shape,
+                          config['annotate'] or annotate_next, bool(config['tracking']))
+                annotate_next = False
+                frame_ready.set()
+
+    async def process_frames():
+        nonlocal latest, session
+        while True:
+            await frame_ready.wait()
+            frame_ready.clear()
+            if latest is None:
+                continue
+            seq, data, frame_format, shape, annotate, tracking = latest
+            latest = None
+
+            if tracking and pool.kind != 'thread':
+                await websocket.send_json({'seq': seq, 'error': 'Трекинг доступен только с INFERENCE_POOL=thread'})
+                tracking = config['tracking'] = False
+            if not tracking:
+                session = None
+            elif session is None:
+                session = VideoSession()
+
+            try:
+                result, annotated = await pool.run(analyze_fn, data, frame_format, shape, annotate, session)
+            except PoolOverloaded:
+                stats['dropped'] += 1
+                await websocket.send_json({'seq': seq, 'error': 'busy'})
+                continue
+            except Exception as e:
+                stats['errors'] += 1
+                await websocket.send_json({'seq': seq, 'error': str(e)})
+                continue
+
+            stats['processed'] += 1
+            result.update(metadata or {})
+            result['seq'] = seq
+            result['dropped_frames'] = stats['dropped']
+            result['annotated_image'] = annotated is not None
+
+            await websocket.send_json(result)
+            if annotated is not None:
+                await websocket.send_bytes(annotated)
+
+    receiver = asyncio.create_task(receive_frames())
+    processor = asyncio.create_task(process_frames())
+    try:
+        done, _ = await asyncio.wait({receiver, processor}, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if task.exception() is not None and not isinstance(task.exception(), WebSocketDisconnect):
+                raise task.exception()
+    finally:
+        receiver.cancel()
+        processor.cancel()
+
+    if session is not None:
+        stats['tracking'] = session.stats
+    return stats
@@ -1,17 +1,19 @@
 import os
 import yaml
 from ultralytics import YOLO
-import torch
-import gc
+from device import select_device, describe_device
+from balanced_training import TurbineTrainer
+from training_planner import plan_training, describe_plan, is_out_of_memory
+
+# Каталог запуска: отсюда берется last.pt, если обучение все же упрется в память
+RUN_PROJECT = 'turbine_model'
+RUN_NAME = 'augmented_training_yolo8n_v1'
 
 def train_model():
-    # Очистка памяти перед началом
-    torch.cuda.empty_cache()
-    gc.collect()
+    device = select_device()
 
-    # Проверка GPU
-    print(f"🔧 Используется: {torch.cuda.get_device_name(0)}")
-    print(f"💾 Память GPU: {torch.cuda.get_device_properties(0).total_memory / 1024**3:.1f} GB")
+    # Проверка устройства
+    print(f"🔧 Используется: {describe_device(device)}")
     
     # Проверка датасета
     dataset_path = "dataset/data.yaml"
@@ -28,12 +30,22 @@ def train_model():
     # Создаем модель
     model = YOLO('yolov8n.pt')
     
+    # Слабые классы добираются взвешенной выборкой и аугментацией в памяти, без копий на диске;
+    # декодированные снимки берутся из кэша в dataset/.image_cache
+    trainer = TurbineTrainer
+    
+    # Батч, воркеры и AMP подбираются пробными шагами до запуска, а не падением посреди обучения
+    print("\n📐 Подбор батча по памяти...")
+    plan = plan_training('yolov8n.pt', imgsz=640, device=device, data=dataset_path)
+    
     # Параметры обучения
     print("\n   Параметры обучения:")
     print("   - Модель: YOLOv8n")
     print("   - Эпохи: 100")
-    print("   - Batch size: 8-16")
     print("   - Размер изображения: 640px")
+    print(f"   - Балансировка классов: {'взвешенная выборка' if os.getenv('BALANCED_SAMPLING', '1') == '1' else 'нет'}")
+    print(f"   - Кэш снимков: {'да' if os.getenv('IMAGE_CACHE', '1') == '1' else 'нет'}")
+    print(describe_plan(plan))
     
     try:
         print("\n🎓 Начинаем обучение...")
@@ -41,19 +53,21 @@ def train_model():
             data=dataset_path,
             epochs=100,
             imgsz=640,
-            batch=16,
-            device=0,           # Используем GPU 0
-            workers=2,
+            batch=plan['batch'],
+            nbs=plan['nbs'],       # Эффективный батч постоянен: накопление nbs / batch шагов
+            device=device,
+            workers=plan['workers'],
             lr0=1e-3,
             patience=20,
             save=True,
             exist_ok=True,      # Перезаписывать существующие результаты
             verbose=True,
-            project='turbine_model',
-            name='augmented_training_yolo8n_v1',
+            project=RUN_PROJECT,
+            name=RUN_NAME,
             optimizer='AdamW',
             cache=False,
-            amp=False
+            amp=plan['amp'],
+            trainer=trainer
             #close_mosaic=5,
             #overlap_mask=False,
             #plots=True,
@@ -73,46 +87,26 @@ def train_model():
         )
         
         print("\n✅ Обучение завершено успешно!")
-        print("📁 Модель сохранена в: turbine_model/augmented_training_new_data_yolo8n_v1/")
+        print(f"📁 Модель сохранена в: {RUN_PROJECT}/{RUN_NAME}/")
         
     except Exception as e:
-        print(f"\n❌ Ошибка при обучении: {e}")
-        print("Пробуем уменьшить batch size...")
+        if not is_out_of_memory(e) or plan['batch'] == 1:
+            print(f"\n❌ Ошибка при обучении: {e}")
+            return
         
-        # Пробуем с меньшим batch size
+        # Не начинаем заново: продолжаем с последней эпохи с меньшим батчем,
+        # накопление градиентов пересчитается от того же nbs
+        last = os.path.join(RUN_PROJECT, RUN_NAME, 'weights', 'last.pt')
+        if not os.path.exists(last):
+            print(f"\n❌ Не хватило памяти до первого чекпоинта: {e}")
+            return
+        batch = max(1, plan['batch'] // 2)
+        print(f"\n⚠️ Не хватило памяти, продолжаем с {last} с batch={batch}")
         try:
-            results = model.train(
-                data=dataset_path,
-                epochs=100,
-                imgsz=640,
-                batch=8,        # Уменьшаем batch size
-                device=0,
-                workers=1,
-                lr0=1e-3,
-                patience=20,
-                save=True,
-                project='turbine_model',
-                name='augmented_training_yolo8n_v1',
-                optimizer='AdamW',
-                cache=False,
-                amp=False
-                #close_mosaic=3,
-                # Аугментация для экономии памяти
-                #hsv_h=0.005,
-                #hsv_s=0.3, 
-                #hsv_v=0.2,
-                #degrees=2.0,
-                #translate=0.02,
-                #scale=0.2,
-                #shear=1.0,
-                #perspective=0.0001,
-                #flipud=0.0,
-                #mosaic=0.5,     # ⚠️ Уменьшаем mosaic
-                #mixup=0.0,
-                #copy_paste=0.0
-            )
+            results = YOLO(last).train(resume=True, batch=batch, trainer=trainer)
+            print("\n✅ Обучение завершено успешно!")
         except Exception as e2:
             print(f"❌ Критическая ошибка: {e2}")
 
 if __name__ == "__main__":
-    train_model()
\ No newline at end of file
+    train_model()
@@ -0,0 +1,229 @@
+import os
+import gc
+import argparse
+import numpy as np
+import yaml
+
+# torch и device импортируются внутри функций: арифметика плана не требует torch
+
+# Доля свободной видеопамяти, которую занимает обучение (запас на фрагментацию и валидацию)
+MEMORY_FRACTION = float(os.getenv('TRAIN_MEMORY_FRACTION', 0.85))
+
+# nbs ultralytics: градиенты накапливаются до этого эффективного батча (accumulate = nbs / batch)
+NOMINAL_BATCH = 64
+
+MAX_BATCH = int(os.getenv('TRAIN_MAX_BATCH', 64))
+
+# Батчи пробных шагов, по которым строится линейная модель памяти
+PROBE_BATCHES = (1, 2, 4)
+
+# Боксов на снимок в пробном шаге: память назначения целей (TaskAlignedAssigner) растет с их числом
+PROBE_BOXES = int(os.getenv('TRAIN_PROBE_BOXES', 32))
+
+# Память хоста на процесс загрузчика: буфер мозаики, батчи в очереди предвыборки, копия разметки
+WORKER_RAM_MB = float(os.getenv('TRAIN_WORKER_RAM_MB', 1024))
+
+
+def is_out_of_memory(error):
+    import torch
+
+    out_of_memory = getattr(torch.cuda, 'OutOfMemoryError', RuntimeError)
+    return isinstance(error, out_of_memory) and 'out of memory' in str(error).lower()
+
+
+def amp_supported(device):
+    """Смешанная точность только на CUDA с тензорными ядрами (compute capability 7.0+).
+
+    На старых картах FP16 не ускоряет обучение, а на CPU ultralytics AMP не использует.
+    Численную проверку на реальной модели ultralytics делает сам (check_amp) и при
+    расхождении откатывается в FP32.
+    """
+    from device import is_cuda
+
+    if not is_cuda(device):
+        return False
+    import torch
+
+    major, _ = torch.cuda.get_device_capability(torch.device(device))
+    return major >= 7
+
+
+def available_ram():
+    """Доступная память хоста в байтах (psutil приходит с ultralytics)"""
+    import psutil
+
+    return psutil.virtual_memory().available
+
+
+def plan_workers(cpu_count=None, ram_bytes=None, worker_ram_mb=WORKER_RAM_MB):
+    """Процессы загрузчика: ядра минус одно под главный процесс и не больше, чем помещается в память хоста"""
+    cpu_count = cpu_count or os.cpu_count() or 2
+    ram_bytes = available_ram() if ram_bytes is None else ram_bytes
+    by_ram = int(ram_bytes // (worker_ram_mb * 1024**2))
+    return max(1, min(cpu_count - 1, by_ram))
+
+
+def fit_batch(measured, budget, state_bytes, max_batch):
+    """Наибольший батч по линейной модели пиковой памяти из пробных шагов [(батч, пик)].
+
+    С одним замером берется его батч; от 16 батч округляется вниз до кратного 8 (тензорные ядра).
+    """
+    if len(measured) >= 2:
+        slope, intercept = np.polyfit(*zip(*measured), 1)
+        batch = int((budget - state_bytes - intercept) / max(slope, 1.0))
+    else:
+        batch = measured[0][0] if measured else 1
+    batch = max(1, min(batch, max_batch))
+    if batch >= 16:
+        batch -= batch % 8
+    return batch
+
+
+def accumulation(nbs, batch):
+    """Шагов накопления градиентов до эффективного батча nbs — как accumulate в ultralytics"""
+    return max(round(nbs / batch), 1)
+
+
+def dataset_classes(data):
+    """Число классов датасета из data.yaml (nc или длина names)"""
+    with open(data, 'r', encoding='utf-8') as f:
+        config = yaml.safe_load(f)
+    return int(config.get('nc') or len(config['names']))
+
+
+def build_probe_model(weights, nc, device):
+    """Модель для пробных шагов в том виде, в каком ее обучает DetectionTrainer.
+
+    Голова собирается на число классов датасета, а не на 80 классов COCO из весов; args нужны
+    функции потерь (коэффициенты box, cls, dfl). Веса не переносятся — на память они не влияют.
+    """
+    from ultralytics import YOLO
+    from ultralytics.cfg import get_cfg
+    from ultralytics.nn.tasks import DetectionModel
+
+    module = DetectionModel(YOLO(weights).model.yaml, nc=nc, verbose=False)
+    module.args = get_cfg()
+    module = module.to(device).float().train()
+    for parameter in module.parameters():
+        parameter.requires_grad_(True)
+    return module
+
+
+def probe_peak_memory(module, batch, imgsz, device, amp, boxes=PROBE_BOXES):
+    """Пиковая видеопамять шага обучения на батче случайных снимков и боксов.
+
+    Шаг идет через функцию потерь детектора, как в тренере: прямой проход, назначение целей,
+    потери и обратный проход.
+    """
+    import torch
+    from device import empty_cache
+
+    empty_cache(device)
+    torch.cuda.reset_peak_memory_stats(device)
+    count = batch * boxes
+    targets = {
+        'img': torch.rand(batch, 3, imgsz, imgsz, device=device),
+        'batch_idx': torch.arange(batch, device=device).repeat_interleave(boxes).float(),
+        'cls': torch.randint(0, module.yaml['nc'], (count, 1), device=device).float(),
+        'bboxes': torch.rand(count, 4, device=device) * 0.5 + 0.25  # Нормализованные xywh внутри кадра
+    }
+    with torch.autocast('cuda', enabled=amp):
+        loss, _ = module.loss(targets)
+    loss.sum().backward()
+    peak = torch.cuda.max_memory_allocated(device)
+    module.zero_grad(set_to_none=True)
+    del targets, loss
+    return peak
+
+
+def _safe_probe(module, batch, imgsz, device, amp):
+    from device import empty_cache
+
+    try:
+        return probe_peak_memory(module, batch, imgsz, device, amp)
+    except RuntimeError as e:
+        if not is_out_of_memory(e):
+            raise
+        module.zero_grad(set_to_none=True)
+        empty_cache(device)
+        return None
+
+
+def plan_training(weights='yolov8n.pt', imgsz=640, device=None, amp=None, max_batch=None, nbs=NOMINAL_BATCH,
+                  data='dataset/data.yaml'):
+    """Параметры model.train до запуска обучения: батч, накопление градиентов, воркеры и AMP.
+
+    На CUDA пробные шаги на батчах 1, 2 и 4 дают линейную модель пиковой памяти; выбирается
+    наибольший батч, который с запасом помещается в свободную память вместе с состоянием AdamW
+    и EMA, и проверяется еще одним пробным шагом. Эффективный батч держит nbs: ultralytics
+    накапливает градиенты nbs / batch шагов, поэтому меньший батч не меняет режим обучения.
+    """
+    import torch
+    from device import select_device, is_cuda, empty_cache
+
+    device = device or select_device()
+    max_batch = max_batch or MAX_BATCH
+    amp = amp_supported(device) if amp is None else amp
+
+    plan = {'device': device, 'imgsz': imgsz, 'amp': amp, 'nbs': nbs, 'peak_mb': None, 'budget_mb': None}
+    if not is_cuda(device):
+        # На CPU ограничивает время шага, а не память — оставляем прежний батч
+        plan['batch'] = min(16, max_batch)
+    else:
+        free, _ = torch.cuda.mem_get_info(torch.device(device))
+        budget = free * MEMORY_FRACTION
+        module = build_probe_model(weights, dataset_classes(data), device)
+        # Градиенты попадают в пик пробного шага; моменты AdamW и EMA-копия — еще три размера весов
+        state_bytes = 3 * sum(p.numel() * p.element_size() for p in module.parameters())
+
+        peaks = [_safe_probe(module, batch, imgsz, device, amp) for batch in PROBE_BATCHES]
+        measured = [(batch, peak) for batch, peak in zip(PROBE_BATCHES, peaks) if peak is not None]
+        batch = fit_batch(measured, budget, state_bytes, max_batch)
+
+        # Проверка выбранного батча настоящим шагом; при нехватке — уменьшение
+        while True:
+            peak = _safe_probe(module, batch, imgsz, device, amp)
+            if peak is not None and peak + state_bytes <= budget or batch == 1:
+                break
+            batch = max(1, batch * 3 // 4)
+
+        del module
+        gc.collect()
+        empty_cache(device)
+        plan.update({'batch': batch, 'peak_mb': round((peak or 0) / 1024**2),
+                     'budget_mb': round(budget / 1024**2)})
+
+    plan['accumulate'] = accumulation(nbs, plan['batch'])
+    plan['workers'] = plan_workers()
+    return plan
+
+
+def describe_plan(plan):
+    from device import describe_device
+
+    lines = [
+        f"   - Устройство: {describe_device(plan['device'])}",
+        f"   - Batch size: {plan['batch']} × накопление {plan['accumulate']} = {plan['batch'] * plan['accumulate']}",
+        f"   - Воркеры загрузчика: {plan['workers']}",
+        f"   - AMP: {'да' if plan['amp'] else 'нет'}"
+    ]
+    if plan['peak_mb'] is not None:
+        lines.append(f"   - Пик памяти шага: {plan['peak_mb']} МБ из {plan['budget_mb']} МБ")
+    return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+    from device import select_device
+
+    parser = argparse.ArgumentParser(description="Подбор батча, воркеров и AMP для обучения")
+    parser.add_argument('--weights', default='yolov8n.pt')
+    parser.add_argument('--data', default='dataset/data.yaml')
+    parser.add_argument('--imgsz', type=int, default=640)
+    parser.add_argument('--device', default=None)
+    parser.add_argument('--no-amp', action='store_true')
+    args = parser.parse_args()
+
+    plan = plan_training(args.weights, args.imgsz, select_device(args.device), amp=False if args.no_amp else None,
+                         data=args.data)
+    print("📐 План обучения:")
+    print(describe_plan(plan))
@@ -0,0 +1,137 @@
+import os
+import numpy as np
+import cv2
+from ensemble_base import EnsembleBase
+
+
+class VideoSession:
+    """Состояние видеопотока: ансамбль только на ключевых кадрах, между ними — оптический поток.
+
+    Ключевой кадр — каждый keyframe_interval-й кадр или кадр, на котором сменилась сцена.
+    Детекции ключевых кадров сопоставляются с треками по IoU, поэтому один и тот же дефект
+    сохраняет track_id на протяжении всего видео.
+    """
+
+    def __init__(self, keyframe_interval=None, scene_change_threshold=None, iou_threshold=0.3, max_missed=2):
+        self.keyframe_interval = int(keyframe_interval or os.getenv('VIDEO_KEYFRAME_INTERVAL', 10))
+        # Средняя разница яркости (0-255) уменьшенных кадров, после которой сцена считается новой
+        self.scene_change_threshold = float(scene_change_threshold or os.getenv('VIDEO_SCENE_CHANGE', 12.0))
+        self.iou_threshold = iou_threshold
+        self.max_missed = max_missed
+
+        self.tracks = []  # {'track_id', 'xyxy', 'conf', 'cls', 'model', 'missed'}
+        self._next_id = 1
+        self._prev_gray = None
+        self._key_thumb = None
+        self._since_keyframe = 0
+        self.stats = {'frames': 0, 'keyframes': 0, 'tracks_created': 0}
+
+    def update(self, image, detect_fn):
+        """Обработка кадра; detect_fn(image) -> детекции ансамбля. Возвращает (детекции, ключевой ли кадр)"""
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        thumb = cv2.resize(gray, (64, 64), interpolation=cv2.INTER_AREA)
+
+        keyframe = bool(
+            self._key_thumb is None
+            or self._since_keyframe + 1 >= self.keyframe_interval
+            or cv2.absdiff(thumb, self._key_thumb).mean() > self.scene_change_threshold
+        )
+
+        if keyframe:
+            self._associate(detect_fn(image))
+            self._key_thumb = thumb
+            self._since_keyframe = 0
+            self.stats['keyframes'] += 1
+        else:
+            self._propagate(self._prev_gray, gray)
+            self._since_keyframe += 1
+
+        self._prev_gray = gray
+        self.stats['frames'] += 1
+
+        detections = [{
+            'xyxy': track['xyxy'],
+            'conf': track['conf'],
+            'cls': track['cls'],
+            'model': track['model'],
+            'track_id': track['track_id']
+        } for track in self.tracks if track['missed'] == 0]
+        return detections, keyframe
+
+    def _associate(self, detections):
+        """Жадное сопоставление детекций с треками того же класса по IoU"""
+        matches = {}
+        if detections and self.tracks:
+            boxes, _, classes = EnsembleBase._to_arrays(detections)
+            track_boxes = np.array([track['xyxy'] for track in self.tracks], dtype=np.float32)
+            track_classes = np.array([int(track['cls']) for track in self.tracks])
+
+            iou = EnsembleBase._iou_matrix(boxes, track_boxes)
+            iou[classes[:, None] != track_classes[None, :]] = 0
+
+            used_tracks = set()
+            for flat in np.argsort(-iou, axis=None):
+                d, t = divmod(int(flat), len(self.tracks))
+                if iou[d, t] < self.iou_threshold:
+                    break
+                if d in matches or t in used_tracks:
+                    continue
+                matches[d] = t
+                used_tracks.add(t)
+
+        matched_tracks = set(matches.values())
+        for t, track in enumerate(self.tracks):
+            if t not in matched_tracks:
+                track['missed'] += 1
+
+        for d, det in enumerate(detections):
+            if d in matches:
+                track = self.tracks[matches[d]]
+            else:
+                track = {'track_id': self._next_id}
+                self._next_id += 1
+                self.stats['tracks_created'] += 1
+                self.tracks.append(track)
+            track.update({
+                'xyxy': np.asarray(det['xyxy'], dtype=np.float32),
+                'conf': det['conf'],
+                'cls': det['cls'],
+                'model': det.get('model', 'ensemble'),
+                'missed': 0
+            })
+
+        # Трек, не подтвержденный несколькими ключевыми кадрами подряд, удаляется
+        self.tracks = [track for track in self.tracks if track['missed'] <= self.max_missed]
+
+    def _propagate(self, prev_gray, gray):
+        """Сдвиг боксов активных треков на медианное смещение точек (Lucas-Kanade)"""
+        h, w = gray.shape
+        points, owners = [], []
+        for i, track in enumerate(self.tracks):
+            if track['missed']:
+                continue
+            x1, y1, x2, y2 = np.clip(track['xyxy'], 0, [w, h, w, h]).astype(int)
+            if x2 - x1 < 4 or y2 - y1 < 4:
+                continue
+            corners = cv2.goodFeaturesToTrack(prev_gray[y1:y2, x1:x2], maxCorners=20,
+                                              qualityLevel=0.01, minDistance=3)
+            if corners is None:
+                continue
+            points.append(corners.reshape(-1, 2) + [x1, y1])
+            owners.extend([i] * len(corners))
+
+        if not points:
+            return
+
+        points = np.concatenate(points).astype(np.float32).reshape(-1, 1, 2)
+        moved, status, _ = cv2.calcOpticalFlowPyrLK(prev_gray, gray, points, None,
+                                                    winSize=(15, 15), maxLevel=2)
+        shifts = (moved - points).reshape(-1, 2)
+        ok = status.reshape(-1) == 1
+        owners = np.array(owners)
+
+        for i in np.unique(owners[ok]):
+            dx, dy = np.median(shifts[ok & (owners == i)], axis=0)
+            track = self.tracks[i]
+            track['xyxy'] = np.clip(track['xyxy'] + np.array([dx, dy, dx, dy], dtype=np.float32),
+                                    0, [w, h, w, h]).astype(np.float32)
@@ -0,0 +1,41 @@
+import os
+import sys
+import threading
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from ensemble_base import EnsembleBase, CLASS_NAMES
+
+
+class StubEnsemble(EnsembleBase):
+    """Ансамбль без моделей: на каждый кадр — заданные детекции, вызовы записываются"""
+
+    def __init__(self, detections=(), weights=None, merge_mode='nms', delay=0.0):
+        config = {'path': None, 'version': 'test', 'merge_mode': merge_mode, 'iou_threshold': 0.5,
+                  'names': list(CLASS_NAMES), 'models': []}
+        super().__init__(config=config, cascade=False)
+        weights = weights or {'a': 1.0}
+        self.models = [{'name': name, 'path': f"{name}.pt", 'weight': weight, 'mtime': 0.0}
+                       for name, weight in weights.items()]
+        self.detections = list(detections)
+        self.delay = delay
+        self.calls = []  # (число кадров, порог) на каждый вызов predict_batch
+        self._calls_lock = threading.Lock()
+
+    def _run_members(self, members, images, conf_threshold):
+        with self._calls_lock:
+            self.calls.append((len(images), conf_threshold))
+        if self.delay:
+            threading.Event().wait(self.delay)
+        return [[dict(det) for det in self.detections] for _ in images]
+
+
+def detection(xyxy, conf, cls=0, model='a'):
+    return {'xyxy': np.array(xyxy, dtype=np.float32), 'conf': np.float32(conf), 'cls': np.float32(cls), 'model': model}
+
+
+@pytest.fixture
+def stub_ensemble():
+    return StubEnsemble([detection([10, 10, 50, 50], 0.9)])
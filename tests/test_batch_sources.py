@@ -0,0 +1,44 @@
+import zipfile
+import pytest
+import batch_analysis
+from batch_analysis import collect_sources
+from ingest import ImageTooLarge
+
+
+@pytest.fixture
+def archive(tmp_path):
+    path = tmp_path / 'inspection.zip'
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr('E1/blade_1.jpg', b'\0' * 4096)  # Сжимается в десятки байт
+        zf.writestr('E1/blade_2.jpg', b'\0' * 1024)
+        zf.writestr('E1/notes.txt', b'\0' * 10**6)
+    return str(path)
+
+
+def test_zip_members_are_listed(archive):
+    sources = collect_sources([archive])
+    try:
+        assert [name for name, _ in sources] == ['E1/blade_1.jpg', 'E1/blade_2.jpg']
+        assert len(sources[1][1]()) == 1024
+    finally:
+        sources.close()
+
+
+def test_oversized_member_is_rejected_before_decompression(archive, monkeypatch):
+    monkeypatch.setattr(batch_analysis, 'MAX_UPLOAD_BYTES', 2048)
+    sources = collect_sources([archive])
+    try:
+        monkeypatch.setattr(zipfile.ZipFile, 'read', lambda *args: pytest.fail("член архива не должен распаковываться"))
+        with pytest.raises(ImageTooLarge):
+            sources[0][1]()
+    finally:
+        sources.close()
+
+
+def test_archive_over_uncompressed_limit_is_rejected(archive, monkeypatch):
+    # Снимки вместе 5 КБ; текстовые файлы в предел не входят
+    monkeypatch.setattr(batch_analysis, 'MAX_ZIP_UNCOMPRESSED_BYTES', 5120)
+    collect_sources([archive]).close()
+    monkeypatch.setattr(batch_analysis, 'MAX_ZIP_UNCOMPRESSED_BYTES', 5119)
+    with pytest.raises(ImageTooLarge):
+        collect_sources([archive])
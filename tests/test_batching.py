@@ -0,0 +1,94 @@
+import threading
+import time
+import numpy as np
+from batching import BatchScheduler
+from conftest import StubEnsemble, detection
+
+
+def _frames(count):
+    return [np.zeros((32, 32, 3), dtype=np.uint8) for _ in range(count)]
+
+
+def _submit_concurrently(scheduler, frames, conf_threshold=0.25):
+    barrier = threading.Barrier(len(frames))
+    results = [None] * len(frames)
+
+    def worker(i):
+        barrier.wait()
+        results[i] = scheduler.submit(frames[i], conf_threshold).result(timeout=5)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(frames))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_concurrent_requests_share_one_batch():
+    ensemble = StubEnsemble([detection([0, 0, 10, 10], 0.9)])
+    scheduler = BatchScheduler(ensemble, max_batch_size=8, window_ms=200)
+    try:
+        results = _submit_concurrently(scheduler, _frames(4))
+    finally:
+        scheduler.shutdown()
+
+    assert ensemble.calls == [(4, 0.25)]
+    assert all(len(detections) == 1 for detections in results)
+    assert scheduler.stats()['batch_size_histogram'] == {4: 1}
+
+
+def test_batch_is_limited_by_max_batch_size():
+    ensemble = StubEnsemble()
+    scheduler = BatchScheduler(ensemble, max_batch_size=3, window_ms=200)
+    try:
+        futures = [scheduler.submit(frame) for frame in _frames(7)]
+        for future in futures:
+            future.result(timeout=5)
+    finally:
+        scheduler.shutdown()
+
+    assert [size for size, _ in ensemble.calls] == [3, 3, 1]
+
+
+def test_different_thresholds_are_not_mixed():
+    ensemble = StubEnsemble()
+    scheduler = BatchScheduler(ensemble, max_batch_size=8, window_ms=200)
+    try:
+        futures = [scheduler.submit(frame, conf) for frame, conf in zip(_frames(4), (0.25, 0.5, 0.25, 0.5))]
+        for future in futures:
+            future.result(timeout=5)
+    finally:
+        scheduler.shutdown()
+
+    assert sorted(ensemble.calls) == [(2, 0.25), (2, 0.5)]
+    assert scheduler.stats()['batches'] == 1
+
+
+def test_lone_request_waits_only_for_window():
+    ensemble = StubEnsemble()
+    scheduler = BatchScheduler(ensemble, max_batch_size=8, window_ms=50)
+    try:
+        started = time.perf_counter()
+        scheduler.submit(_frames(1)[0]).result(timeout=5)
+        elapsed = time.perf_counter() - started
+    finally:
+        scheduler.shutdown()
+
+    assert ensemble.calls == [(1, 0.25)]
+    assert 0.04 <= elapsed < 1.0
+
+
+def test_ensemble_error_reaches_every_request():
+    class FailingEnsemble(StubEnsemble):
+        def _run_members(self, members, images, conf_threshold):
+            raise RuntimeError("сбой модели")
+
+    scheduler = BatchScheduler(FailingEnsemble(), max_batch_size=8, window_ms=50)
+    try:
+        futures = [scheduler.submit(frame) for frame in _frames(2)]
+        errors = [future.exception(timeout=5) for future in futures]
+    finally:
+        scheduler.shutdown()
+
+    assert all(isinstance(error, RuntimeError) for error in errors)
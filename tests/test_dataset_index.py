@@ -0,0 +1,104 @@
+import os
+import numpy as np
+import pytest
+import dataset_index
+from dataset_index import LabelIndex, load_index
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    labels = tmp_path / 'train' / 'labels'
+    labels.mkdir(parents=True)
+    (labels / 'a.txt').write_text("0 0.5 0.5 0.2 0.2\n2 0.1 0.1 0.1 0.1\n")
+    (labels / 'b.txt').write_text("1 0.5 0.5 0.4 0.4\n")
+    (labels / 'aug_a_0.txt').write_text("0 0.4 0.4 0.2 0.2\n")
+    (labels / 'empty.txt').write_text("")
+    return tmp_path
+
+
+def _write(dataset, name, text, mtime_ns=None):
+    path = dataset / 'train' / 'labels' / f"{name}.txt"
+    path.write_text(text)
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+    return path
+
+
+def test_build_collects_boxes_per_image(dataset):
+    index = LabelIndex('train', str(dataset)).load()
+
+    assert index.images.tolist() == ['a', 'aug_a_0', 'b', 'empty']
+    assert index.reparsed == 4
+    assert index.class_counts(4).tolist() == [2, 1, 1, 0]
+    assert index.class_counts(4, originals_only=True).tolist() == [1, 1, 1, 0]
+    assert index.images_with_classes([0], originals_only=True) == ['a']
+    assert index.class_matrix(4)[0].tolist() == [True, False, True, False]
+    np.testing.assert_allclose(index.boxes[index.image_id == 2], [[0.5, 0.5, 0.4, 0.4]])
+    assert os.path.exists(index.cache_path)
+
+
+def test_polygon_is_reduced_to_bounding_box(dataset):
+    _write(dataset, 'poly', "3 0.1 0.2 0.5 0.2 0.5 0.6 0.1 0.6\n")
+    index = LabelIndex('train', str(dataset)).load()
+    row = index.image_id == index.images.tolist().index('poly')
+    np.testing.assert_allclose(index.boxes[row], [[0.3, 0.4, 0.4, 0.4]], atol=1e-6)
+    assert index.cls[row].tolist() == [3]
+
+
+def test_unchanged_dataset_is_read_from_cache(dataset):
+    LabelIndex('train', str(dataset)).load()
+    index = LabelIndex('train', str(dataset)).load()
+    assert index.reparsed == 0
+    assert len(index.cls) == 4
+
+
+def test_only_changed_files_are_reparsed(dataset):
+    path = dataset / 'train' / 'labels' / 'b.txt'
+    LabelIndex('train', str(dataset)).load()
+
+    # Тот же размер файла, другое время изменения
+    _write(dataset, 'b', "3 0.5 0.5 0.4 0.4\n", mtime_ns=os.stat(path).st_mtime_ns + 10**9)
+    index = LabelIndex('train', str(dataset)).load()
+    assert index.reparsed == 1
+    assert index.class_counts(4).tolist() == [2, 0, 1, 1]
+
+
+def test_added_and_removed_files(dataset):
+    LabelIndex('train', str(dataset)).load()
+    os.remove(dataset / 'train' / 'labels' / 'a.txt')
+    _write(dataset, 'c', "1 0.5 0.5 0.1 0.1\n1 0.2 0.2 0.1 0.1\n")
+
+    index = LabelIndex('train', str(dataset)).load()
+    assert index.images.tolist() == ['aug_a_0', 'b', 'c', 'empty']
+    assert index.reparsed == 1
+    assert index.class_counts(4).tolist() == [1, 3, 0, 0]
+    # image_id указывает на новые позиции изображений
+    assert index.image_id.tolist() == [0, 1, 2, 2]
+
+
+def test_index_of_other_format_is_rebuilt(dataset, monkeypatch):
+    LabelIndex('train', str(dataset)).load()
+    monkeypatch.setattr(dataset_index, 'INDEX_FORMAT', dataset_index.INDEX_FORMAT + 1)
+    assert LabelIndex('train', str(dataset)).load().reparsed == 4
+
+
+def test_corrupt_cache_is_rebuilt(dataset):
+    index = LabelIndex('train', str(dataset)).load()
+    with open(index.cache_path, 'wb') as f:
+        f.write(b'broken')
+    assert LabelIndex('train', str(dataset)).load().reparsed == 4
+
+
+def test_load_index_reuses_object_and_resets_reparsed(dataset, monkeypatch):
+    monkeypatch.setattr(dataset_index, '_indexes', {})
+    first = load_index('train', str(dataset))
+    assert first.reparsed == 4
+    second = load_index('train', str(dataset))
+    assert second is first
+    assert second.reparsed == 0
+
+
+def test_missing_split_is_empty(tmp_path):
+    index = LabelIndex('valid', str(tmp_path)).load()
+    assert len(index) == 0
+    assert index.class_counts(4).tolist() == [0, 0, 0, 0]
@@ -0,0 +1,82 @@
+import io
+import numpy as np
+import pytest
+from PIL import Image
+import ingest
+from ingest import decode_image, ImageRejected, ImageTooLarge
+
+
+def _encode(width, height, fmt='JPEG', orientation=None, marker=True):
+    """Снимок с красным квадратом в левом верхнем углу (в хранимой ориентации)"""
+    pixels = np.zeros((height, width, 3), dtype=np.uint8)
+    if marker:
+        pixels[:height // 4, :width // 4] = (255, 0, 0)
+    image = Image.fromarray(pixels)
+    exif = Image.Exif()
+    if orientation is not None:
+        exif[0x0112] = orientation
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt, quality=95, exif=exif.tobytes())
+    return buffer.getvalue()
+
+
+def _red_corner(image):
+    """Угол, в котором оказался красный квадрат (BGR)"""
+    h, w = image.shape[:2]
+    corners = {'top_left': image[h // 16, w // 16], 'top_right': image[h // 16, -w // 16],
+               'bottom_left': image[-h // 16, w // 16], 'bottom_right': image[-h // 16, -w // 16]}
+    return next(name for name, pixel in corners.items() if pixel[2] > 200 and pixel[0] < 60)
+
+
+def test_decodes_to_contiguous_bgr():
+    image, scale = decode_image(_encode(64, 32, 'PNG'), reduce_to=0)
+    assert image.shape == (32, 64, 3) and image.dtype == np.uint8
+    assert image.flags['C_CONTIGUOUS']
+    assert scale == 1
+    assert _red_corner(image) == 'top_left'
+
+
+@pytest.mark.parametrize('orientation, shape, corner', [
+    (1, (40, 80, 3), 'top_left'),
+    (3, (40, 80, 3), 'bottom_right'),
+    (6, (80, 40, 3), 'top_right'),
+    (8, (80, 40, 3), 'bottom_left'),
+])
+def test_exif_orientation_is_applied(orientation, shape, corner):
+    image, scale = decode_image(_encode(80, 40, orientation=orientation), reduce_to=0)
+    assert image.shape == shape
+    assert _red_corner(image) == corner
+    assert scale == 1
+
+
+def test_upload_size_limit(monkeypatch):
+    data = _encode(64, 64)
+    monkeypatch.setattr(ingest, 'MAX_UPLOAD_BYTES', len(data) - 1)
+    with pytest.raises(ImageTooLarge):
+        decode_image(data)
+
+
+def test_pixel_limit_is_checked_from_header(monkeypatch):
+    monkeypatch.setattr(ingest, 'MAX_IMAGE_PIXELS', 64 * 64 - 1)
+    monkeypatch.setattr(ingest.cv2, 'imdecode', lambda *args: pytest.fail("пиксели не должны декодироваться"))
+    with pytest.raises(ImageTooLarge) as error:
+        decode_image(_encode(64, 64))
+    assert error.value.status_code == 413
+
+
+def test_garbage_is_rejected():
+    with pytest.raises(ImageRejected) as error:
+        decode_image(b'not an image')
+    assert error.value.status_code == 400
+
+
+def test_jpeg_is_reduced_in_dct_with_scale():
+    image, scale = decode_image(_encode(1600, 800), reduce_to=400)
+    assert image.shape == (200, 400, 3)
+    assert scale == 4
+
+
+def test_png_is_not_reduced():
+    image, scale = decode_image(_encode(1600, 800, 'PNG'), reduce_to=400)
+    assert image.shape == (800, 1600, 3)
+    assert scale == 1
@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+from conftest import StubEnsemble, detection
+
+
+def _arrays(boxes, scores, classes):
+    return (np.array(boxes, dtype=np.float32).reshape(-1, 4), np.array(scores, dtype=np.float32),
+            np.array(classes, dtype=np.int64))
+
+
+def test_nms_keeps_best_box_of_overlapping_pair():
+    boxes, scores, classes = _arrays([[0, 0, 10, 10], [1, 1, 11, 11], [50, 50, 60, 60]], [0.6, 0.9, 0.7], [0, 0, 0])
+    keep = StubEnsemble._nms_indices(boxes, scores, classes, 0.5)
+    assert keep.tolist() == [1, 2]
+
+
+def test_nms_does_not_suppress_other_classes():
+    boxes, scores, classes = _arrays([[0, 0, 10, 10], [0, 0, 10, 10]], [0.9, 0.8], [0, 1])
+    assert StubEnsemble._nms_indices(boxes, scores, classes, 0.5).tolist() == [0, 1]
+
+
+def test_nms_threshold_is_inclusive():
+    # IoU ровно 0.5: бокс 10x10 и его половина
+    boxes, scores, classes = _arrays([[0, 0, 10, 10], [0, 0, 10, 5]], [0.9, 0.8], [0, 0])
+    assert StubEnsemble._nms_indices(boxes, scores, classes, 0.5).tolist() == [0]
+    assert StubEnsemble._nms_indices(boxes, scores, classes, 0.51).tolist() == [0, 1]
+
+
+def test_nms_suppressed_box_does_not_suppress_others():
+    # 1 подавлен 0; 2 пересекается только с 1 и должен остаться
+    boxes, scores, classes = _arrays([[0, 0, 10, 10], [4, 0, 14, 10], [8, 0, 18, 10]], [0.9, 0.8, 0.7], [0, 0, 0])
+    assert StubEnsemble._nms_indices(boxes, scores, classes, 0.3).tolist() == [0, 2]
+
+
+def test_apply_nms_returns_original_detections():
+    ensemble = StubEnsemble()
+    detections = [detection([0, 0, 10, 10], 0.5), detection([0, 0, 10, 10], 0.8, model='b')]
+    assert ensemble._apply_nms(detections) == [detections[1]]
+    assert ensemble._apply_nms([]) == []
+
+
+def test_wbf_fuses_cluster_with_confidence_weighted_box():
+    ensemble = StubEnsemble(weights={'a': 1.0, 'b': 1.0}, merge_mode='wbf')
+    fused = ensemble._apply_wbf([detection([0, 0, 10, 10], 0.75, model='a'),
+                                 detection([2, 0, 12, 10], 0.25, model='b')], 0.5)
+
+    assert len(fused) == 1
+    np.testing.assert_allclose(fused[0]['xyxy'], [0.5, 0, 10.5, 10])
+    assert fused[0]['conf'] == pytest.approx(0.5)
+    assert fused[0]['model'] == 'a+b'
+
+
+def test_wbf_penalizes_clusters_confirmed_by_part_of_ensemble():
+    ensemble = StubEnsemble(weights={'a': 3.0, 'b': 1.0}, merge_mode='wbf')
+    fused = ensemble._apply_wbf([detection([0, 0, 10, 10], 0.8, model='a'),
+                                 detection([50, 50, 60, 60], 0.8, model='b')], 0.5)
+
+    assert [d['model'] for d in fused] == ['a', 'b']
+    assert fused[0]['conf'] == pytest.approx(0.8 * 3 / 4)
+    assert fused[1]['conf'] == pytest.approx(0.8 * 1 / 4)
+
+
+def test_wbf_keeps_classes_apart():
+    ensemble = StubEnsemble(merge_mode='wbf')
+    fused = ensemble._apply_wbf([detection([0, 0, 10, 10], 0.9, cls=0), detection([0, 0, 10, 10], 0.9, cls=2)], 0.5)
+    assert sorted(int(d['cls']) for d in fused) == [0, 2]
+
+
+def test_predict_batch_merges_with_configured_mode():
+    duplicates = [detection([0, 0, 10, 10], 0.9), detection([0, 0, 10, 10], 0.6, model='b')]
+    nms = StubEnsemble(duplicates, weights={'a': 1.0, 'b': 1.0})
+    wbf = StubEnsemble(duplicates, weights={'a': 1.0, 'b': 1.0}, merge_mode='wbf')
+
+    image = np.zeros((32, 32, 3), dtype=np.uint8)
+    assert nms.predict_batch([image])[0][0]['model'] == 'a'
+    assert wbf.predict_batch([image])[0][0]['model'] == 'a+b'
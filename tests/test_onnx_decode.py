@@ -0,0 +1,36 @@
+import numpy as np
+from onnx_ensemble import OnnxEnsemble
+
+
+def _ensemble(max_nms, max_det=300):
+    ensemble = OnnxEnsemble.__new__(OnnxEnsemble)  # Без загрузки моделей
+    ensemble.nms_iou, ensemble.max_det, ensemble.max_nms = 0.7, max_det, max_nms
+    return ensemble
+
+
+def _output(n, nc=2, seed=0):
+    """Выход YOLOv8 (4 + nc, N): n непересекающихся боксов 4x4 на сетке"""
+    rng = np.random.default_rng(seed)
+    cx = (np.arange(n) % 100) * 10 + 5
+    cy = (np.arange(n) // 100) * 10 + 5
+    scores = np.zeros((nc, n), dtype=np.float32)
+    scores[0] = rng.uniform(0.3, 1.0, n)
+    return np.vstack([cx, cy, np.full(n, 4), np.full(n, 4), scores]).astype(np.float32)
+
+
+META = (1.0, (0, 0), (1000, 1000))
+MODEL = {'name': 'a', 'weight': 1.0}
+
+
+def test_decode_keeps_most_confident_candidates_before_nms():
+    output = _output(5000)
+    detections = _ensemble(max_nms=1000)._decode(output, META, 0.25, MODEL)
+
+    expected = np.sort(output[4])[::-1][:300]
+    np.testing.assert_allclose([d['conf'] for d in detections], expected)
+
+
+def test_decode_limits_detections_after_nms():
+    detections = _ensemble(max_nms=3000, max_det=50)._decode(_output(400), META, 0.25, MODEL)
+    assert len(detections) == 50
+    assert all(d['model'] == 'a' and d['cls'] == 0 for d in detections)
@@ -0,0 +1,82 @@
+from result_cache import ResultCache, AnnotatedImageStore
+from conftest import StubEnsemble
+
+KB = 1 / 1024  # max_mb для бюджета в 1 КБ
+
+
+def _result(size, text='x'):
+    return {'defects': [], 'note': text * size}
+
+
+def test_key_depends_on_image_version_threshold_and_options():
+    key = ResultCache.make_key(b'image', 'v1', 0.25)
+    assert key == ResultCache.make_key(b'image', 'v1', 0.25)
+    assert len({
+        key,
+        ResultCache.make_key(b'other', 'v1', 0.25),
+        ResultCache.make_key(b'image', 'v2', 0.25),
+        ResultCache.make_key(b'image', 'v1', 0.5),
+        ResultCache.make_key(b'image', 'v1', 0.25, 'tiled'),
+    }) == 5
+
+
+def test_new_model_weights_change_the_key():
+    ensemble = StubEnsemble()
+    before = ResultCache.make_key(b'image', ensemble.version, 0.25)
+    ensemble.models[0]['mtime'] = 1.0  # Веса перезаписаны
+    assert ResultCache.make_key(b'image', ensemble.version, 0.25) != before
+
+
+def test_get_returns_a_copy():
+    cache = ResultCache(max_mb=1)
+    cache.put('k', {'defects': [1]})
+    cache.get('k')['defects'].append(2)
+    assert cache.get('k') == {'defects': [1]}
+    assert cache.stats()['hits'] == 2
+
+
+def test_least_recently_used_entry_is_evicted_first():
+    cache = ResultCache(max_mb=KB)
+    cache.put('a', _result(400))
+    cache.put('b', _result(400))
+    cache.get('a')  # b становится самым старым
+    cache.put('c', _result(400))
+
+    assert cache.get('b') is None
+    assert cache.get('a') is not None
+    assert cache.get('c') is not None
+    assert cache._size <= cache.max_bytes
+
+
+def test_budget_counts_utf8_bytes():
+    cache = ResultCache(max_mb=KB)
+    cache.put('a', _result(300, 'ж'))  # 600 байт в UTF-8
+    cache.put('b', _result(300, 'ж'))
+    assert cache.get('a') is None
+    assert cache.stats()['entries'] == 1
+
+
+def test_entry_larger_than_budget_is_not_stored():
+    cache = ResultCache(max_mb=KB)
+    cache.put('small', _result(10))
+    cache.put('huge', _result(2000))
+    assert cache.get('huge') is None
+    assert cache.get('small') is not None
+
+
+def test_disk_level_survives_restart(tmp_path):
+    ResultCache(max_mb=1, disk_dir=str(tmp_path)).put('k', {'defects': ['Трещина']})
+    cache = ResultCache(max_mb=1, disk_dir=str(tmp_path))
+    assert cache.get('k') == {'defects': ['Трещина']}
+    assert cache.stats()['disk_hits'] == 1
+    cache.get('k')
+    assert cache.stats()['hits'] == 1
+
+
+def test_annotated_store_respects_byte_budget():
+    store = AnnotatedImageStore(max_mb=KB)
+    store.put('a', b'\xff' * 600)
+    store.put('b', b'\xff' * 600)
+    assert store.get('a') is None
+    assert store.get('b') is not None
+    assert store.stats()['images'] == 1
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+from conftest import StubEnsemble, detection
+
+
+def test_tile_origins_cover_frame_and_clamp_last_tile():
+    origins = StubEnsemble._tile_origins(1000, 1500, 640, 0.2)
+    ys = sorted({y for y, _ in origins})
+    xs = sorted({x for _, x in origins})
+
+    assert ys == [0, 360]
+    assert xs == [0, 512, 860]
+    assert len(origins) == len(ys) * len(xs)
+
+
+def test_tile_origins_for_frame_not_larger_than_tile():
+    assert StubEnsemble._tile_origins(640, 640, 640, 0.2) == [(0, 0)]
+    assert StubEnsemble._tile_origins(300, 500, 640, 0.2) == [(0, 0)]
+
+
+def test_tile_origins_overlap_between_neighbours():
+    tile_size, overlap = 512, 0.25
+    xs = sorted({x for _, x in StubEnsemble._tile_origins(512, 2000, tile_size, overlap)})
+    assert xs[-1] + tile_size == 2000
+    assert all(b - a <= tile_size * (1 - overlap) for a, b in zip(xs, xs[1:]))
+
+
+def test_predict_tiled_shifts_tile_detections_to_frame_coordinates():
+    ensemble = StubEnsemble([detection([10, 10, 20, 20], 0.9)])
+    image = np.random.default_rng(0).integers(0, 255, (1000, 1500, 3), dtype=np.uint8)
+
+    detections = ensemble.predict_tiled(image, tile_size=640, overlap=0.2)
+
+    boxes = sorted(tuple(d['xyxy'].tolist()) for d in detections)
+    # Целый кадр и тайл (0, 0) дают один и тот же бокс — после NMS он один
+    assert boxes[0] == (10, 10, 20, 20)
+    assert (870, 370, 880, 380) in boxes
+    assert len(boxes) == 6
+
+
+def test_predict_tiled_skips_uniform_tiles():
+    ensemble = StubEnsemble()
+    image = np.zeros((1000, 1500, 3), dtype=np.uint8)
+    ensemble.predict_tiled(image, tile_size=640, overlap=0.2)
+    assert ensemble.calls == [(1, 0.25)]  # Только целый кадр
+
+
+def test_predict_tiled_preserves_wbf_confidence():
+    both = [detection([10, 10, 20, 20], 0.9, model='a'), detection([10, 10, 20, 20], 0.9, model='b')]
+    ensemble = StubEnsemble(both, weights={'a': 1.0, 'b': 1.0}, merge_mode='wbf')
+    image = np.random.default_rng(0).integers(0, 255, (1000, 1500, 3), dtype=np.uint8)
+
+    whole = ensemble.predict_batch([image])[0]
+    tiled = ensemble.predict_tiled(image, tile_size=640, overlap=0.2)
+
+    assert whole[0]['conf'] == pytest.approx(0.9)
+    assert all(d['conf'] == pytest.approx(0.9) for d in tiled)
+    assert {d['model'] for d in tiled} == {'a+b'}
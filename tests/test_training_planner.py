@@ -0,0 +1,53 @@
+import pytest
+from training_planner import fit_batch, accumulation, plan_workers, dataset_classes
+
+MB = 1024**2
+GB = 1024**3
+
+
+def _linear(intercept, slope, batches=(1, 2, 4)):
+    return [(batch, intercept + slope * batch) for batch in batches]
+
+
+def test_fit_batch_solves_linear_memory_model():
+    # 500 МБ постоянных + 100 МБ на снимок, бюджет 4 ГБ, состояние оптимизатора 300 МБ
+    batch = fit_batch(_linear(500 * MB, 100 * MB), 4096 * MB, 300 * MB, max_batch=128)
+    assert batch == 32  # (4096 - 300 - 500) / 100 = 32.96 -> кратное 8
+
+
+def test_fit_batch_rounds_to_multiple_of_eight_from_sixteen():
+    assert fit_batch(_linear(0, 100 * MB), 2300 * MB, 0, max_batch=64) == 16  # 23 -> 16
+    assert fit_batch(_linear(0, 100 * MB), 1500 * MB, 0, max_batch=64) == 15  # меньше 16 — без округления
+
+
+def test_fit_batch_respects_limits():
+    assert fit_batch(_linear(0, MB), 100 * GB, 0, max_batch=48) == 48
+    assert fit_batch(_linear(4 * GB, 100 * MB), 2 * GB, 0, max_batch=64) == 1
+
+
+def test_fit_batch_with_partial_measurements():
+    assert fit_batch([(2, 3 * GB)], 8 * GB, 0, max_batch=64) == 2  # Батч 4 не поместился
+    assert fit_batch([], 8 * GB, 0, max_batch=64) == 1
+
+
+@pytest.mark.parametrize('batch, expected', [(64, 1), (32, 2), (16, 4), (24, 3), (10, 6), (1, 64), (128, 1)])
+def test_accumulation_keeps_nominal_batch(batch, expected):
+    assert accumulation(64, batch) == expected
+
+
+def test_workers_are_limited_by_cpu_count():
+    assert plan_workers(cpu_count=8, ram_bytes=64 * GB, worker_ram_mb=1024) == 7
+    assert plan_workers(cpu_count=1, ram_bytes=64 * GB, worker_ram_mb=1024) == 1
+
+
+def test_workers_are_limited_by_host_ram():
+    assert plan_workers(cpu_count=32, ram_bytes=6 * GB, worker_ram_mb=1024) == 6
+    assert plan_workers(cpu_count=32, ram_bytes=512 * MB, worker_ram_mb=1024) == 1
+
+
+def test_dataset_classes_from_data_yaml(tmp_path):
+    data = tmp_path / 'data.yaml'
+    data.write_text("nc: 4\nnames: ['Burn Mark', 'Coating_defects', 'Crack', 'EROSION']\n")
+    assert dataset_classes(str(data)) == 4
+    data.write_text("names:\n  0: a\n  1: b\n")
+    assert dataset_classes(str(data)) == 2